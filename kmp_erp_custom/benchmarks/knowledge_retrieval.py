@@ -0,0 +1,98 @@
+"""
+Benchmark: knowledge-base retrieval vs. injecting every entry into the prompt
+
+Runs on synthetic Thai entries and needs no site or network:
+
+    python -m kmp_erp_custom.benchmarks.knowledge_retrieval
+    bench execute kmp_erp_custom.benchmarks.knowledge_retrieval.run --kwargs "{'sizes': [100, 1000]}"
+"""
+import random
+import statistics
+import time
+
+from kmp_erp_custom.kmp_assistant.knowledge import KnowledgeIndex, format_entries
+
+TOPICS = [
+    ("การลา", "HR", "ยื่นใบลาผ่านระบบ HR ล่วงหน้าอย่างน้อย 3 วัน และแจ้งหัวหน้างาน"),
+    ("เบิกวัตถุดิบ", "Production", "สร้าง Material Request แล้วให้หัวหน้าฝ่ายผลิตอนุมัติ"),
+    ("สต็อกขั้นต่ำ", "Stock", "ตั้งค่า Reorder Level ที่ Item แต่ละตัวเพื่อแจ้งเตือนสต็อกต่ำ"),
+    ("ใบสั่งซื้อ", "Purchasing", "Purchase Order ต้องมีใบเสนอราคาอย่างน้อย 2 ราย"),
+    ("รหัสผ่าน", "IT", "เปลี่ยนรหัสผ่านได้ที่เมนู My Settings ทุก 90 วัน"),
+    ("ตรวจคุณภาพ", "QC", "บันทึก Quality Inspection ก่อนรับสินค้าเข้าคลัง"),
+    ("ส่งสินค้า", "Logistics", "สร้าง Delivery Note จาก Sales Order ที่อนุมัติแล้ว"),
+    ("สูตรตำรับ", "R&D", "แก้ไข BOM ต้องสร้างเวอร์ชันใหม่และ submit"),
+]
+
+
+def make_entries(n: int, seed: int = 42) -> list[dict]:
+    rng = random.Random(seed)
+    entries = []
+    for i in range(n):
+        topic, category, answer = TOPICS[i % len(TOPICS)]
+        code = f"FG-{rng.randint(1, 999):03d}"
+        entries.append({
+            "name": i + 1,
+            "question": f"ขั้นตอน{topic}สำหรับ {code} ทำอย่างไร",
+            "answer": f"{answer} (อ้างอิง {code} ข้อ {i + 1})",
+            "category": category,
+        })
+    return entries
+
+
+def estimate_tokens(text: str) -> int:
+    try:
+        import tiktoken
+
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except Exception:
+        # Thai averages roughly one token per 1.5 characters with GPT tokenizers
+        return int(len(text) / 1.5)
+
+
+def _time_ms(fn, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def run(sizes=(50, 300, 1000, 5000), top_k: int = 5, repeat: int = 50) -> list[dict]:
+    results = []
+    for size in sizes:
+        entries = make_entries(size)
+        queries = [f"ขั้นตอน{t[0]}ต้องทำยังไง" for t in TOPICS]
+
+        start = time.perf_counter()
+        index = KnowledgeIndex()
+        for e in entries:
+            index.add(e)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        full_prompt = format_entries(entries)
+        full_ms = _time_ms(lambda: format_entries(entries), repeat)
+
+        retrieved_prompts = [format_entries(index.search(q, top_k)) for q in queries]
+        query_cycle = iter(queries * repeat)
+        retrieval_ms = _time_ms(lambda: format_entries(index.search(next(query_cycle), top_k)), repeat)
+
+        row = {
+            "entries": size,
+            "index_build_ms": round(build_ms, 2),
+            "all_tokens": estimate_tokens(full_prompt),
+            "topk_tokens": max(estimate_tokens(p) for p in retrieved_prompts),
+            "all_build_ms_p50": round(statistics.median(full_ms), 3),
+            "topk_build_ms_p50": round(statistics.median(retrieval_ms), 3),
+        }
+        results.append(row)
+        print(
+            f"{size:>6} entries | prompt tokens: all={row['all_tokens']:>8} top{top_k}={row['topk_tokens']:>5}"
+            f" | build p50: all={row['all_build_ms_p50']}ms top{top_k}={row['topk_build_ms_p50']}ms"
+            f" | index build {row['index_build_ms']}ms"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    run()
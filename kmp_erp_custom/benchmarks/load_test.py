@@ -0,0 +1,237 @@
+"""
+Load test for the chat pipeline against the mock LLM server
+
+Simulates ``users`` concurrent users, each sending ``turns`` messages in
+its own session through ``api.chat``, and reports requests per second,
+latency percentiles, DB queries per turn and worker memory. Results can
+be saved as a baseline and later runs compared against it.
+
+1. Seed the site (see ``seed.py``) and point it at the mock server:
+       "openai_api_key": "mock", "openai_base_url": "http://127.0.0.1:8765/v1"
+2. Start the mock, or pass ``start_mock=1`` to run it in-process:
+       python -m kmp_erp_custom.benchmarks.mock_llm --latency-ms 800
+3. Run:
+       bench --site bench.local execute kmp_erp_custom.benchmarks.load_test.run \\
+           --kwargs "{'users': 20, 'turns': 5, 'save_baseline': 1}"
+
+Users run on threads with their own site context and DB connection, so
+the process plays the role of one worker. DB queries are counted on the
+users' connections; set ``kmp_assistant_tool_workers`` to 1 to include
+tool queries too (parallel tool calls use connections of their own).
+"""
+import json
+import os
+import resource
+import threading
+import time
+from urllib.parse import urlparse
+
+import frappe
+import psutil
+
+from kmp_erp_custom.benchmarks import mock_llm
+from kmp_erp_custom.kmp_assistant.telemetry import count_queries
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+DEFAULT_TOLERANCE = 0.1
+
+# metric path -> True when higher is better
+COMPARED_METRICS = {
+    ("rps",): True,
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p95"): False,
+    ("latency_ms", "p99"): False,
+    ("db_queries_per_turn", "avg"): False,
+    ("rss_mb", "peak"): False,
+}
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return round(values[lo] + (values[hi] - values[lo]) * (k - lo), 1)
+
+
+def _rss_mb() -> float:
+    return round(psutil.Process().memory_info().rss / 2**20, 1)
+
+
+def _user_loop(site, sites_path, user, scenarios, index, turns, stream, unique, run_id, results):
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        frappe.connect()
+        frappe.set_user(user)
+        from kmp_erp_custom.kmp_assistant import api
+
+        session_id = None
+        for turn in range(turns):
+            scenario = scenarios[(index + turn) % len(scenarios)]
+            message = scenario["question"]
+            if unique:
+                message += f" ({run_id}-u{index}-t{turn})"
+            started = time.perf_counter()
+            error = None
+            with count_queries() as db_stats:
+                try:
+                    session_id = api.chat(message, session_id=session_id, stream=stream)["session_id"]
+                except Exception as e:
+                    error = str(e)
+                    frappe.db.rollback()
+            results.append({
+                "latency_ms": (time.perf_counter() - started) * 1000,
+                "db_queries": db_stats["db_queries"],
+                "error": error,
+            })
+    finally:
+        frappe.destroy()
+
+
+def _start_mock(latency_ms: float):
+    url = urlparse(frappe.conf.get("openai_base_url") or "http://127.0.0.1:8765/v1")
+    server = mock_llm.serve(url.port or 80, latency_ms=latency_ms, host=url.hostname)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(
+    users: int = 10,
+    turns: int = 5,
+    scenario: str = None,
+    stream: int = 0,
+    unique: int = 1,
+    user: str = "Administrator",
+    start_mock: int = 0,
+    mock_latency_ms: float = 800,
+    name: str = None,
+    save_baseline: int = 0,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> dict:
+    """Run the load test; ``unique=0`` repeats questions verbatim (exercises the answer cache)"""
+    users, turns = int(users), int(turns)
+    all_scenarios = mock_llm.load_scenarios()
+    names = [scenario] if scenario else list(all_scenarios)
+    scenarios = [all_scenarios[n] for n in names]
+    name = name or f"{scenario or 'mixed'}-{users}u"
+
+    server = _start_mock(mock_latency_ms) if int(start_mock) else None
+    site, sites_path = frappe.local.site, frappe.local.sites_path
+    run_id = frappe.generate_hash(length=6)
+    results = []
+    rss_start = _rss_mb()
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=_user_loop,
+            args=(site, sites_path, user, scenarios, i, turns, int(stream), int(unique), run_id, results),
+        )
+        for i in range(users)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall_s = time.perf_counter() - started
+    if server:
+        server.shutdown()
+
+    ok = [r for r in results if not r["error"]]
+    latencies = [r["latency_ms"] for r in ok]
+    queries = [r["db_queries"] for r in ok]
+    report = {
+        "name": name,
+        "scenarios": names,
+        "users": users,
+        "turns": turns,
+        "stream": int(stream),
+        "total_turns": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": round(wall_s, 2),
+        "rps": round(len(ok) / wall_s, 2) if wall_s else 0,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": round(max(latencies), 1) if latencies else 0,
+        },
+        "db_queries_per_turn": {
+            "avg": round(sum(queries) / len(queries), 1) if queries else 0,
+            "p95": _percentile(queries, 95),
+        },
+        "rss_mb": {
+            "start": rss_start,
+            "end": _rss_mb(),
+            # ru_maxrss is in KiB on Linux
+            "peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+    if report["errors"]:
+        report["first_error"] = next(r["error"] for r in results if r["error"])
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    comparison = compare(report, load_baseline(name), tolerance)
+    if int(save_baseline):
+        path = save(report)
+        print(f"baseline saved to {path}")
+    report["comparison"] = comparison
+    return report
+
+
+# ---------------------------------------------------------------------------
+# Baselines
+# ---------------------------------------------------------------------------
+
+def _baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def load_baseline(name: str) -> dict | None:
+    path = _baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(report: dict) -> str:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = _baseline_path(report["name"])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in report.items() if k != "comparison"}, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    return path
+
+
+def compare(report: dict, baseline: dict | None, tolerance: float = DEFAULT_TOLERANCE) -> list[dict]:
+    """Metric-by-metric change against ``baseline``; changes for the worse
+    beyond ``tolerance`` (a fraction) are flagged as regressions"""
+    if not baseline:
+        print(f"no baseline for {report['name']}")
+        return []
+
+    def get(data, path):
+        for key in path:
+            data = (data or {}).get(key)
+        return data or 0
+
+    rows = []
+    for path, higher_is_better in COMPARED_METRICS.items():
+        current, previous = get(report, path), get(baseline, path)
+        change = (current - previous) / previous if previous else 0
+        worse = -change if higher_is_better else change
+        rows.append({
+            "metric": ".".join(path),
+            "baseline": previous,
+            "current": current,
+            "change_pct": round(change * 100, 1),
+            "regression": worse > float(tolerance),
+        })
+
+    print(f"\n{'metric':<26}{'baseline':>12}{'current':>12}{'change':>10}")
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['metric']:<26}{r['baseline']:>12}{r['current']:>12}{r['change_pct']:>9}%{flag}")
+    return rows
@@ -0,0 +1,95 @@
+"""
+Benchmark marketplace order ingestion against the mock marketplace APIs
+
+Starts benchmarks/mock_marketplace.py on a thread, points the marketplace's
+``kmp_marketplace`` settings at it for this process only and ingests from an
+empty cursor, reporting orders per second. With ``interrupt_after_pages``
+the first run stops early and a second run resumes from the saved cursor;
+either way the Imported rows must match the orders the mock marks as
+importable. Needs a site seeded with benchmarks/seed.py (SKUs are seeded Item
+codes; orders go to the first seeded Customer and warehouse), and replaces
+that marketplace's cursor, so use a benchmark site.
+
+    bench --site bench.local execute kmp_erp_custom.benchmarks.marketplace_ingest.run \\
+        --kwargs "{'orders': 5000, 'marketplace': 'Lazada', 'interrupt_after_pages': 10}"
+    bench --site bench.local execute kmp_erp_custom.benchmarks.marketplace_ingest.purge
+"""
+import threading
+
+import frappe
+
+from kmp_erp_custom.benchmarks import mock_marketplace
+from kmp_erp_custom.benchmarks.seed import PREFIX
+from kmp_erp_custom.kmp_integration import marketplace as ingestion
+
+
+def _settings(marketplace: str, port: int, days: float) -> dict:
+    api_base = f"http://127.0.0.1:{port}" + ("/rest" if marketplace == "Lazada" else "")
+    warehouse = frappe.db.get_value("Warehouse", {"name": ["like", f"{PREFIX}WH 1 - %"]}, "name")
+    customer = frappe.db.get_value("Customer", {"name": ["like", f"{PREFIX}CUST-%"]}, "name")
+    if not (warehouse and customer):
+        frappe.throw("Seed the site with benchmarks/seed.py first")
+    return {
+        "api_base": api_base,
+        "partner_id": 1,
+        "partner_key": "mock",
+        "shop_id": 1,
+        "app_key": "mock",
+        "app_secret": "mock",
+        "access_token": "mock",
+        "customer": customer,
+        "warehouse": warehouse,
+        "initial_days": int(days) + 1,
+    }
+
+
+def run(
+    orders: int = 2000,
+    marketplace: str = "Shopee",
+    items: int = 1000,
+    days: float = 2,
+    latency_ms: float = 20,
+    fail_rate: float = 0.0,
+    interrupt_after_pages: int = 0,
+    port: int = 8767,
+):
+    marketplace = marketplace.title()
+    server = mock_marketplace.serve(port, orders, items, days, latency_ms, fail_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    frappe.conf["kmp_marketplace"] = {marketplace.lower(): _settings(marketplace, port, days)}
+    purge(marketplace)
+
+    try:
+        runs = []
+        if interrupt_after_pages:
+            runs.append(ingestion.ingest(marketplace, max_pages=interrupt_after_pages))
+        runs.append(ingestion.ingest(marketplace))
+    finally:
+        server.shutdown()
+
+    for i, stats in enumerate(runs, 1):
+        print(f"run {i}: {stats['pages']} pages, {stats['orders']} orders, {stats['created']} created, "
+              f"{stats['duplicates']} duplicates, {stats['failed']} failed in {stats['seconds']}s "
+              f"= {stats['orders_per_sec']} orders/s")
+
+    imported = frappe.db.count(ingestion.ORDER_DOCTYPE, {"marketplace": marketplace, "status": "Imported"})
+    expected = server.store.importable
+    print(f"{imported} orders imported, {expected} expected, {server.store.requests} API requests "
+          f"{'OK' if imported == expected else 'MISMATCH'}")
+
+
+def purge(marketplace: str = None):
+    """Delete the mock orders, their Sales Orders and the cursor"""
+    filters = {"order_id": ["like", f"{mock_marketplace.ORDER_PREFIX}%"]}
+    if marketplace:
+        filters["marketplace"] = marketplace.title()
+    sales_orders = frappe.get_all(ingestion.ORDER_DOCTYPE, filters={**filters, "sales_order": ["is", "set"]},
+                                  pluck="sales_order")
+    for i in range(0, len(sales_orders), 1000):
+        chunk = sales_orders[i:i + 1000]
+        for child in ("Sales Order Item", "Sales Taxes and Charges", "Payment Schedule"):
+            frappe.db.delete(child, {"parenttype": "Sales Order", "parent": ["in", chunk]})
+        frappe.db.delete("Sales Order", {"name": ["in", chunk]})
+    frappe.db.delete(ingestion.ORDER_DOCTYPE, filters)
+    frappe.db.delete(ingestion.CURSOR_DOCTYPE, {"marketplace": marketplace.title()} if marketplace else {})
+    frappe.db.commit()
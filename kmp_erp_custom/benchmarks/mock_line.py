@@ -0,0 +1,160 @@
+"""
+Mock LINE Messaging API push endpoint for testing the notification outbox
+
+Accepts ``POST /v2/bot/message/push`` like the real API: at most 5 text
+messages per request, 429 beyond ``--rate-limit`` requests per second, and
+409 for a repeated ``X-Line-Retry-Key`` that was already accepted. A share
+of requests can be failed with 500 to exercise retries. ``GET /stats``
+returns what was received.
+
+    python -m kmp_erp_custom.benchmarks.mock_line --port 8766 --fail-rate 0.05
+
+and in the site's config:
+
+    "kmp_line_channel_access_token": "mock",
+    "kmp_line_api_base": "http://127.0.0.1:8766"
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PUSH_PATH = "/v2/bot/message/push"
+
+
+class Recorder:
+    def __init__(self, rate_limit: float):
+        self.lock = threading.Lock()
+        self.rate_limit = rate_limit
+        self.tokens = rate_limit
+        self.updated = time.monotonic()
+        self.accepted_keys = set()
+        self.stats = Counter()
+        self.by_recipient = Counter()
+
+    def allow(self) -> bool:
+        """Server-side token bucket, one second of burst"""
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.updated) * self.rate_limit)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {**self.stats, "recipients": len(self.by_recipient)}
+
+
+def make_handler(recorder: Recorder, latency_ms: float, fail_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send_json(200, recorder.snapshot())
+            else:
+                self._send_json(404, {"message": "Not found"})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path.rstrip("/") != PUSH_PATH:
+                self._send_json(404, {"message": "Not found"})
+                return
+            time.sleep(latency_ms / 1000)
+            with recorder.lock:
+                recorder.stats["requests"] += 1
+
+            if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+                self._send_json(401, {"message": "Authentication failed"})
+                return
+            if not recorder.allow():
+                with recorder.lock:
+                    recorder.stats["rate_limited"] += 1
+                self._send_json(429, {"message": "The API rate limit has been exceeded. Try again later."})
+                return
+
+            request = json.loads(body or b"{}")
+            messages = request.get("messages") or []
+            if not request.get("to") or not 1 <= len(messages) <= 5:
+                with recorder.lock:
+                    recorder.stats["invalid"] += 1
+                self._send_json(400, {"message": "The request body has 1 error(s)"})
+                return
+
+            retry_key = self.headers.get("X-Line-Retry-Key")
+            with recorder.lock:
+                if retry_key and retry_key in recorder.accepted_keys:
+                    recorder.stats["duplicates"] += 1
+                    duplicate = True
+                else:
+                    duplicate = False
+            if duplicate:
+                self._send_json(409, {"message": "The retry key is already accepted"})
+                return
+            if random.random() < fail_rate:
+                with recorder.lock:
+                    recorder.stats["failed"] += 1
+                self._send_json(500, {"message": "Internal error (mock)"})
+                return
+
+            with recorder.lock:
+                if retry_key:
+                    recorder.accepted_keys.add(retry_key)
+                recorder.stats["accepted"] += 1
+                recorder.stats["messages"] += len(messages)
+                recorder.stats["notifications"] += sum(m.get("text", "").count("\n\n") + 1 for m in messages)
+                recorder.by_recipient[request["to"]] += 1
+            self._send_json(200, {"sentMessages": [{"id": str(i)} for i in range(len(messages))]})
+
+    return Handler
+
+
+def serve(port: int = 8766, latency_ms: float = 30, fail_rate: float = 0.0, rate_limit: float = 0,
+          host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Build the server; call ``serve_forever`` on it (or run it in a thread).
+    ``server.recorder`` holds what it received."""
+    recorder = Recorder(rate_limit)
+    server = ThreadingHTTPServer((host, port), make_handler(recorder, latency_ms, fail_rate))
+    server.daemon_threads = True
+    server.recorder = recorder
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=0, help="requests per second before 429 (0: none)")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms, args.fail_rate, args.rate_limit, args.host)
+    print(f"mock LINE API on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
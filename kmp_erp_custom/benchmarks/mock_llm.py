@@ -0,0 +1,160 @@
+"""
+Mock OpenAI-compatible chat completions server for offline benchmarks
+
+Replays the scripted tool-call sequences in ``scenarios.json``. The server
+is stateless: the scenario is the one whose ``question`` the last user
+message starts with, and the step is the number of assistant messages
+sent after that user message, so any number of concurrent conversations
+can be replayed. Both plain and streamed (SSE) responses are supported.
+
+    python -m kmp_erp_custom.benchmarks.mock_llm --port 8765 --latency-ms 800
+
+and in the benchmark site's config:
+
+    "openai_api_key": "mock",
+    "openai_base_url": "http://127.0.0.1:8765/v1"
+"""
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCENARIOS_PATH = os.path.join(os.path.dirname(__file__), "scenarios.json")
+FALLBACK_CONTENT = "ไม่พบสคริปต์สำหรับคำถามนี้ (mock)"
+
+
+def load_scenarios(path: str = None) -> dict:
+    with open(path or SCENARIOS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value, ensure_ascii=False)) // 3)
+
+
+def pick_step(scenarios: dict, messages: list) -> dict:
+    last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+    question = (messages[last_user].get("content") or "") if last_user >= 0 else ""
+    step = sum(1 for m in messages[last_user + 1:] if m.get("role") == "assistant")
+    for scenario in scenarios.values():
+        if question.startswith(scenario["question"]):
+            steps = scenario["steps"]
+            return steps[min(step, len(steps) - 1)]
+    return {"content": FALLBACK_CONTENT}
+
+
+def _tool_calls(step: dict) -> list[dict]:
+    return [
+        {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments") or {}, ensure_ascii=False)},
+        }
+        for call in step.get("tool_calls") or []
+    ]
+
+
+def make_handler(scenarios: dict, latency_ms: float, jitter_ms: float, chunk_delay_ms: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            step = pick_step(scenarios, request.get("messages") or [])
+            time.sleep(max(0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+            tool_calls = _tool_calls(step)
+            content = None if tool_calls else step.get("content", "")
+            usage = {
+                "prompt_tokens": _estimate_tokens(request.get("messages")),
+                "completion_tokens": _estimate_tokens(tool_calls or content),
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            meta = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": request.get("model")}
+
+            if request.get("stream"):
+                self._stream(meta, content, tool_calls, usage)
+                return
+
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            self._send_json(200, {
+                **meta,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+                "usage": usage,
+            })
+
+        def _stream(self, meta: dict, content, tool_calls: list, usage: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def send(choices, **extra):
+                chunk = {**meta, "object": "chat.completion.chunk", "choices": choices, **extra}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+
+            if tool_calls:
+                for i, call in enumerate(tool_calls):
+                    send([{"index": 0, "delta": {"tool_calls": [{**call, "index": i}]}, "finish_reason": None}])
+            else:
+                for start in range(0, len(content), 8):
+                    send([{"index": 0, "delta": {"content": content[start:start + 8]}, "finish_reason": None}])
+                    time.sleep(chunk_delay_ms / 1000)
+            send([{"index": 0, "delta": {}, "finish_reason": "tool_calls" if tool_calls else "stop"}])
+            send([], usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(port: int = 8765, latency_ms: float = 800, jitter_ms: float = 200, chunk_delay_ms: float = 20,
+          scenarios_path: str = None, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Build the server; call ``serve_forever`` on it (or run it in a thread)"""
+    handler = make_handler(load_scenarios(scenarios_path), latency_ms, jitter_ms, chunk_delay_ms)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800, help="time to first byte per completion")
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--chunk-delay-ms", type=float, default=20, help="delay between streamed chunks")
+    parser.add_argument("--scenarios", help="scenario file (default: scenarios.json next to this module)")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms, args.jitter_ms, args.chunk_delay_ms, args.scenarios, args.host)
+    print(f"mock OpenAI server on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
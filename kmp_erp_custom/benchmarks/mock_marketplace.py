@@ -0,0 +1,226 @@
+"""
+Mock Shopee and Lazada order APIs for testing marketplace ingestion
+
+Serves a fixed, seeded set of orders through the endpoints
+kmp_integration/marketplace.py reads: Shopee's ``get_order_list`` /
+``get_order_detail`` under ``/api/v2/order/`` and Lazada's ``/orders/get``
+/ ``/orders/items/get`` under ``/rest``. Orders are spread over the last
+``--days`` days, their SKUs are the Item codes benchmarks/seed.py creates,
+and a share of them are unpaid or cancelled (not to be imported) or carry an
+unknown SKU (to be recorded as Failed). Signatures are required but not
+checked.
+
+    python -m kmp_erp_custom.benchmarks.mock_marketplace --port 8767 --orders 5000
+
+and in the site's config, ``"api_base": "http://127.0.0.1:8767"`` for Shopee
+or ``"http://127.0.0.1:8767/rest"`` for Lazada under ``kmp_marketplace``.
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ORDER_PREFIX = "BENCH"
+SHOPEE_WINDOW = 15 * 24 * 60 * 60
+LAZADA_TZ = timezone(timedelta(hours=7))
+SKIPPED_SHARE = 0.05
+UNKNOWN_SKU_SHARE = 0.01
+
+
+def _item_code(i: int) -> str:
+    # Same codes as benchmarks/seed.py
+    return f"BENCH-ITEM-{i:05d}" if i % 2 else f"BENCH-FG-{i:05d}"
+
+
+def make_orders(count: int, items: int, days: float, random_seed: int = 42) -> list[dict]:
+    """Orders sorted by update time: ``{order_id, created, updated, buyer,
+    skipped, lines: [(sku, qty, price)]}``, times in epoch seconds"""
+    rng = random.Random(random_seed)
+    now = int(time.time())
+    span = int(days * 24 * 60 * 60)
+    orders = []
+    for i in range(1, count + 1):
+        updated = now - span + span * i // (count + 1)
+        lines = [
+            (_item_code(rng.randint(1, items)), rng.randint(1, 3), round(rng.uniform(59, 1990), 2))
+            for _ in range(rng.randint(1, 4))
+        ]
+        if rng.random() < UNKNOWN_SKU_SHARE:
+            lines[0] = ("NO-SUCH-SKU", 1, 99.0)
+        orders.append({
+            "order_id": f"{ORDER_PREFIX}{i:09d}",
+            "created": updated - rng.randint(0, 3600),
+            "updated": updated,
+            "buyer": f"buyer{rng.randint(1, count // 3 + 1)}",
+            "skipped": rng.random() < SKIPPED_SHARE,
+            "lines": lines,
+        })
+    return orders
+
+
+def _lazada_time(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, LAZADA_TZ).strftime("%Y-%m-%d %H:%M:%S %z")
+
+
+class Store:
+    def __init__(self, orders: list[dict]):
+        self.orders = orders
+        self.by_id = {o["order_id"]: o for o in orders}
+        self.requests = 0
+
+    @property
+    def importable(self) -> int:
+        return sum(1 for o in self.orders if not o["skipped"] and o["lines"][0][0] != "NO-SUCH-SKU")
+
+    # Shopee ---------------------------------------------------------------
+
+    def shopee_list(self, q: dict) -> dict:
+        time_from, time_to = int(q["time_from"]), int(q["time_to"])
+        if time_to - time_from > SHOPEE_WINDOW:
+            return {"error": "error_param", "message": "time range exceeds 15 days"}
+        page_size, offset = min(int(q.get("page_size") or 20), 100), int(q.get("cursor") or 0)
+        matching = [o for o in self.orders if time_from <= o["updated"] <= time_to]
+        page = matching[offset:offset + page_size]
+        more = offset + page_size < len(matching)
+        return {"error": "", "message": "", "response": {
+            "more": more,
+            "next_cursor": str(offset + page_size) if more else "",
+            "order_list": [{"order_sn": o["order_id"]} for o in page],
+        }}
+
+    def shopee_detail(self, q: dict) -> dict:
+        order_sns = q["order_sn_list"].split(",")
+        if len(order_sns) > 50:
+            return {"error": "error_param", "message": "order_sn_list is limited to 50"}
+        return {"error": "", "message": "", "response": {"order_list": [
+            {
+                "order_sn": o["order_id"],
+                "order_status": "UNPAID" if o["skipped"] else "READY_TO_SHIP",
+                "create_time": o["created"],
+                "update_time": o["updated"],
+                "buyer_username": o["buyer"],
+                "total_amount": round(sum(qty * price for _sku, qty, price in o["lines"]), 2),
+                "item_list": [
+                    {"item_sku": sku, "model_sku": "", "model_quantity_purchased": qty,
+                     "model_discounted_price": price}
+                    for sku, qty, price in o["lines"]
+                ],
+            }
+            for o in map(self.by_id.get, order_sns) if o
+        ]}}
+
+    # Lazada ---------------------------------------------------------------
+
+    def lazada_list(self, q: dict) -> dict:
+        after = datetime.fromisoformat(q["update_after"]).timestamp()
+        offset, limit = int(q.get("offset") or 0), min(int(q.get("limit") or 10), 100)
+        matching = [o for o in self.orders if o["updated"] >= after]
+        return {"code": "0", "data": {"count": len(matching), "orders": [
+            {
+                "order_id": o["order_id"],
+                "created_at": _lazada_time(o["created"]),
+                "updated_at": _lazada_time(o["updated"]),
+                "customer_first_name": o["buyer"],
+                "customer_last_name": "",
+                "price": f"{sum(qty * price for _sku, qty, price in o['lines']):.2f}",
+                "statuses": ["canceled" if o["skipped"] else "pending"],
+            }
+            for o in matching[offset:offset + limit]
+        ]}}
+
+    def lazada_items(self, q: dict) -> dict:
+        order_ids = json.loads(q["order_ids"])
+        if len(order_ids) > 50:
+            return {"code": "InvalidParameter", "message": "order_ids is limited to 50"}
+        return {"code": "0", "data": [
+            {
+                "order_id": o["order_id"],
+                "order_items": [
+                    {"sku": sku, "item_price": price, "paid_price": price}
+                    for sku, qty, price in o["lines"] for _unit in range(qty)
+                ],
+            }
+            for o in map(self.by_id.get, order_ids) if o
+        ]}
+
+
+ROUTES = {
+    "/api/v2/order/get_order_list": Store.shopee_list,
+    "/api/v2/order/get_order_detail": Store.shopee_detail,
+    "/rest/orders/get": Store.lazada_list,
+    "/rest/orders/items/get": Store.lazada_items,
+}
+
+
+def make_handler(store: Store, latency_ms: float, fail_rate: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            route = ROUTES.get(url.path.rstrip("/"))
+            if not route:
+                self._send_json(404, {"message": "Not found"})
+                return
+            time.sleep(latency_ms / 1000)
+            store.requests += 1
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if not query.get("sign"):
+                self._send_json(403, {"error": "error_sign", "code": "IncompleteSignature", "message": "no sign"})
+            elif random.random() < fail_rate:
+                self._send_json(500, {"message": "Internal error (mock)"})
+            else:
+                self._send_json(200, route(store, query))
+
+    return Handler
+
+
+def serve(port: int = 8767, orders: int = 2000, items: int = 1000, days: float = 2, latency_ms: float = 20,
+          fail_rate: float = 0.0, random_seed: int = 42, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Build the server; call ``serve_forever`` on it (or run it in a thread).
+    ``server.store`` holds the orders served."""
+    store = Store(make_orders(orders, items, days, random_seed))
+    server = ThreadingHTTPServer((host, port), make_handler(store, latency_ms, fail_rate))
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--items", type=int, default=1000, help="seeded Items to draw SKUs from")
+    parser.add_argument("--days", type=float, default=2, help="spread orders over this many past days")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    server = serve(args.port, args.orders, args.items, args.days, args.latency_ms, args.fail_rate, args.seed,
+                   args.host)
+    print(f"mock marketplace APIs on http://{args.host}:{args.port} "
+          f"({args.orders} orders, {server.store.importable} importable)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Seed a benchmark site with synthetic Items, Bins, BOMs and Sales Orders
+
+Rows are written with bulk inserts (no controllers, no stock ledger), so
+the data is only fit for read benchmarks. Every record is named with the
+``BENCH-`` prefix and ``purge`` removes them again (the ten ``BENCH-``
+warehouses are kept for the next run). Needs a site with
+ERPNext set up (a Company, and the default item/customer groups).
+
+    bench --site bench.local execute kmp_erp_custom.benchmarks.seed.seed --kwargs "{'scale': '100k'}"
+    bench --site bench.local execute kmp_erp_custom.benchmarks.seed.purge
+
+For a scale of ``n`` rows: n Bins (n/10 Items x 10 warehouses) with a
+reorder level each, n/100 BOMs with 10 items each, n/100 Customers and n/10
+Sales Orders with 3 items.
+"""
+import random
+import time
+
+import frappe
+from frappe.utils import add_days, nowdate
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+WAREHOUSES = 10
+CHUNK_SIZE = 10_000
+PREFIX = "BENCH-"
+
+WORDS = ["สมุนไพร", "ครีม", "เซรั่ม", "สบู่", "แชมพู", "โลชั่น", "ขมิ้น", "ว่านหางจระเข้", "มะขาม", "ชาเขียว"]
+
+# DocTypes seeded, child tables first so purge removes them before parents
+PURGE_ORDER = [
+    ("Sales Order Item", "parent"),
+    ("Sales Order", "name"),
+    ("BOM Item", "parent"),
+    ("BOM", "name"),
+    ("Item Reorder", "parent"),
+    ("Bin", "item_code"),
+    ("Customer", "name"),
+    ("Item", "name"),
+]
+
+
+def _insert(doctype: str, rows):
+    """Bulk insert dict rows in chunks, keeping only columns the table has"""
+    columns = set(frappe.db.get_table_columns(doctype))
+    now = frappe.utils.now()
+    user = frappe.session.user
+    chunk = []
+
+    def flush():
+        if not chunk:
+            return
+        fields = [f for f in chunk[0] if f in columns]
+        frappe.db.bulk_insert(doctype, fields, [tuple(r[f] for f in fields) for r in chunk])
+        frappe.db.commit()
+        chunk.clear()
+
+    for row in rows:
+        row.setdefault("creation", now)
+        row.setdefault("modified", now)
+        row.setdefault("owner", user)
+        row.setdefault("modified_by", user)
+        row.setdefault("docstatus", 0)
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            flush()
+    flush()
+
+
+def _item_code(i: int) -> str:
+    return f"{PREFIX}ITEM-{i:05d}" if i % 2 else f"{PREFIX}FG-{i:05d}"
+
+
+def _prerequisites() -> frappe._dict:
+    company = frappe.defaults.get_global_default("company") or frappe.db.get_value("Company", {}, "name")
+    if not company:
+        frappe.throw("Set up a Company on the benchmark site first")
+    abbr = frappe.db.get_value("Company", company, "abbr")
+    currency = frappe.db.get_value("Company", company, "default_currency")
+
+    warehouses = []
+    for i in range(1, WAREHOUSES + 1):
+        name = f"{PREFIX}WH {i} - {abbr}"
+        if not frappe.db.exists("Warehouse", name):
+            frappe.get_doc({
+                "doctype": "Warehouse",
+                "warehouse_name": f"{PREFIX}WH {i}",
+                "company": company,
+            }).insert(ignore_permissions=True)
+        warehouses.append(name)
+    frappe.db.commit()
+
+    return frappe._dict(
+        company=company,
+        currency=currency,
+        warehouses=warehouses,
+        item_group=frappe.db.get_value("Item Group", {"is_group": 0}, "name") or "All Item Groups",
+        customer_group=frappe.db.get_value("Customer Group", {"is_group": 0}, "name") or "All Customer Groups",
+        territory=frappe.db.get_value("Territory", {"is_group": 0}, "name") or "All Territories",
+    )
+
+
+def seed(scale: str = "10k", random_seed: int = 42):
+    n = SCALES[scale.lower()] if isinstance(scale, str) else int(scale)
+    rng = random.Random(random_seed)
+    ctx = _prerequisites()
+    n_items, n_boms, n_customers, n_orders = max(n // WAREHOUSES, 100), max(n // 100, 10), max(n // 100, 10), max(n // 10, 100)
+    started = time.perf_counter()
+
+    _insert("Item", ({
+        "name": _item_code(i),
+        "item_code": _item_code(i),
+        "item_name": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+        "item_group": ctx.item_group,
+        "stock_uom": "Nos",
+        "is_stock_item": 1,
+        "include_item_in_manufacturing": 1,
+        "description": f"สินค้าทดสอบ {i}",
+    } for i in range(1, n_items + 1)))
+
+    _insert("Bin", ({
+        "name": f"{PREFIX}BIN-{i:05d}-{w}",
+        "item_code": _item_code(i),
+        "warehouse": warehouse,
+        "stock_uom": "Nos",
+        "actual_qty": (qty := rng.randint(0, 5000)),
+        "reserved_qty": rng.randint(0, 100),
+        "ordered_qty": rng.randint(0, 500),
+        "projected_qty": qty,
+    } for i in range(1, n_items + 1) for w, warehouse in enumerate(ctx.warehouses)))
+
+    _insert("Item Reorder", ({
+        "name": f"{PREFIX}IR-{i:05d}-{w}",
+        "parent": _item_code(i),
+        "parenttype": "Item",
+        "parentfield": "reorder_levels",
+        "idx": w + 1,
+        "warehouse": warehouse,
+        "warehouse_reorder_level": rng.randint(0, 1000),
+        "warehouse_reorder_qty": rng.randint(100, 2000),
+        "material_request_type": "Purchase",
+    } for i in range(1, n_items + 1) for w, warehouse in enumerate(ctx.warehouses)))
+
+    def bom_items(b):
+        for idx in range(1, 11):
+            code = _item_code(rng.randrange(1, n_items + 1, 2) if n_items > 2 else 1)
+            qty, rate = round(rng.uniform(0.01, 5), 3), round(rng.uniform(10, 2000), 2)
+            yield {
+                "name": f"{PREFIX}BOMI-{b:05d}-{idx}",
+                "parent": f"{PREFIX}BOM-{b:05d}",
+                "parenttype": "BOM",
+                "parentfield": "items",
+                "idx": idx,
+                "docstatus": 1,
+                "item_code": code,
+                "item_name": code,
+                "qty": qty,
+                "stock_qty": qty,
+                "uom": "Nos",
+                "stock_uom": "Nos",
+                "conversion_factor": 1,
+                "rate": rate,
+                "amount": round(qty * rate, 2),
+            }
+
+    _insert("BOM Item", (row for b in range(1, n_boms + 1) for row in bom_items(b)))
+    _insert("BOM", ({
+        "name": f"{PREFIX}BOM-{b:05d}",
+        "item": _item_code(2 * b),
+        "item_name": _item_code(2 * b),
+        "company": ctx.company,
+        "currency": ctx.currency,
+        "uom": "Nos",
+        "quantity": 1,
+        "total_cost": round(rng.uniform(100, 20000), 2),
+        "is_active": 1,
+        "is_default": 1,
+        "docstatus": 1,
+    } for b in range(1, n_boms + 1)))
+
+    _insert("Customer", ({
+        "name": f"{PREFIX}CUST-{c:05d}",
+        "customer_name": f"ลูกค้าทดสอบ {c}",
+        "customer_type": "Company",
+        "customer_group": ctx.customer_group,
+        "territory": ctx.territory,
+    } for c in range(1, n_customers + 1)))
+
+    today = nowdate()
+
+    def order_items(o):
+        for idx in range(1, 4):
+            code = _item_code(rng.randint(1, n_items))
+            qty, rate = rng.randint(1, 100), round(rng.uniform(50, 5000), 2)
+            yield {
+                "name": f"{PREFIX}SOI-{o:06d}-{idx}",
+                "parent": f"{PREFIX}SO-{o:06d}",
+                "parenttype": "Sales Order",
+                "parentfield": "items",
+                "idx": idx,
+                "docstatus": 1,
+                "item_code": code,
+                "item_name": code,
+                "qty": qty,
+                "stock_qty": qty,
+                "uom": "Nos",
+                "stock_uom": "Nos",
+                "conversion_factor": 1,
+                "rate": rate,
+                "amount": qty * rate,
+                "delivery_date": today,
+                "warehouse": ctx.warehouses[idx % WAREHOUSES],
+            }
+
+    _insert("Sales Order Item", (row for o in range(1, n_orders + 1) for row in order_items(o)))
+    _insert("Sales Order", ({
+        "name": f"{PREFIX}SO-{o:06d}",
+        "customer": (customer := f"{PREFIX}CUST-{rng.randint(1, n_customers):05d}"),
+        "customer_name": customer,
+        "company": ctx.company,
+        "currency": ctx.currency,
+        "conversion_rate": 1,
+        "order_type": "Sales",
+        "transaction_date": (date := add_days(today, -rng.randint(0, 365))),
+        "delivery_date": add_days(date, 14),
+        "status": rng.choice(["To Deliver and Bill", "To Bill", "To Deliver", "Completed"]),
+        "grand_total": round(rng.uniform(1000, 500000), 2),
+        "per_delivered": rng.choice([0, 50, 100]),
+        "per_billed": rng.choice([0, 100]),
+        "docstatus": 1,
+    } for o in range(1, n_orders + 1)))
+
+    print(f"seeded scale {scale} in {time.perf_counter() - started:.1f}s: "
+          f"{n_items} items, {n_items * WAREHOUSES} bins, {n_boms} BOMs, {n_customers} customers, {n_orders} orders")
+
+
+def purge():
+    for doctype, field in PURGE_ORDER:
+        frappe.db.delete(doctype, {field: ["like", f"{PREFIX}%"]})
+        frappe.db.commit()
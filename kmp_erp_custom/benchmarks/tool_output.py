@@ -0,0 +1,180 @@
+"""
+Benchmark: prompt tokens of tool results, plain JSON vs. compact tables
+
+Runs on synthetic results shaped like each assistant tool's output and
+needs no site or network:
+
+    python -m kmp_erp_custom.benchmarks.tool_output
+
+``run_live`` measures real tool results on a site instead:
+
+    bench --site <site> execute kmp_erp_custom.benchmarks.tool_output.run_live
+"""
+import json
+import random
+
+from kmp_erp_custom.kmp_assistant import tool_output
+from kmp_erp_custom.kmp_assistant.context import count_tokens
+
+# Arguments used by run_live; broad queries so results are large
+LIVE_CALLS = {
+    "search_bom": {"query": "", "limit": 20, "compact": False},
+    "check_stock": {"limit": 50},
+    "get_stock_summary": {"limit": 50},
+    "get_low_stock_items": {"limit": 50},
+    "get_order_status": {"limit": 30},
+    "search_customer_supplier": {"query": "", "limit": 30},
+    "search_erp_general": {"query": "", "limit": 20},
+    "get_system_info": {},
+    "get_recent_activity": {"limit": 20},
+}
+
+
+def _code(rng, prefix: str) -> str:
+    return f"{prefix}-{rng.randint(1, 9999):04d}"
+
+
+def make_results(rows: int = 20, seed: int = 42) -> dict:
+    """Synthetic result of every tool with ``rows`` rows per list"""
+    rng = random.Random(seed)
+
+    def money():
+        return rng.uniform(10, 100000)
+
+    bins = [{
+        "item_code": _code(rng, "RM"),
+        "item_name": f"วัตถุดิบสมุนไพร {i}",
+        "warehouse": "คลังวัตถุดิบ - KMP",
+        "actual_qty": rng.uniform(0, 5000),
+        "reserved_qty": rng.uniform(0, 100),
+        "ordered_qty": rng.uniform(0, 500),
+        "projected_qty": rng.uniform(0, 5000),
+    } for i in range(rows)]
+
+    boms = [{
+        "name": f"BOM-{_code(rng, 'FG')}-001",
+        "item": _code(rng, "FG"),
+        "item_name": f"ครีมบำรุงผิว สูตร {i}",
+        "quantity": 1.0,
+        "total_cost": money(),
+        "is_active": 1,
+        "is_default": 1,
+        "items": [{
+            "item_code": _code(rng, "RM"),
+            "item_name": f"สารสกัด {j}",
+            "qty": rng.uniform(0.01, 5),
+            "rate": money(),
+            "amount": money(),
+        } for j in range(8)],
+    } for i in range(max(1, rows // 4))]
+
+    orders = [{
+        "name": f"SAL-ORD-2026-{i:05d}",
+        "status": rng.choice(["To Deliver and Bill", "Completed", "To Bill"]),
+        "transaction_date": "2026-10-01",
+        "grand_total": money(),
+        "currency": "THB",
+        "customer": _code(rng, "CUST"),
+        "customer_name": f"บริษัท ลูกค้า {i} จำกัด",
+        "delivery_date": "2026-10-15",
+        "per_delivered": rng.uniform(0, 100),
+        "per_billed": rng.uniform(0, 100),
+    } for i in range(rows)]
+
+    parties = [{
+        "name": _code(rng, "CUST"),
+        "customer_name": f"ร้านค้า {i}",
+        "customer_group": "Commercial",
+        "territory": "Thailand",
+        "mobile_no": f"08{rng.randint(10000000, 99999999)}",
+        "email_id": f"shop{i}@example.com",
+        "_doctype": "Customer",
+    } for i in range(rows)]
+
+    general = {
+        "Item": [{"name": _code(rng, "FG"), "item_name": f"สินค้า {i}", "item_group": "Products",
+                  "stock_uom": "Nos", "description": f"รายละเอียดสินค้า {i}"} for i in range(rows)],
+        "Item Group": [{"name": f"กลุ่ม {i}", "parent_item_group": "All Item Groups", "is_group": 0}
+                       for i in range(rows // 4)],
+        "Warehouse": [{"name": f"คลัง {i} - KMP", "warehouse_name": f"คลัง {i}", "company": "KMP", "is_group": 0}
+                      for i in range(rows // 4)],
+        "Customer": [{"name": _code(rng, "CUST"), "customer_name": f"ลูกค้า {i}",
+                      "customer_group": "Commercial", "territory": "Thailand"} for i in range(rows)],
+        "Supplier": [{"name": _code(rng, "SUP"), "supplier_name": f"ผู้ขาย {i}",
+                      "supplier_group": "Raw Material", "country": "Thailand"} for i in range(rows)],
+    }
+
+    system_info = {
+        "companies": [{"name": "KMP", "company_name": "KMP", "default_currency": "THB", "country": "Thailand"}],
+        "fiscal_years": [{"name": str(y), "year_start_date": f"{y}-01-01", "year_end_date": f"{y}-12-31"}
+                         for y in (2026, 2025, 2024)],
+        "item_count": 1200, "customer_count": 300, "supplier_count": 80,
+        "sales_order_count": 5000, "purchase_order_count": 900, "bom_count": 150,
+    }
+
+    activity = {
+        "Sales Order": [{k: o[k] for k in ("name", "customer", "grand_total", "status")} | {"modified": "2026-10-18 09:00:00"}
+                        for o in orders],
+        "Purchase Order": [{"name": f"PUR-ORD-2026-{i:05d}", "supplier": _code(rng, "SUP"), "grand_total": money(),
+                            "status": "To Receive and Bill", "modified": "2026-10-18 09:00:00"} for i in range(rows)],
+        "Stock Entry": [{"name": f"MAT-STE-2026-{i:05d}", "stock_entry_type": "Manufacture",
+                         "posting_date": "2026-10-18", "modified": "2026-10-18 09:00:00"} for i in range(rows)],
+        "Item": [{"name": _code(rng, "FG"), "item_name": f"สินค้า {i}", "creation": "2026-10-01 10:00:00",
+                  "modified": "2026-10-18 09:00:00"} for i in range(rows)],
+    }
+
+    return {
+        "search_bom": boms,
+        "check_stock": bins,
+        "get_order_status": orders,
+        "search_customer_supplier": parties,
+        "search_erp_general": general,
+        "get_system_info": system_info,
+        "get_recent_activity": activity,
+    }
+
+
+def measure(results: dict) -> list[dict]:
+    rows = []
+    for tool, result in results.items():
+        before = count_tokens(json.dumps(result, ensure_ascii=False, default=str))
+        compacted = count_tokens(tool_output._dumps(tool_output.compact(result)))
+        encoded = count_tokens(tool_output.encode(tool, result))
+        rows.append({
+            "tool": tool,
+            "json_tokens": before,
+            "compact_tokens": compacted,
+            "budgeted_tokens": encoded,
+            "budget": tool_output.get_budget(tool),
+            "saving_pct": round((1 - encoded / before) * 100, 1) if before else 0,
+        })
+    return rows
+
+
+def report(rows: list[dict]):
+    print(f"{'tool':<26}{'json':>8}{'compact':>9}{'budgeted':>10}{'budget':>8}{'saving':>9}")
+    for r in rows:
+        print(
+            f"{r['tool']:<26}{r['json_tokens']:>8}{r['compact_tokens']:>9}"
+            f"{r['budgeted_tokens']:>10}{r['budget']:>8}{r['saving_pct']:>8}%"
+        )
+
+
+def run(rows: int = 20) -> list[dict]:
+    results = measure(make_results(rows))
+    report(results)
+    return results
+
+
+def run_live() -> list[dict]:
+    from kmp_erp_custom.kmp_assistant.helpers import TOOL_FUNCTIONS
+
+    results = measure({tool: TOOL_FUNCTIONS[tool](**args) for tool, args in LIVE_CALLS.items()})
+    report(results)
+    return results
+
+
+if __name__ == "__main__":
+    for n in (10, 50):
+        print(f"\n{n} rows per list")
+        run(n)
@@ -20,6 +20,76 @@ app_include_js = ["/assets/kmp_erp_custom/js/kmp_widget_v2.js"]
 # DocTypes
 # ------------------
 
+# Document Events
+# ---------------
+
+_tool_cache_events = {
+    event: "kmp_erp_custom.kmp_assistant.tool_cache.invalidate_doctype"
+    for event in ("on_update", "on_submit", "on_cancel", "on_update_after_submit", "on_trash")
+}
+
+# Keep the assistant's search index (kmp_assistant/erp_search.py) current
+_search_index_events = {
+    "on_update": "kmp_erp_custom.kmp_assistant.erp_search.update_doc",
+    "on_trash": "kmp_erp_custom.kmp_assistant.erp_search.remove_doc",
+    "after_rename": "kmp_erp_custom.kmp_assistant.erp_search.rename_doc",
+}
+_search_indexed = ("Item", "Item Group", "Warehouse", "Customer", "Supplier")
+
+# Memoized BOM explosions (kmp_manufacturing/bom_explosion.py)
+_bom_explosion_events = {
+    event: "kmp_erp_custom.kmp_manufacturing.bom_explosion.invalidate"
+    for event in ("on_submit", "on_cancel", "on_update_after_submit")
+}
+
+# Daily yield totals (kmp_manufacturing/yield_analysis.py)
+_yield_events = {
+    event: "kmp_erp_custom.kmp_manufacturing.yield_analysis.update_from_stock_entry"
+    for event in ("on_submit", "on_cancel")
+}
+
+# LINE notifications queued per site config kmp_line_notify (kmp_integration/line_notify.py)
+_line_notify_events = {
+    event: "kmp_erp_custom.kmp_integration.line_notify.notify_document"
+    for event in ("on_submit", "on_cancel")
+}
+_line_notified = ("Sales Order", "Purchase Order", "Stock Entry")
+
+
+def _merge_events(*handler_maps):
+    """Combine event -> handler maps into event -> [handlers]"""
+    merged = {}
+    for handlers in handler_maps:
+        for event, handler in handlers.items():
+            merged.setdefault(event, []).append(handler)
+    return merged
+
+
+doc_events = {
+    doctype: _merge_events(
+        _tool_cache_events,
+        _search_index_events if doctype in _search_indexed else {},
+        _bom_explosion_events if doctype == "BOM" else {},
+        _yield_events if doctype == "Stock Entry" else {},
+        _line_notify_events if doctype in _line_notified else {},
+    )
+    for doctype in (
+        "BOM",
+        "Bin",
+        "Stock Ledger Entry",
+        "Item",
+        "Item Group",
+        "Warehouse",
+        "Customer",
+        "Supplier",
+        "Sales Order",
+        "Purchase Order",
+        "Stock Entry",
+        "Company",
+        "Fiscal Year",
+    )
+}
+
 # Modules
 # --------------------
 
@@ -31,11 +101,24 @@ app_include_js = ["/assets/kmp_erp_custom/js/kmp_widget_v2.js"]
 # Scheduled Tasks
 # ----------------
 
-# scheduler_events = {
-#     "daily": [
-#         "kmp_erp_custom.tasks.daily"
-#     ],
-# }
+scheduler_events = {
+    "cron": {
+        "* * * * *": [
+            "kmp_erp_custom.kmp_assistant.telemetry.flush_spans",
+            "kmp_erp_custom.kmp_integration.line_notify.drain",
+        ],
+        "*/5 * * * *": [
+            "kmp_erp_custom.kmp_integration.marketplace.ingest_all",
+        ],
+    },
+    "hourly": [
+        "kmp_erp_custom.kmp_assistant.analytics.update_daily_stats",
+    ],
+    "daily": [
+        "kmp_erp_custom.kmp_assistant.telemetry.purge_old_spans",
+        "kmp_erp_custom.kmp_integration.line_notify.purge_sent",
+    ],
+}
 
 # Override DocType Classes
 # -------------------------
@@ -0,0 +1,162 @@
+"""
+KMP Assistant - Materialized daily usage statistics
+
+``KMP Assistant Daily Stats`` holds one row per day. The hourly scheduler
+job recomputes yesterday's and today's rows with range scans on the
+indexed ``creation`` columns, and the dashboard queues a background
+refresh of today's running bucket when it is a few minutes old. The
+dashboard itself only reads the precomputed rows.
+"""
+import frappe
+from frappe.utils import add_days, cint, getdate, now_datetime, nowdate
+
+STATS_DOCTYPE = "KMP Assistant Daily Stats"
+STATS_FIELDS = (
+    "sessions",
+    "messages",
+    "user_messages",
+    "assistant_messages",
+    "active_users",
+    "feedback_positive",
+    "feedback_negative",
+    "prompt_tokens",
+    "completion_tokens",
+    "turns",
+    "total_latency_ms",
+)
+
+
+def _by_day(query: str, from_date, to_date) -> dict:
+    """Run a ``GROUP BY day`` query over [from_date, to_date] keyed by date"""
+    rows = frappe.db.sql(
+        query,
+        {"start": f"{from_date} 00:00:00", "end": f"{add_days(to_date, 1)} 00:00:00"},
+        as_dict=True,
+    )
+    return {getdate(r.pop("day")): r for r in rows}
+
+
+def compute_stats(from_date, to_date) -> dict:
+    """Aggregate raw chat data for each day in [from_date, to_date]"""
+    days = {}
+
+    def merge(result):
+        for day, values in result.items():
+            days.setdefault(day, {}).update(values)
+
+    merge(_by_day("""
+        SELECT DATE(creation) AS day, COUNT(*) AS sessions
+        FROM `tabKMP Chat Session`
+        WHERE creation >= %(start)s AND creation < %(end)s
+        GROUP BY day
+    """, from_date, to_date))
+
+    merge(_by_day("""
+        SELECT DATE(m.creation) AS day,
+            COUNT(*) AS messages,
+            SUM(m.role = 'user') AS user_messages,
+            SUM(m.role = 'assistant') AS assistant_messages,
+            COUNT(DISTINCT s.user) AS active_users,
+            SUM(IFNULL(m.prompt_tokens, 0)) AS prompt_tokens,
+            SUM(IFNULL(m.completion_tokens, 0)) AS completion_tokens,
+            SUM(m.role = 'assistant' AND IFNULL(m.latency_ms, 0) > 0) AS turns,
+            SUM(IFNULL(m.latency_ms, 0)) AS total_latency_ms
+        FROM `tabKMP Chat Message` m
+        JOIN `tabKMP Chat Session` s ON s.name = m.parent
+        WHERE m.parenttype = 'KMP Chat Session'
+            AND m.creation >= %(start)s AND m.creation < %(end)s
+        GROUP BY day
+    """, from_date, to_date))
+
+    merge(_by_day("""
+        SELECT DATE(creation) AS day,
+            SUM(rating = 'positive') AS feedback_positive,
+            SUM(rating = 'negative') AS feedback_negative
+        FROM `tabKMP Chat Feedback`
+        WHERE creation >= %(start)s AND creation < %(end)s
+        GROUP BY day
+    """, from_date, to_date))
+
+    return days
+
+
+def save_stats(days: dict):
+    """Insert or overwrite each day's row in one statement, so concurrent
+    refreshes of the same day cannot collide"""
+    computed_at, user = now_datetime(), frappe.session.user
+    for day, values in days.items():
+        values = {field: cint(values.get(field)) for field in STATS_FIELDS}
+        values.update(name=str(day), date=day, computed_at=computed_at, user=user)
+        frappe.db.sql(f"""
+            INSERT INTO `tab{STATS_DOCTYPE}` (name, creation, modified, owner, modified_by, docstatus, idx,
+                date, computed_at, {", ".join(STATS_FIELDS)})
+            VALUES (%(name)s, %(computed_at)s, %(computed_at)s, %(user)s, %(user)s, 0, 0,
+                %(date)s, %(computed_at)s, {", ".join(f"%({f})s" for f in STATS_FIELDS)})
+            ON DUPLICATE KEY UPDATE computed_at = VALUES(computed_at),
+                {", ".join(f"{f} = VALUES({f})" for f in STATS_FIELDS)}
+        """, values)
+
+
+def refresh(from_date, to_date):
+    save_stats(compute_stats(from_date, to_date))
+    frappe.db.commit()
+
+
+def refresh_today():
+    """Background job: recompute today's running bucket"""
+    today = getdate(nowdate())
+    refresh(today, today)
+
+
+def queue_refresh_today(max_age_minutes: int = 5):
+    """Queue ``refresh_today`` if today's bucket is older than ``max_age_minutes``"""
+    computed_at = frappe.db.get_value(STATS_DOCTYPE, nowdate(), "computed_at")
+    if computed_at and (now_datetime() - computed_at).total_seconds() < max_age_minutes * 60:
+        return
+    frappe.enqueue(
+        f"{__name__}.refresh_today",
+        queue="short",
+        job_id="kmp_assistant_refresh_today_stats",
+        deduplicate=True,
+    )
+
+
+def update_daily_stats():
+    """Scheduler job (hourly): close out yesterday and update today's running bucket"""
+    today = getdate(nowdate())
+    refresh(add_days(today, -1), today)
+
+
+def backfill(days: int = None):
+    """Rebuild all daily rows (or the last ``days`` days), one month at a time.
+
+    bench --site <site> execute kmp_erp_custom.kmp_assistant.analytics.backfill
+    """
+    today = getdate(nowdate())
+    if days:
+        start = add_days(today, -cint(days))
+    else:
+        first = frappe.db.sql("SELECT MIN(creation) FROM `tabKMP Chat Session`")[0][0]
+        if not first:
+            return
+        start = getdate(first)
+    while start <= today:
+        end = min(add_days(start, 30), today)
+        refresh(start, end)
+        start = add_days(end, 1)
+
+
+def get_daily_rows(days: int = 30) -> list[dict]:
+    start = add_days(getdate(nowdate()), -(cint(days) - 1))
+    return frappe.get_all(
+        STATS_DOCTYPE,
+        filters={"date": [">=", start]},
+        fields=["date", *STATS_FIELDS],
+        order_by="date asc",
+    )
+
+
+def get_totals() -> frappe._dict:
+    fields = ", ".join(f"IFNULL(SUM({f}), 0) AS {f}" for f in STATS_FIELDS if f != "active_users")
+    row = frappe.db.sql(f"SELECT {fields} FROM `tab{STATS_DOCTYPE}`", as_dict=True)[0]
+    return frappe._dict({k: cint(v) for k, v in row.items()})
@@ -0,0 +1,138 @@
+"""
+KMP Assistant - Answer cache for repeated first-turn questions
+
+A question asked as the first message of a session does not depend on
+earlier conversation, so its answer can be reused for the same question
+from users with the same permission scope on the same day. Each entry
+records the data version of every DocType its tools read (see
+``tool_cache``) and is only served while those versions are unchanged.
+Answers that used a tool without a DocType mapping are not cached.
+
+Entries are evicted least-recently-used once ``max_entries`` is exceeded;
+recency is kept in a Redis sorted set.
+"""
+import hashlib
+import json
+import re
+import time
+
+import frappe
+from frappe.utils import cint, nowdate
+
+from kmp_erp_custom.kmp_assistant.cache import get_doctype_versions
+from kmp_erp_custom.kmp_assistant.knowledge import normalize
+from kmp_erp_custom.kmp_assistant.tool_cache import TOOL_CACHE_CONFIG, _permission_scope
+
+DEFAULT_MAX_ENTRIES = 500
+ENTRY_TTL = 24 * 60 * 60
+LRU_KEY = "kmp_assistant:answer_cache:lru"
+STATS_KEY = "kmp_assistant:answer_cache_stats"
+
+# Trailing punctuation and polite particles that do not change the question
+_TRAILING = re.compile(r"(?:[\s?!.。,ๆ]|ครับ|คับ|ค่ะ|คะ|นะ|จ้ะ|จ้า|หน่อย)+$")
+
+
+def normalize_question(text: str) -> str:
+    text = " ".join(normalize(text).split())
+    return _TRAILING.sub("", text) or text
+
+
+def _entry_key(digest: str) -> str:
+    return f"kmp_assistant:answer:{digest}"
+
+
+def make_digest(question: str, context: str) -> str:
+    """``context`` identifies everything else the answer depends on (prompt,
+    model, knowledge base)"""
+    payload = json.dumps(
+        {
+            "question": normalize_question(question),
+            "context": context,
+            "date": nowdate(),
+            "scope": _permission_scope(),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def tool_doctypes(tools) -> list | None:
+    """DocTypes read by ``tools``, or None when one of them is not mapped"""
+    doctypes = set()
+    for tool in tools:
+        if tool not in TOOL_CACHE_CONFIG:
+            return None
+        doctypes.update(TOOL_CACHE_CONFIG[tool]["doctypes"])
+    return sorted(doctypes)
+
+
+def all_doctype_versions() -> dict:
+    """Versions of every DocType a cacheable tool reads; take this before
+    the turn runs so a change made during the turn makes the entry stale"""
+    return get_doctype_versions({dt for c in TOOL_CACHE_CONFIG.values() for dt in c["doctypes"]})
+
+
+def _count(outcome: str):
+    cache = frappe.cache()
+    cache.incrby(cache.make_key(f"{STATS_KEY}:{outcome}"), 1)
+
+
+def get(question: str, context: str) -> str | None:
+    digest = make_digest(question, context)
+    cache = frappe.cache()
+    entry = cache.get_value(_entry_key(digest))
+    if entry and get_doctype_versions(entry["doctypes"]) == entry["versions"]:
+        cache.zadd(cache.make_key(LRU_KEY), {digest: time.time()})
+        _count("hit")
+        return entry["answer"]
+    _count("miss")
+    return None
+
+
+def put(question: str, context: str, answer: str, tools, versions: dict, max_entries: int = None):
+    doctypes = tool_doctypes(tools)
+    if doctypes is None:
+        return
+
+    digest = make_digest(question, context)
+    cache = frappe.cache()
+    cache.set_value(
+        _entry_key(digest),
+        {"answer": answer, "doctypes": doctypes, "versions": {dt: versions.get(dt, "0") for dt in doctypes}},
+        expires_in_sec=ENTRY_TTL,
+    )
+    lru = cache.make_key(LRU_KEY)
+    cache.zadd(lru, {digest: time.time()})
+
+    excess = cache.zcard(lru) - (max_entries or DEFAULT_MAX_ENTRIES)
+    if excess > 0:
+        victims = [frappe.safe_decode(d) for d in cache.zrange(lru, 0, excess - 1)]
+        for victim in victims:
+            cache.delete_value(_entry_key(victim))
+        cache.zrem(lru, *victims)
+
+
+def purge():
+    """Drop every cached answer and reset the hit/miss counters"""
+    cache = frappe.cache()
+    lru = cache.make_key(LRU_KEY)
+    for digest in cache.zrange(lru, 0, -1):
+        cache.delete_value(_entry_key(frappe.safe_decode(digest)))
+    cache.delete(lru)
+    for outcome in ("hit", "miss"):
+        cache.delete(cache.make_key(f"{STATS_KEY}:{outcome}"))
+
+
+def get_stats() -> dict:
+    cache = frappe.cache()
+    hits = cint(cache.get(cache.make_key(f"{STATS_KEY}:hit")))
+    misses = cint(cache.get(cache.make_key(f"{STATS_KEY}:miss")))
+    total = hits + misses
+    return {
+        "entries": cache.zcard(cache.make_key(LRU_KEY)),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total * 100, 1) if total else 0,
+    }
+
@@ -1,13 +1,34 @@
 """
 KMP Assistant - API endpoint for AI Chatbot
 """
+import hashlib
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import frappe
 from frappe import _
-from frappe.utils import nowdate, getdate, cint, flt
-import openai
-
+from frappe.utils import nowdate, now_datetime, getdate, cint, cstr, flt
+
+from kmp_erp_custom.kmp_assistant.cache import VersionedCache
+from kmp_erp_custom.kmp_assistant.context import (
+    build_context,
+    enqueue_summary_update,
+    message_tokens,
+    save_token_counts,
+)
 from kmp_erp_custom.kmp_assistant.helpers import TOOL_DEFINITIONS, TOOL_FUNCTIONS
+from kmp_erp_custom.kmp_assistant.knowledge import format_entries, retrieve
+from kmp_erp_custom.kmp_assistant.knowledge import get_version as get_knowledge_version
+from kmp_erp_custom.kmp_assistant import (
+    analytics,
+    answer_cache,
+    llm,
+    message_search,
+    telemetry,
+    tool_cache,
+    tool_output,
+)
 
 DEFAULT_SYSTEM_PROMPT = """คุณคือ KMP Assistant ผู้ช่วย AI ของบริษัท KMP (Pollaphat Marketing)
 คุณช่วยพนักงานได้หลายเรื่อง ทั้งการสนทนาทั่วไปและการค้นหาข้อมูลในระบบ ERPNext
@@ -16,6 +37,8 @@ DEFAULT_SYSTEM_PROMPT = """คุณคือ KMP Assistant ผู้ช่ว
 1. สนทนาทั่วไป - ทักทาย ตอบคำถาม ให้คำแนะนำ
 2. ค้นหาข้อมูลในระบบ ERPNext:
    - สูตรตำรับ (BOM / Bill of Materials)
+   - คำนวณวัตถุดิบทุกระดับและต้นทุนสำหรับยอดผลิตที่ต้องการ
+   - Yield การผลิตและส่วนต่างการใช้วัตถุดิบ
    - สต็อกสินค้า (Stock / Inventory)
    - สถานะออเดอร์ (Sales Order / Purchase Order)
    - ข้อมูลลูกค้าและ Supplier
@@ -51,47 +74,55 @@ def _get_settings_doc():
     return None
 
 
-def _get_system_prompt():
+def _build_assistant_config() -> frappe._dict:
+    """Resolve everything a chat turn needs from settings in one pass"""
     doc = _get_settings_doc()
-    prompt = (doc.system_prompt if doc and doc.system_prompt else DEFAULT_SYSTEM_PROMPT)
-    # Append knowledge base entries
-    entries = frappe.get_all(
-        "KMP Knowledge Entry",
-        filters={"is_active": 1},
-        fields=["question", "answer", "category"],
-        ignore_permissions=True,
-    ) if frappe.db.exists("DocType", "KMP Knowledge Entry") else []
-    if entries:
-        prompt += "\n\n--- ฐานความรู้เพิ่มเติม ---\n"
-        for e in entries:
-            cat = f" [{e['category']}]" if e.get("category") else ""
-            prompt += f"\nQ{cat}: {e['question']}\nA: {e['answer']}\n"
-    return prompt
+    api_key = None
+    if doc and doc.meta.has_field("api_key"):
+        api_key = doc.get("api_key")
+    temperature = 0.3
+    if doc and doc.temperature is not None and doc.temperature != 0:
+        temperature = flt(doc.temperature)
+    return frappe._dict(
+        system_prompt=(doc.system_prompt if doc and doc.system_prompt else DEFAULT_SYSTEM_PROMPT),
+        model=(doc.ai_model if doc and doc.ai_model else None),
+        temperature=temperature,
+        api_key=api_key,
+        answer_cache=cint(doc.get("enable_answer_cache")) if doc and doc.meta.has_field("enable_answer_cache") else 1,
+        answer_cache_size=cint(doc.get("answer_cache_size")) if doc else 0,
+    )
+
+
+_assistant_config = VersionedCache("config", _build_assistant_config)
+
+
+def clear_assistant_config():
+    """Drop the cached settings/prompt in every worker once the transaction commits"""
+    _assistant_config.invalidate_after_commit()
+
+
+def _get_assistant_config() -> frappe._dict:
+    return _assistant_config.get()
+
+
+def _get_system_prompt(query: str = None):
+    """Base prompt plus the knowledge entries relevant to ``query``"""
+    return _get_assistant_config().system_prompt + format_entries(retrieve(query))
 
 
 def _get_model():
-    doc = _get_settings_doc()
-    if doc and doc.ai_model:
-        return doc.ai_model
-    return frappe.conf.get("openai_model", "gpt-4o")
+    return _get_assistant_config().model or frappe.conf.get("openai_model", "gpt-4o")
 
 
 def _get_temperature():
-    doc = _get_settings_doc()
-    if doc and doc.temperature is not None and doc.temperature != 0:
-        return flt(doc.temperature)
-    return 0.3
+    return _get_assistant_config().temperature
 
 
 def _get_openai_client():
-    api_key = frappe.conf.get("openai_api_key")
-    if not api_key:
-        doc = _get_settings_doc()
-        if doc:
-            api_key = doc.get("api_key") if doc.meta.has_field("api_key") else None
+    api_key = frappe.conf.get("openai_api_key") or _get_assistant_config().api_key
     if not api_key:
         frappe.throw(_("OpenAI API Key not configured. Please set 'openai_api_key' in site_config.json"))
-    return openai.OpenAI(api_key=api_key)
+    return llm.get_client(api_key, frappe.conf.get("openai_base_url"))
 
 
 def _get_or_create_session(session_id: str = None, user: str = None) -> "Document":
@@ -106,88 +137,536 @@ def _get_or_create_session(session_id: str = None, user: str = None) -> "Documen
     session.user = user or frappe.session.user
     session.status = "Active"
     session.insert(ignore_permissions=True)
-    frappe.db.commit()
     return session
 
 
 def _add_message(session, role: str, content: str):
-    session.append("messages", {
+    """Append a message to the in-memory session; persist it with ``_save_messages``"""
+    return session.append("messages", {
         "role": role,
         "content": content,
+        "owner": frappe.session.user,
     })
-    session.save(ignore_permissions=True)
+
+
+def _save_messages(session, rows: list):
+    """Insert new message rows without re-saving the session, then commit.
+
+    The session row is locked so that concurrent turns on the same session
+    (e.g. two browser tabs) get consecutive ``idx`` values. Only the new
+    child rows are written and the parent's ``modified`` and listing fields
+    (preview, message_count, last_message_at, last_role) are updated, so
+    the cost does not grow with the length of the conversation.
+    """
+    frappe.db.sql("SELECT name FROM `tabKMP Chat Session` WHERE name = %s FOR UPDATE", session.name)
+    last_idx = frappe.db.sql(
+        """SELECT COALESCE(MAX(idx), 0) FROM `tabKMP Chat Message`
+           WHERE parent = %s AND parenttype = 'KMP Chat Session' AND parentfield = 'messages'""",
+        session.name,
+    )[0][0]
+    for row in rows:
+        last_idx += 1
+        row.idx = last_idx
+        message_tokens(row)
+        row.db_insert()
+    first_user = next((r.content for r in rows if r.role == "user"), None)
+    frappe.db.sql(
+        """UPDATE `tabKMP Chat Session`
+           SET modified = %(now)s, modified_by = %(user)s,
+               message_count = IFNULL(message_count, 0) + %(count)s,
+               last_message_at = %(now)s, last_role = %(last_role)s,
+               preview = IF(IFNULL(preview, '') = '' AND %(preview)s IS NOT NULL, %(preview)s, preview)
+           WHERE name = %(name)s""",
+        {
+            "now": now_datetime(),
+            "user": frappe.session.user,
+            "count": len(rows),
+            "last_role": rows[-1].role,
+            "preview": first_user[:PREVIEW_LENGTH] if first_user else None,
+            "name": session.name,
+        },
+    )
+    save_token_counts(session.messages)
     frappe.db.commit()
+    message_search.enqueue_sync()
 
 
-def _build_messages(session) -> list[dict]:
-    messages = [{"role": "system", "content": _get_system_prompt()}]
-    for msg in session.messages:
-        messages.append({"role": msg.role, "content": msg.content})
-    return messages
+def _build_messages(session) -> tuple[list[dict], list]:
+    """Messages for the next completion plus any overflow awaiting summarization"""
+    last_user = next((m.content for m in reversed(session.messages) if m.role == "user"), None)
+    return build_context(session, _get_system_prompt(last_user))
 
 
 # ---------------------------------------------------------------------------
-# Existing chat APIs (keep intact for widget)
+# Chat pipeline
 # ---------------------------------------------------------------------------
 
-@frappe.whitelist()
-def chat(message: str, session_id: str = None):
-    if not message or not message.strip():
-        frappe.throw(_("Message cannot be empty"))
-
-    session = _get_or_create_session(session_id, frappe.session.user)
-    _add_message(session, "user", message.strip())
-
-    client = _get_openai_client()
-    messages = _build_messages(session)
-    model = _get_model()
-    temperature = _get_temperature()
+MAX_TOOL_ITERATIONS = 5
+DEFAULT_TOOL_WORKERS = 4
+STREAM_EVENT = "kmp_assistant_stream"
+PREVIEW_LENGTH = 140
+FALLBACK_REPLY = "ขออภัย ไม่สามารถตอบได้ในขณะนี้"
+
+
+class _StreamRelay:
+    """Relay streamed tokens to the chat session's realtime room in small chunks.
+
+    Publishing every token would flood socket.io, so deltas are buffered and
+    flushed once enough text has collected or enough time has passed.
+    """
+
+    def __init__(self, session_name: str, min_chars: int = 24, min_interval: float = 0.05):
+        self.session_name = session_name
+        self.min_chars = min_chars
+        self.min_interval = min_interval
+        self._buffer = []
+        self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+
+    def _publish(self, event_type: str, **payload):
+        payload.update({"session_id": self.session_name, "type": event_type})
+        frappe.publish_realtime(
+            STREAM_EVENT,
+            payload,
+            doctype="KMP Chat Session",
+            docname=self.session_name,
+        )
 
+    def push(self, text: str):
+        if not text:
+            return
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        if (self._buffered_chars >= self.min_chars
+                or time.monotonic() - self._last_flush >= self.min_interval):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._publish("delta", text="".join(self._buffer))
+            self._buffer = []
+            self._buffered_chars = 0
+        self._last_flush = time.monotonic()
+
+    def reset(self):
+        """Discard text streamed so far (the model switched to calling tools)"""
+        self._buffer = []
+        self._buffered_chars = 0
+        self._publish("reset")
+
+    def tool(self, names: list[str]):
+        self.flush()
+        self._publish("tool", tools=names)
+
+    def done(self, content: str):
+        self.flush()
+        self._publish("done", text=content)
+
+    def error(self, message: str):
+        self._buffer = []
+        self._publish("error", text=message)
+
+
+def _message_to_dict(message) -> dict:
+    """Convert an SDK assistant message into a plain dict for the next request"""
+    msg = {"role": "assistant", "content": message.content}
+    if message.tool_calls:
+        msg["tool_calls"] = [
+            {
+                "id": tc.id,
+                "type": "function",
+                "function": {"name": tc.function.name, "arguments": tc.function.arguments},
+            }
+            for tc in message.tool_calls
+        ]
+    return msg
+
+
+def _add_usage(usage: dict, response_usage):
+    if response_usage:
+        usage["prompt_tokens"] += response_usage.prompt_tokens or 0
+        usage["completion_tokens"] += response_usage.completion_tokens or 0
+        details = getattr(response_usage, "prompt_tokens_details", None)
+        usage["cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+
+
+def _complete(client, messages: list, model: str, temperature: float, usage: dict) -> dict:
+    response = llm.chat_completion(
+        client,
+        model=model,
+        messages=messages,
+        tools=TOOL_DEFINITIONS,
+        tool_choice="auto",
+        temperature=temperature,
+    )
+    _add_usage(usage, response.usage)
+    return _message_to_dict(response.choices[0].message)
+
+
+def _complete_stream(client, messages: list, model: str, temperature: float, usage: dict, relay: _StreamRelay) -> dict:
+    """Stream a completion, relaying content deltas and assembling tool calls"""
+    stream = llm.chat_completion(
+        client,
+        model=model,
+        messages=messages,
+        tools=TOOL_DEFINITIONS,
+        tool_choice="auto",
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    content = []
+    tool_calls = {}
+    for chunk in stream:
+        _add_usage(usage, getattr(chunk, "usage", None))
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+            if not tool_calls:
+                relay.push(delta.content)
+        for tc in delta.tool_calls or []:
+            if not tool_calls and content:
+                relay.reset()
+            call = tool_calls.setdefault(tc.index, {
+                "id": "",
+                "type": "function",
+                "function": {"name": "", "arguments": ""},
+            })
+            if tc.id:
+                call["id"] = tc.id
+            if tc.function:
+                if tc.function.name:
+                    call["function"]["name"] += tc.function.name
+                if tc.function.arguments:
+                    call["function"]["arguments"] += tc.function.arguments
+
+    msg = {"role": "assistant", "content": "".join(content) or None}
+    if tool_calls:
+        msg["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return msg
+
+
+def _execute_tool_call(tool_call: dict, trace: telemetry.Trace = None) -> str:
+    fn_name = tool_call["function"]["name"]
+    if fn_name not in TOOL_FUNCTIONS:
+        return json.dumps({"error": f"Unknown function: {fn_name}"})
+    started = time.perf_counter()
+    with telemetry.count_queries() as db_stats:
+        try:
+            fn_args = json.loads(tool_call["function"]["arguments"] or "{}")
+            result = tool_cache.call_tool(fn_name, TOOL_FUNCTIONS[fn_name], fn_args)
+            output = tool_output.encode(fn_name, result)
+        except Exception as e:
+            output = json.dumps({"error": str(e)}, ensure_ascii=False)
+    if trace:
+        trace.add("tool", fn_name, (time.perf_counter() - started) * 1000, **db_stats)
+    return output
+
+
+def _execute_tool_call_in_site(site: str, sites_path: str, user: str, tool_call: dict, trace: telemetry.Trace = None) -> str:
+    """Run a tool call on a worker thread with its own site context and DB connection"""
+    frappe.init(site=site, sites_path=sites_path)
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=TOOL_DEFINITIONS,
-            tool_choice="auto",
-            temperature=temperature,
-        )
+        frappe.connect()
+        frappe.set_user(user)
+        return _execute_tool_call(tool_call, trace)
     except Exception as e:
-        frappe.log_error(f"OpenAI API Error: {str(e)}", "KMP Assistant")
-        frappe.throw(_("ไม่สามารถเชื่อมต่อ AI ได้ กรุณาลองใหม่อีกครั้ง"))
-
-    response_message = response.choices[0].message
-    max_iterations = 5
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    finally:
+        frappe.destroy()
+
+
+def _execute_tool_calls(tool_calls: list[dict], trace: telemetry.Trace = None) -> list[str]:
+    """Execute the tool calls of one model turn, concurrently when there are several.
+
+    Results are returned in the same order as ``tool_calls``; a failing tool
+    yields an error payload without affecting the others.
+    """
+    workers = min(len(tool_calls), cint(frappe.conf.get("kmp_assistant_tool_workers") or DEFAULT_TOOL_WORKERS))
+    if workers <= 1:
+        return [_execute_tool_call(tc, trace) for tc in tool_calls]
+
+    site, sites_path, user = frappe.local.site, frappe.local.sites_path, frappe.session.user
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kmp-tool") as pool:
+        futures = [
+            pool.submit(_execute_tool_call_in_site, site, sites_path, user, tc, trace)
+            for tc in tool_calls
+        ]
+        return [f.result() for f in futures]
+
+
+def _run_turn(
+    client,
+    messages: list,
+    relay: _StreamRelay = None,
+    usage: dict = None,
+    tools_used: list = None,
+    trace: telemetry.Trace = None,
+) -> str:
+    """Run one assistant turn (completion + tool round-trips) and return the reply text.
+
+    Token usage of every completion is added to ``usage`` and the names of
+    the tools called to ``tools_used`` when given; ``trace`` gets a span per
+    completion and per tool call.
+    """
+    model = _get_model()
+    temperature = _get_temperature()
+    if usage is None:
+        usage = {}
+    usage.setdefault("prompt_tokens", 0)
+    usage.setdefault("completion_tokens", 0)
+    usage.setdefault("cached_tokens", 0)
+
+    def complete():
+        before = dict(usage)
+        started = time.perf_counter()
+        if relay:
+            message = _complete_stream(client, messages, model, temperature, usage, relay)
+        else:
+            message = _complete(client, messages, model, temperature, usage)
+        if trace:
+            trace.add(
+                "llm",
+                model,
+                (time.perf_counter() - started) * 1000,
+                **{key: usage[key] - before[key] for key in usage},
+            )
+        return message
+
+    response_message = complete()
     iteration = 0
-    while response_message.tool_calls and iteration < max_iterations:
+    while response_message.get("tool_calls") and iteration < MAX_TOOL_ITERATIONS:
         iteration += 1
         messages.append(response_message)
-        for tool_call in response_message.tool_calls:
-            fn_name = tool_call.function.name
-            fn_args = json.loads(tool_call.function.arguments)
-            if fn_name in TOOL_FUNCTIONS:
-                try:
-                    result = TOOL_FUNCTIONS[fn_name](**fn_args)
-                    tool_result = json.dumps(result, ensure_ascii=False, default=str)
-                except Exception as e:
-                    tool_result = json.dumps({"error": str(e)}, ensure_ascii=False)
-            else:
-                tool_result = json.dumps({"error": f"Unknown function: {fn_name}"})
+        if relay:
+            relay.tool([tc["function"]["name"] for tc in response_message["tool_calls"]])
+        tool_calls = response_message["tool_calls"]
+        if tools_used is not None:
+            tools_used.extend(tc["function"]["name"] for tc in tool_calls)
+        for tool_call, tool_result in zip(tool_calls, _execute_tool_calls(tool_calls, trace)):
             messages.append({
                 "role": "tool",
-                "tool_call_id": tool_call.id,
+                "tool_call_id": tool_call["id"],
                 "content": tool_result,
             })
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=TOOL_DEFINITIONS,
-            tool_choice="auto",
-            temperature=temperature,
+        response_message = complete()
+
+    return response_message.get("content") or FALLBACK_REPLY
+
+
+def _first_turn_question(session) -> str | None:
+    """The question when the session holds nothing but it (no context to
+    depend on) and the answer cache is enabled"""
+    if not _get_assistant_config().answer_cache:
+        return None
+    if len(session.messages) == 1 and session.messages[0].role == "user":
+        return session.messages[0].content
+    return None
+
+
+def _answer_cache_context() -> str:
+    return f"{_get_model()}:{_assistant_config.version()}:{get_knowledge_version()}"
+
+
+def _answer_from_cache(session, pending_rows: list, relay: _StreamRelay = None) -> str | None:
+    """Serve a cached answer to a first-turn question, saving it as a normal reply"""
+    question = _first_turn_question(session)
+    if not question:
+        return None
+    trace = telemetry.Trace(session.name)
+    started = time.monotonic()
+    assistant_reply = answer_cache.get(question, _answer_cache_context())
+    if assistant_reply is None:
+        return None
+
+    assistant_row = _add_message(session, "assistant", assistant_reply)
+    assistant_row.update({
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "latency_ms": max(1, int((time.monotonic() - started) * 1000)),
+    })
+    with trace.span("persist"):
+        _save_messages(session, pending_rows + [assistant_row])
+    if relay:
+        relay.done(assistant_reply)
+    trace.finish("cached")
+    return assistant_reply
+
+
+def _answer(session, pending_rows: list, relay: _StreamRelay = None) -> str:
+    """Answer the session's latest user message and save the reply.
+
+    ``pending_rows`` are in-memory rows (the user message) saved in the same
+    transaction as the reply.
+    """
+    trace = telemetry.Trace(session.name)
+    client = _get_openai_client()
+    question = _first_turn_question(session)
+
+    usage = {}
+    tools_used = []
+    try:
+        # Inside the guard so a failure here still saves the user's message
+        # and reaches the relay
+        with trace.span("build"):
+            messages, overflow = _build_messages(session)
+            versions = answer_cache.all_doctype_versions() if question else None
+        started = time.monotonic()
+        assistant_reply = _run_turn(client, messages, relay, usage, tools_used, trace)
+    except Exception as e:
+        frappe.log_error(f"OpenAI API Error: {str(e)}", "KMP Assistant")
+        if pending_rows:
+            _save_messages(session, pending_rows)
+        trace.finish("error", **usage)
+        if relay:
+            relay.error(_("ไม่สามารถเชื่อมต่อ AI ได้ กรุณาลองใหม่อีกครั้ง"))
+        frappe.throw(_("ไม่สามารถเชื่อมต่อ AI ได้ กรุณาลองใหม่อีกครั้ง"))
+
+    assistant_row = _add_message(session, "assistant", assistant_reply)
+    assistant_row.update({
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "latency_ms": int((time.monotonic() - started) * 1000),
+    })
+    with trace.span("persist"):
+        _save_messages(session, pending_rows + [assistant_row])
+    if overflow:
+        enqueue_summary_update(session.name)
+    if question and assistant_reply != FALLBACK_REPLY:
+        answer_cache.put(
+            question,
+            _answer_cache_context(),
+            assistant_reply,
+            tools_used,
+            versions,
+            _get_assistant_config().answer_cache_size,
         )
-        response_message = response.choices[0].message
+    if relay:
+        relay.done(assistant_reply)
+    trace.finish(_get_model(), **usage)
+    return assistant_reply
+
+
+# ---------------------------------------------------------------------------
+# Background turns
+# ---------------------------------------------------------------------------
+
+ASSISTANT_QUEUE = "kmp_assistant"
+DEFAULT_MAX_QUEUE_DEPTH = 50
+TURN_RESULT_TTL = 60 * 60
+
+
+def _get_queue_name() -> str:
+    """The dedicated queue when a worker pool is configured for it, else ``long``.
+
+    Configure it in common_site_config.json, e.g.
+    ``"workers": {"kmp_assistant": {"timeout": 300}}``, and run
+    ``bench worker --queue kmp_assistant`` once per worker wanted.
+    """
+    if ASSISTANT_QUEUE in (frappe.conf.get("workers") or {}):
+        return ASSISTANT_QUEUE
+    return "long"
+
+
+def _turn_key(turn_id: str) -> str:
+    return f"kmp_assistant:turn:{turn_id}"
+
+
+def _set_turn_state(turn_id: str, **state):
+    state.setdefault("user", frappe.session.user)
+    frappe.cache().set_value(_turn_key(turn_id), state, expires_in_sec=TURN_RESULT_TTL)
+
+
+def _enqueue_turn(session, user_row) -> dict:
+    from frappe.utils.background_jobs import get_queue
+
+    queue = _get_queue_name()
+    max_depth = cint(frappe.conf.get("kmp_assistant_max_queue_depth") or DEFAULT_MAX_QUEUE_DEPTH)
+    if get_queue(queue).count >= max_depth:
+        frappe.throw(_("ระบบกำลังมีผู้ใช้งานจำนวนมาก กรุณาลองใหม่อีกครั้งในอีกสักครู่"))
+
+    _save_messages(session, [user_row])
+    turn_id = frappe.generate_hash(length=16)
+    _set_turn_state(turn_id, status="queued", session_id=session.name)
+    frappe.enqueue(
+        "kmp_erp_custom.kmp_assistant.api.run_chat_turn",
+        queue=queue,
+        session_name=session.name,
+        turn_id=turn_id,
+    )
+    return {"session_id": session.name, "job_id": turn_id, "status": "queued"}
 
-    assistant_reply = response_message.content or "ขออภัย ไม่สามารถตอบได้ในขณะนี้"
-    _add_message(session, "assistant", assistant_reply)
+
+def run_chat_turn(session_name: str, turn_id: str):
+    """Background job: answer the latest user message of a session.
+
+    The reply is relayed over realtime as it streams and kept in Redis for
+    ``get_turn_result`` polling.
+    """
+    _set_turn_state(turn_id, status="running", session_id=session_name)
+    session = frappe.get_doc("KMP Chat Session", session_name)
+    try:
+        reply = _answer(session, [], _StreamRelay(session.name))
+    except Exception as e:
+        _set_turn_state(turn_id, status="error", session_id=session_name, error=str(e))
+        raise
+    _set_turn_state(turn_id, status="done", session_id=session_name, response=reply)
+
+
+@frappe.whitelist()
+def get_turn_result(job_id: str):
+    """Polling fallback for background turns when realtime is unavailable"""
+    state = frappe.cache().get_value(_turn_key(job_id))
+    if not state or state.get("user") != frappe.session.user:
+        return {"status": "unknown"}
+    state = dict(state)
+    state.pop("user", None)
+    return state
+
+
+# ---------------------------------------------------------------------------
+# Existing chat APIs (keep intact for widget)
+# ---------------------------------------------------------------------------
+
+@frappe.whitelist()
+def create_session():
+    """Create an empty session so the widget can subscribe to its room before streaming"""
+    session = _get_or_create_session(None, frappe.session.user)
+    return {"session_id": session.name}
+
+
+@frappe.whitelist()
+def chat(message: str, session_id: str = None, stream: int = 0, background: int = 0):
+    """Answer a chat message.
+
+    With ``stream=1`` the reply is also relayed token-by-token over the
+    ``kmp_assistant_stream`` realtime event to the session's document room;
+    the final text is still returned (and saved) once the turn completes.
+
+    First-turn questions answered before (with unchanged data) are served
+    from the answer cache without calling the model.
+
+    With ``background=1`` the user message is saved, the turn is queued and
+    ``{"session_id", "job_id", "status"}`` is returned at once; the reply
+    arrives over realtime (as with ``stream``) or via ``get_turn_result``.
+    """
+    if not message or not message.strip():
+        frappe.throw(_("Message cannot be empty"))
+
+    session = _get_or_create_session(session_id, frappe.session.user)
+    user_row = _add_message(session, "user", message.strip())
+    relay = _StreamRelay(session.name) if cint(stream) else None
+
+    cached_reply = _answer_from_cache(session, [user_row], relay)
+    if cached_reply is not None:
+        return {"session_id": session.name, "response": cached_reply, "cached": 1}
+
+    if cint(background):
+        return _enqueue_turn(session, user_row)
+
+    assistant_reply = _answer(session, [user_row], relay)
     return {"session_id": session.name, "response": assistant_reply}
 
 
@@ -208,19 +687,12 @@ def get_my_sessions(limit: int = 20):
     sessions = frappe.get_list(
         "KMP Chat Session",
         filters={"user": frappe.session.user},
-        fields=["name", "user", "status", "creation", "modified"],
+        fields=["name", "user", "status", "creation", "modified", "preview", "message_count"],
         order_by="modified desc",
         limit_page_length=limit,
     )
     for s in sessions:
-        first_msg = frappe.get_all(
-            "KMP Chat Message",
-            filters={"parent": s["name"], "role": "user"},
-            fields=["content"],
-            order_by="idx asc",
-            limit_page_length=1,
-        )
-        s["preview"] = first_msg[0]["content"][:50] if first_msg else "สนทนาใหม่"
+        s["preview"] = s["preview"][:50] if s.get("preview") else "สนทนาใหม่"
     return sessions
 
 
@@ -245,44 +717,56 @@ def submit_feedback(session_id: str, message_index: int, rating: str, comment: s
 
 @frappe.whitelist()
 def get_dashboard_stats():
-    total_sessions = frappe.db.count("KMP Chat Session")
-    total_messages = frappe.db.count("KMP Chat Message")
-
-    today = nowdate()
-    active_users_today = frappe.db.sql(
-        """SELECT COUNT(DISTINCT user) FROM `tabKMP Chat Session`
-           WHERE DATE(modified) = %s""",
-        today,
-    )[0][0] or 0
-
-    feedback_positive = frappe.db.count("KMP Chat Feedback", {"rating": "positive"})
-    feedback_negative = frappe.db.count("KMP Chat Feedback", {"rating": "negative"})
-
-    recent_sessions = frappe.db.sql("""
-        SELECT s.name, s.user, s.status, s.creation, s.modified,
-            (SELECT COUNT(*) FROM `tabKMP Chat Message` m WHERE m.parent = s.name) as message_count,
-            (SELECT m2.content FROM `tabKMP Chat Message` m2
-             WHERE m2.parent = s.name AND m2.role = 'user'
-             ORDER BY m2.idx ASC LIMIT 1) as preview
-        FROM `tabKMP Chat Session` s
-        ORDER BY s.modified DESC
-        LIMIT 20
-    """, as_dict=True)
+    """Headline numbers from the materialized daily stats (see analytics.py)"""
+    analytics.queue_refresh_today()
+    totals = analytics.get_totals()
+    today = frappe.db.get_value(
+        "KMP Assistant Daily Stats", nowdate(), ["active_users", "prompt_tokens", "completion_tokens"], as_dict=True
+    ) or {}
+
+    recent_sessions = frappe.get_all(
+        "KMP Chat Session",
+        fields=["name", "user", "status", "creation", "modified", "message_count", "preview"],
+        order_by="modified desc",
+        limit_page_length=20,
+    )
 
     for s in recent_sessions:
         if s.get("preview"):
             s["preview"] = s["preview"][:80]
 
     return {
-        "total_sessions": total_sessions,
-        "total_messages": total_messages,
-        "active_users_today": active_users_today,
-        "feedback_positive": feedback_positive,
-        "feedback_negative": feedback_negative,
+        "total_sessions": totals.sessions,
+        "total_messages": totals.messages,
+        "active_users_today": today.get("active_users") or 0,
+        "feedback_positive": totals.feedback_positive,
+        "feedback_negative": totals.feedback_negative,
+        "avg_latency_ms": int(totals.total_latency_ms / totals.turns) if totals.turns else 0,
+        "total_tokens": totals.prompt_tokens + totals.completion_tokens,
         "recent_sessions": recent_sessions,
     }
 
 
+@frappe.whitelist()
+def get_dashboard_trend(days=30):
+    """Daily rows for the 30/90-day trend charts"""
+    days = min(max(cint(days), 1), 366)
+    return analytics.get_daily_rows(days)
+
+
+@frappe.whitelist()
+def get_performance_summary(hours=24):
+    """Latency percentiles per stage and per tool, and the slowest recent turns"""
+    frappe.only_for("System Manager")
+    return telemetry.get_summary(min(max(cint(hours), 1), 24 * 14))
+
+
+@frappe.whitelist()
+def get_turn_spans(turn_id):
+    frappe.only_for("System Manager")
+    return telemetry.get_turn(turn_id)
+
+
 # ---------------------------------------------------------------------------
 # Settings APIs
 # ---------------------------------------------------------------------------
@@ -297,6 +781,8 @@ def get_settings():
             "ai_model": "gpt-4o",
             "temperature": 0.3,
             "tools_config": "{}",
+            "enable_answer_cache": 1,
+            "answer_cache_size": answer_cache.DEFAULT_MAX_ENTRIES,
         }
     return {
         "bot_name": doc.bot_name or "KMP Assistant",
@@ -304,6 +790,8 @@ def get_settings():
         "ai_model": doc.ai_model or "gpt-4o",
         "temperature": flt(doc.temperature) or 0.3,
         "tools_config": doc.tools_config or "{}",
+        "enable_answer_cache": cint(doc.get("enable_answer_cache")),
+        "answer_cache_size": cint(doc.get("answer_cache_size")) or answer_cache.DEFAULT_MAX_ENTRIES,
     }
 
 
@@ -314,11 +802,14 @@ def save_settings(**kwargs):
         frappe.throw("KMP Assistant Settings DocType not found. Please run bench migrate.")
 
     doc = frappe.get_single("KMP Assistant Settings")
-    for key in ("bot_name", "system_prompt", "ai_model", "temperature", "tools_config"):
+    for key in ("bot_name", "system_prompt", "ai_model", "temperature", "tools_config",
+                "enable_answer_cache", "answer_cache_size"):
         if key in kwargs:
             val = kwargs[key]
             if key == "temperature":
                 val = flt(val)
+            elif key in ("enable_answer_cache", "answer_cache_size"):
+                val = cint(val)
             doc.set(key, val)
     doc.save(ignore_permissions=True)
     frappe.db.commit()
@@ -329,39 +820,93 @@ def save_settings(**kwargs):
 # Chat History (Admin) APIs
 # ---------------------------------------------------------------------------
 
+COUNT_CACHE_SECONDS = 300
+
+
+def _like_prefix(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _keyset(cursor: str, sort_field: str, name_cast=cstr) -> tuple[str, list]:
+    """SQL condition selecting rows after ``cursor`` in ``sort_field DESC, name DESC`` order"""
+    if not cursor:
+        return "", []
+    sort_value, _, name = cstr(cursor).partition("|")
+    return (
+        f"({sort_field} < %s OR ({sort_field} = %s AND name < %s))",
+        [sort_value, sort_value, name_cast(name)],
+    )
+
+
+def _next_cursor(rows: list, limit: int, sort_field: str):
+    """Trim the look-ahead row fetched past ``limit``; return the cursor for the next page"""
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    last = rows[-1]
+    return f"{last[sort_field]}|{last['name']}"
+
+
+def _cached_count(doctype: str, where: str, params: list) -> int:
+    """Row count cached for a few minutes; listing pages don't need exact totals"""
+    key = "kmp_assistant:count:" + hashlib.sha1(
+        json.dumps([doctype, where, params], default=str).encode()
+    ).hexdigest()
+    total = frappe.cache().get_value(key)
+    if total is None:
+        total = frappe.db.sql(f"SELECT COUNT(*) FROM `tab{doctype}` {where}", params)[0][0]
+        frappe.cache().set_value(key, total, expires_in_sec=COUNT_CACHE_SECONDS)
+    return total
+
+
 @frappe.whitelist()
-def get_all_sessions(limit=20, offset=0, search=None):
-    limit = cint(limit)
+def get_all_sessions(limit=20, offset=0, search=None, cursor=None):
+    """Sessions newest first, paged by ``cursor`` (keyset on modified, name).
+
+    ``search`` matches users by prefix so the (user, modified) index applies;
+    ``total`` is a cached count. ``offset`` is still accepted for old callers.
+    """
+    limit = cint(limit) or 20
     offset = cint(offset)
-    conditions = ""
+    conditions = []
     params = []
-    if search:
-        conditions = "WHERE s.user LIKE %s"
-        params.append(f"%{search}%")
+    if search and search.strip():
+        conditions.append("user LIKE %s")
+        params.append(_like_prefix(search.strip()))
 
-    total = frappe.db.sql(
-        f"SELECT COUNT(*) FROM `tabKMP Chat Session` s {conditions}",
-        params,
-    )[0][0]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    total = _cached_count("KMP Chat Session", where, params)
+
+    keyset, keyset_params = _keyset(cursor, "modified")
+    if keyset:
+        conditions.append(keyset)
+        params += keyset_params
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-    params_q = params + [limit, offset]
+    params += [limit + 1, 0 if cursor else offset]
     sessions = frappe.db.sql(f"""
-        SELECT s.name, s.user, s.status, s.creation, s.modified,
-            (SELECT COUNT(*) FROM `tabKMP Chat Message` m WHERE m.parent = s.name) as message_count,
-            (SELECT m2.content FROM `tabKMP Chat Message` m2
-             WHERE m2.parent = s.name AND m2.role = 'user'
-             ORDER BY m2.idx ASC LIMIT 1) as preview
-        FROM `tabKMP Chat Session` s
-        {conditions}
-        ORDER BY s.modified DESC
+        SELECT name, user, status, creation, modified,
+            message_count, preview, last_message_at, last_role
+        FROM `tabKMP Chat Session`
+        {where}
+        ORDER BY modified DESC, name DESC
         LIMIT %s OFFSET %s
-    """, params_q, as_dict=True)
+    """, params, as_dict=True)
+    next_cursor = _next_cursor(sessions, limit, "modified")
 
     for s in sessions:
         if s.get("preview"):
             s["preview"] = s["preview"][:80]
 
-    return {"total": total, "sessions": sessions}
+    return {"total": total, "sessions": sessions, "next_cursor": next_cursor}
+
+
+@frappe.whitelist()
+def search_messages(query, limit=20):
+    """Full-text search over message content; returns matching sessions
+    ranked by relevance with a highlighted snippet"""
+    frappe.only_for("System Manager")
+    return message_search.search(query, limit)
 
 
 @frappe.whitelist()
@@ -392,24 +937,35 @@ def delete_session(session_id):
 # ---------------------------------------------------------------------------
 
 @frappe.whitelist()
-def get_all_feedback(limit=20, offset=0, rating_filter=None):
-    limit = cint(limit)
+def get_all_feedback(limit=20, offset=0, rating_filter=None, cursor=None):
+    """Feedback newest first, paged by ``cursor`` (keyset on creation, name)"""
+    limit = cint(limit) or 20
     offset = cint(offset)
-    filters = {}
+    conditions = []
+    params = []
     if rating_filter and rating_filter in ("positive", "negative"):
-        filters["rating"] = rating_filter
-
-    total = frappe.db.count("KMP Chat Feedback", filters)
-    feedback = frappe.get_list(
-        "KMP Chat Feedback",
-        filters=filters,
-        fields=["name", "session", "user", "rating", "comment", "message_index", "creation"],
-        order_by="creation desc",
-        limit_page_length=limit,
-        start=offset,
-        ignore_permissions=True,
-    )
-    return {"total": total, "feedback": feedback}
+        conditions.append("rating = %s")
+        params.append(rating_filter)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    total = _cached_count("KMP Chat Feedback", where, params)
+
+    keyset, keyset_params = _keyset(cursor, "creation", name_cast=cint)
+    if keyset:
+        conditions.append(keyset)
+        params += keyset_params
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    params += [limit + 1, 0 if cursor else offset]
+    feedback = frappe.db.sql(f"""
+        SELECT name, session, user, rating, comment, message_index, creation
+        FROM `tabKMP Chat Feedback`
+        {where}
+        ORDER BY creation DESC, name DESC
+        LIMIT %s OFFSET %s
+    """, params, as_dict=True)
+    next_cursor = _next_cursor(feedback, limit, "creation")
+    return {"total": total, "feedback": feedback, "next_cursor": next_cursor}
 
 
 # ---------------------------------------------------------------------------
@@ -460,3 +1016,33 @@ def delete_knowledge_entry(name):
     frappe.delete_doc("KMP Knowledge Entry", name, ignore_permissions=True)
     frappe.db.commit()
     return {"status": "ok"}
+
+
+# ---------------------------------------------------------------------------
+# Tool and answer cache APIs
+# ---------------------------------------------------------------------------
+
+@frappe.whitelist()
+def get_tool_cache_stats():
+    frappe.only_for("System Manager")
+    return tool_cache.get_stats()
+
+
+@frappe.whitelist()
+def reset_tool_cache_stats():
+    frappe.only_for("System Manager")
+    tool_cache.reset_stats()
+    return {"status": "ok"}
+
+
+@frappe.whitelist()
+def get_answer_cache_stats():
+    frappe.only_for("System Manager")
+    return answer_cache.get_stats()
+
+
+@frappe.whitelist()
+def purge_answer_cache():
+    frappe.only_for("System Manager")
+    answer_cache.purge()
+    return {"status": "ok"}
@@ -0,0 +1,93 @@
+"""
+KMP Assistant - Versioned two-level (process + Redis) cache
+"""
+import frappe
+
+
+class VersionedCache:
+    """Cache a value that is expensive to rebuild from the database.
+
+    The value is stored in Redis under a key that includes a version token,
+    and each process keeps its own copy of the last value it saw. A lookup
+    costs one Redis read of the version token; the value itself is only
+    fetched from Redis when the token changed and only rebuilt (via
+    ``builder``) when Redis has no value for the current token.
+
+    ``invalidate`` replaces the token, so all workers rebuild on their next
+    lookup and a rebuild that raced with the invalidation is written under
+    the old token and never read again.
+    """
+
+    def __init__(self, name: str, builder, expires_in_sec: int = 24 * 60 * 60):
+        self.name = name
+        self.builder = builder
+        self.expires_in_sec = expires_in_sec
+        self._local = {}
+
+    @property
+    def _version_key(self) -> str:
+        return f"kmp_assistant:{self.name}:version"
+
+    def _value_key(self, version: str) -> str:
+        return f"kmp_assistant:{self.name}:{version}"
+
+    def _current_version(self) -> str:
+        cache = frappe.cache()
+        version = cache.get_value(self._version_key)
+        if not version:
+            version = frappe.generate_hash(length=12)
+            cache.set_value(self._version_key, version)
+        return version
+
+    def version(self) -> str:
+        """Token that changes whenever the value is invalidated"""
+        return self._current_version()
+
+    def get(self):
+        site = frappe.local.site
+        version = self._current_version()
+        local = self._local.get(site)
+        if local and local[0] == version:
+            return local[1]
+
+        cache = frappe.cache()
+        value = cache.get_value(self._value_key(version))
+        if value is None:
+            value = self.builder()
+            cache.set_value(self._value_key(version), value, expires_in_sec=self.expires_in_sec)
+
+        self._local[site] = (version, value)
+        return value
+
+    def invalidate(self):
+        frappe.cache().set_value(self._version_key, frappe.generate_hash(length=12))
+        self._local.pop(frappe.local.site, None)
+
+    def invalidate_after_commit(self):
+        """Invalidate once the current transaction commits, so a concurrent
+        rebuild cannot cache the pre-commit state under the new version"""
+        frappe.db.after_commit.add(self.invalidate)
+
+
+# ---------------------------------------------------------------------------
+# DocType data versions
+# ---------------------------------------------------------------------------
+
+DOCTYPE_VERSIONS_KEY = "kmp_assistant:doctype_versions"
+
+
+def get_doctype_versions(doctypes) -> dict:
+    """Current data version token of each DocType (one Redis round-trip).
+
+    Results cached against these tokens go stale as soon as a document of
+    one of the DocTypes changes, without having to find and delete them.
+    """
+    versions = {
+        frappe.safe_decode(k): v
+        for k, v in (frappe.cache().hgetall(DOCTYPE_VERSIONS_KEY) or {}).items()
+    }
+    return {dt: versions.get(dt, "0") for dt in sorted(doctypes)}
+
+
+def bump_doctype_version(doctype: str):
+    frappe.cache().hset(DOCTYPE_VERSIONS_KEY, doctype, frappe.generate_hash(length=8))
@@ -0,0 +1,176 @@
+"""
+KMP Assistant - Conversation context within a token budget
+
+The most recent messages that fit in the budget are sent verbatim; older
+ones are folded into a rolling summary stored on the session. Folding runs
+as a background job and only summarizes the messages that fell out of the
+window since the last fold, a budget-sized chunk per call, so the summary
+is extended rather than rebuilt. Until a message is folded, the newest
+budget's worth of the waiting messages stays in the prompt; a turn never
+waits on summarization.
+"""
+import frappe
+from frappe.utils import cint
+
+DEFAULT_CONTEXT_TOKENS = 4000
+TOKEN_COUNT_BATCH_SIZE = 500
+SUMMARY_PROMPT = """สรุปบทสนทนาระหว่างพนักงานกับ KMP Assistant ให้กระชับ ไม่เกิน 200 คำ
+เก็บข้อเท็จจริงที่สำคัญ เช่น รหัสสินค้า, BOM, ลูกค้า, เลขที่ออเดอร์, ตัวเลข และคำถามที่ยังค้างอยู่
+ตอบเป็นภาษาไทย"""
+
+_encoder = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text or ""))
+    # Thai averages roughly one token per 1.5 characters with GPT tokenizers
+    return int(len(text or "") / 1.5) + 1
+
+
+def message_tokens(row) -> int:
+    """Token count of a message row, cached on the row's ``token_count``
+    (saved rows that had none are written back by ``save_token_counts``)"""
+    if not row.get("token_count"):
+        row.token_count = count_tokens(row.content) + 4
+        if not row.is_new():
+            row.flags.token_count_unsaved = True
+    return row.token_count
+
+
+def save_token_counts(rows: list):
+    """Write back the counts ``message_tokens`` computed for saved rows, a
+    batch per statement, so older messages are tokenized only once"""
+    rows = [r for r in rows if r.flags.pop("token_count_unsaved", None)]
+    for i in range(0, len(rows), TOKEN_COUNT_BATCH_SIZE):
+        batch = rows[i:i + TOKEN_COUNT_BATCH_SIZE]
+        frappe.db.sql(f"""
+            UPDATE `tabKMP Chat Message`
+            SET token_count = CASE name {" ".join("WHEN %s THEN %s" for _ in batch)} END
+            WHERE name IN %s
+        """, (*(v for r in batch for v in (r.name, r.token_count)), [r.name for r in batch]))
+
+
+def get_budget() -> int:
+    return cint(frappe.conf.get("kmp_assistant_context_tokens") or DEFAULT_CONTEXT_TOKENS)
+
+
+def split_context(session, budget: int = None) -> tuple[list, list]:
+    """Split the unsummarized messages into (window, overflow).
+
+    ``window`` is the newest run of messages that fits in ``budget``
+    (always at least the latest one); ``overflow`` is what still needs to
+    be folded into the summary.
+    """
+    budget = budget or get_budget()
+    upto = cint(session.get("summary_upto_idx"))
+    rows = [m for m in session.messages if m.role in ("user", "assistant") and cint(m.idx) > upto]
+    start = _newest_within(rows, budget)
+    return rows[start:], rows[:start]
+
+
+def _newest_within(rows: list, budget: int) -> int:
+    """Start of the newest run of ``rows`` that fits in ``budget`` (at least one row)"""
+    used = 0
+    start = len(rows)
+    while start > 0:
+        tokens = message_tokens(rows[start - 1])
+        if start < len(rows) and used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    return start
+
+
+def _chunks(rows: list, budget: int):
+    chunk, used = [], 0
+    for row in rows:
+        tokens = message_tokens(row)
+        if chunk and used + tokens > budget:
+            yield chunk
+            chunk, used = [], 0
+        chunk.append(row)
+        used += tokens
+    if chunk:
+        yield chunk
+
+
+def build_context(session, system_prompt: str) -> tuple[list[dict], list]:
+    """Build the OpenAI messages for a turn; returns (messages, overflow)
+
+    The newest budget's worth of the overflow not yet folded into the
+    summary is still sent verbatim, so the turns before the fold job
+    catches up do not lose those messages. Folding ``overflow`` is left to
+    ``enqueue_summary_update``.
+    """
+    budget = get_budget()
+    window, overflow = split_context(session, budget)
+    pending = overflow[_newest_within(overflow, budget):] if overflow else []
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if session.get("summary"):
+        messages.append({"role": "system", "content": f"สรุปบทสนทนาก่อนหน้า:\n{session.summary}"})
+    messages.extend({"role": m.role, "content": m.content} for m in pending + window)
+    return messages, overflow
+
+
+def enqueue_summary_update(session_name: str):
+    frappe.enqueue(
+        "kmp_erp_custom.kmp_assistant.context.update_summary",
+        queue="short",
+        job_id=f"kmp_assistant_summary::{session_name}",
+        deduplicate=True,
+        session_name=session_name,
+    )
+
+
+def fold(session, overflow: list, budget: int = None, commit: bool = False):
+    """Fold ``overflow`` into the session summary, one budget-sized chunk
+    per call, updating ``session`` and its row (and committing, with
+    ``commit``) as each chunk is folded"""
+    from kmp_erp_custom.kmp_assistant import llm
+    from kmp_erp_custom.kmp_assistant.api import _get_model, _get_openai_client
+
+    client, model = _get_openai_client(), _get_model()
+    for chunk in _chunks(overflow, budget or get_budget()):
+        transcript = "\n".join(f"{m.role}: {m.content}" for m in chunk)
+        previous = session.get("summary") or "-"
+        response = llm.chat_completion(
+            client,
+            model=model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"สรุปเดิม:\n{previous}\n\nข้อความใหม่:\n{transcript}"},
+            ],
+            temperature=0,
+        )
+        summary = (response.choices[0].message.content or "").strip()
+        if not summary:
+            return
+        session.summary, session.summary_upto_idx = summary, chunk[-1].idx
+        frappe.db.set_value(
+            "KMP Chat Session",
+            session.name,
+            {"summary": summary, "summary_upto_idx": chunk[-1].idx},
+            update_modified=False,
+        )
+        if commit:
+            frappe.db.commit()
+
+
+def update_summary(session_name: str):
+    """Fold messages that fell out of the context window into the session summary"""
+    session = frappe.get_doc("KMP Chat Session", session_name)
+    _window, overflow = split_context(session)
+    save_token_counts(session.messages)
+    frappe.db.commit()
+    if overflow:
+        fold(session, overflow, commit=True)
@@ -2,4 +2,6 @@ import frappe
 from frappe.model.document import Document
 
 class KMPAssistantSettings(Document):
-    pass
+    def on_update(self):
+        from kmp_erp_custom.kmp_assistant.api import clear_assistant_config
+        clear_assistant_config()
@@ -0,0 +1,12 @@
+import frappe
+from frappe.model.document import Document
+
+
+class KMPAssistantSpan(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Assistant Span", ["creation"])
+    frappe.db.add_index("KMP Assistant Span", ["stage", "creation"])
+    frappe.db.add_index("KMP Assistant Span", ["turn_id"])
@@ -3,3 +3,8 @@ from frappe.model.document import Document
 
 class KMPChatFeedback(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Chat Feedback", ["creation"])
+    frappe.db.add_index("KMP Chat Feedback", ["rating", "creation"])
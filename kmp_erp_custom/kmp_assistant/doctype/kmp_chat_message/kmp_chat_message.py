@@ -4,3 +4,7 @@ from frappe.model.document import Document
 
 class KMPChatMessage(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Chat Message", ["creation"])
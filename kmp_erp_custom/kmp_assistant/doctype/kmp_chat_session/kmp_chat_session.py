@@ -6,3 +6,12 @@ class KMPChatSession(Document):
     def before_save(self):
         if not self.user:
             self.user = frappe.session.user
+
+    def on_trash(self):
+        from kmp_erp_custom.kmp_assistant.message_search import remove_session
+        remove_session(self.name)
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Chat Session", ["creation"])
+    frappe.db.add_index("KMP Chat Session", ["user", "modified"])
@@ -1,5 +1,11 @@
 import frappe
 from frappe.model.document import Document
 
+from kmp_erp_custom.kmp_assistant.knowledge import clear_knowledge_index
+
 class KMPKnowledgeEntry(Document):
-    pass
+    def on_update(self):
+        clear_knowledge_index()
+
+    def on_trash(self):
+        clear_knowledge_index()
@@ -0,0 +1,221 @@
+"""
+KMP Assistant - Search index over Items, Item Groups, Warehouses, Customers
+and Suppliers
+
+``LIKE '%query%'`` over several columns (``Item.description`` among them)
+scans the whole table for every search. Instead the searchable text of
+each record is kept in a per-site SQLite FTS5 sidecar using the trigram
+tokenizer (as for chat messages, see ``message_search``), so one indexed
+query returns ranked candidates for all DocTypes at once. Candidates are
+then loaded with ``frappe.get_list`` by name, which applies the user's
+permissions.
+
+The index is built in bulk by ``rebuild`` and kept current by
+``doc_events`` (see hooks.py). Queries shorter than a trigram, or a site
+whose index has not been built, fall back to the ``LIKE`` search.
+"""
+import os
+import sqlite3
+
+import frappe
+from frappe.utils import cint, cstr, now
+
+REBUILD_BATCH_SIZE = 5000
+# Candidates fetched per DocType for each result wanted, so results the
+# user may not read can be dropped without running short
+OVERFETCH = 3
+TITLE_WEIGHT = 10.0
+
+# DocType -> fields whose text is indexed; title fields rank higher
+INDEXED_DOCTYPES = {
+    "Item": {"title": ["name", "item_name"], "body": ["item_group", "description"]},
+    "Item Group": {"title": ["name"], "body": ["parent_item_group"]},
+    "Warehouse": {"title": ["name", "warehouse_name"], "body": ["company"]},
+    "Customer": {"title": ["name", "customer_name"], "body": ["customer_group", "territory"]},
+    "Supplier": {"title": ["name", "supplier_name"], "body": ["supplier_group", "country"]},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    doctype TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (doctype, name)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(title, body, tokenize = 'trigram');
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def get_index_path() -> str:
+    return frappe.get_site_path("private", "kmp_assistant", "erp_search.sqlite3")
+
+
+def _connect() -> sqlite3.Connection:
+    path = get_index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _texts(doctype: str, row) -> tuple[str, str]:
+    cfg = INDEXED_DOCTYPES[doctype]
+    return tuple(
+        " ".join(cstr(row.get(f)) for f in cfg[part] if row.get(f))
+        for part in ("title", "body")
+    )
+
+
+def _upsert(conn, doctype: str, row):
+    title, body = _texts(doctype, row)
+    existing = conn.execute(
+        "SELECT id FROM docs WHERE doctype = ? AND name = ?", (doctype, row.get("name"))
+    ).fetchone()
+    if existing:
+        conn.execute("UPDATE docs_fts SET title = ?, body = ? WHERE rowid = ?", (title, body, existing[0]))
+    else:
+        cur = conn.execute("INSERT INTO docs (doctype, name) VALUES (?, ?)", (doctype, row.get("name")))
+        conn.execute("INSERT INTO docs_fts (rowid, title, body) VALUES (?, ?, ?)", (cur.lastrowid, title, body))
+
+
+def _delete(conn, doctype: str, name: str):
+    conn.execute(
+        "DELETE FROM docs_fts WHERE rowid IN (SELECT id FROM docs WHERE doctype = ? AND name = ?)",
+        (doctype, name),
+    )
+    conn.execute("DELETE FROM docs WHERE doctype = ? AND name = ?", (doctype, name))
+
+
+# ---------------------------------------------------------------------------
+# Indexing
+# ---------------------------------------------------------------------------
+
+def rebuild():
+    """Drop the sidecar and index every record of the indexed DocTypes.
+
+    bench --site <site> execute kmp_erp_custom.kmp_assistant.erp_search.rebuild
+    """
+    for suffix in ("", "-wal", "-shm"):
+        path = get_index_path() + suffix
+        if os.path.exists(path):
+            os.remove(path)
+
+    conn = _connect()
+    try:
+        for doctype, cfg in INDEXED_DOCTYPES.items():
+            fields = list(dict.fromkeys(cfg["title"] + cfg["body"]))
+            last_name = ""
+            while True:
+                rows = frappe.get_all(
+                    doctype,
+                    filters={"name": [">", last_name]},
+                    fields=fields,
+                    order_by="name asc",
+                    limit_page_length=REBUILD_BATCH_SIZE,
+                )
+                if not rows:
+                    break
+                with conn:
+                    for row in rows:
+                        _upsert(conn, doctype, row)
+                last_name = rows[-1].name
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (now(),))
+    finally:
+        conn.close()
+
+
+def _apply(change, *args):
+    """Run ``change(conn, *args)`` on the sidecar; the ERP write has already
+    committed, so a failure here is logged rather than raised"""
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                change(conn, *args)
+        finally:
+            conn.close()
+    except Exception:
+        frappe.log_error(title="KMP Assistant search index")
+
+
+def update_doc(doc, method=None):
+    """doc_events handler (on_update): re-index the document after commit"""
+    row = {f: doc.get(f) for cfg in [INDEXED_DOCTYPES[doc.doctype]] for f in cfg["title"] + cfg["body"]}
+    frappe.db.after_commit.add(lambda: _apply(_upsert, doc.doctype, row))
+
+
+def remove_doc(doc, method=None):
+    """doc_events handler (on_trash)"""
+    doctype, name = doc.doctype, doc.name
+    frappe.db.after_commit.add(lambda: _apply(_delete, doctype, name))
+
+
+def rename_doc(doc, method=None, old=None, new=None, merge=False):
+    """doc_events handler (after_rename): drop the old name, index the new one"""
+    doctype = doc.doctype
+    frappe.db.after_commit.add(lambda: _apply(_delete, doctype, old))
+    update_doc(doc)
+
+
+# ---------------------------------------------------------------------------
+# Querying
+# ---------------------------------------------------------------------------
+
+def _match_expression(query: str) -> str:
+    """Every whitespace-separated term must appear (as a substring)"""
+    return " AND ".join('"' + t.replace('"', '""') + '"' for t in query.split())
+
+
+def search(query: str, doctypes, limit: int = 10) -> dict | None:
+    """Best-ranked candidate names per DocType, or None when the index
+    cannot answer (short terms, index not built)"""
+    query = (query or "").strip()
+    doctypes = [dt for dt in doctypes if dt in INDEXED_DOCTYPES]
+    if not query or not doctypes or any(len(t) < 3 for t in query.split()):
+        return None
+    if not os.path.exists(get_index_path()):
+        return None
+
+    conn = _connect()
+    try:
+        if not conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone():
+            return None
+        placeholders = ", ".join("?" for _ in doctypes)
+        rows = conn.execute(f"""
+            SELECT doctype, name FROM (
+                SELECT d.doctype, d.name,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY d.doctype ORDER BY bm25(docs_fts, {TITLE_WEIGHT}, 1.0)
+                    ) AS rank_in_doctype
+                FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid
+                WHERE docs_fts MATCH ? AND d.doctype IN ({placeholders})
+            )
+            WHERE rank_in_doctype <= ?
+            ORDER BY doctype, rank_in_doctype
+        """, (_match_expression(query), *doctypes, cint(limit) * OVERFETCH)).fetchall()
+    finally:
+        conn.close()
+
+    results = {dt: [] for dt in doctypes}
+    for doctype, name in rows:
+        results[doctype].append(name)
+    return results
+
+
+def fetch_ranked(doctype: str, names: list, fields: list, limit: int) -> list[dict]:
+    """Load ``names`` the user may read, in the given rank order"""
+    if not names:
+        return []
+    rows = frappe.get_list(
+        doctype,
+        filters={"name": ["in", names]},
+        fields=fields,
+        limit_page_length=len(names),
+    )
+    rank = {name: i for i, name in enumerate(names)}
+    rows.sort(key=lambda r: rank.get(r.get("name"), len(rank)))
+    return rows[:cint(limit)]
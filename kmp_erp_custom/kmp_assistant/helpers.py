@@ -1,35 +1,136 @@
 """
 KMP Assistant - Helper functions for querying ERPNext data
 """
+import heapq
+
 import frappe
-from frappe.utils import flt, nowdate, getdate
+from frappe.utils import cint, flt, nowdate, getdate
+
+from kmp_erp_custom.kmp_assistant import erp_search, item_resolver
+from kmp_erp_custom.kmp_manufacturing import bom_explosion, yield_analysis
+
 
+COMPACT_BOM_THRESHOLD = 5
+STOCK_QTY_FIELDS = ("actual_qty", "reserved_qty", "ordered_qty", "projected_qty")
+REORDER_SCAN_BATCH_SIZE = 1000
+# Items matched by a stock summary ``query`` before summing their Bins
+SUMMARY_QUERY_ITEM_LIMIT = 500
 
-def search_bom(query: str, limit: int = 10) -> list[dict]:
-    """ค้นหาสูตรตำรับ (Bill of Materials)"""
+
+def search_bom(query: str, limit: int = 10, compact: bool = None) -> list[dict]:
+    """ค้นหาสูตรตำรับ (Bill of Materials)
+
+    Child items of all matched BOMs are fetched in one query. With
+    ``compact`` (the default once more than COMPACT_BOM_THRESHOLD BOMs
+    match) each BOM carries item count and cost totals instead of items.
+    """
     filters = {"docstatus": 1}
     or_filters = {
         "name": ["like", f"%{query}%"],
         "item": ["like", f"%{query}%"],
         "item_name": ["like", f"%{query}%"],
     }
+    fields = ["name", "item", "item_name", "quantity", "total_cost", "is_active", "is_default"]
     boms = frappe.get_list(
         "BOM",
         filters=filters,
         or_filters=or_filters,
-        fields=["name", "item", "item_name", "quantity", "total_cost", "is_active", "is_default"],
+        fields=fields,
         limit_page_length=limit,
         order_by="modified desc",
     )
-    for bom in boms:
-        bom["items"] = frappe.get_all(
-            "BOM Item",
-            filters={"parent": bom["name"]},
-            fields=["item_code", "item_name", "qty", "rate", "amount"],
+    if not boms:
+        # Nothing matched verbatim: try the Items the text most likely means
+        item_codes = item_resolver.resolve_codes(query)
+        if not item_codes:
+            return boms
+        boms = frappe.get_list(
+            "BOM",
+            filters={**filters, "item": ["in", item_codes]},
+            fields=fields,
+            limit_page_length=limit,
+            order_by="is_default desc, modified desc",
         )
+        for bom in boms:
+            bom["_resolved_from"] = query
+        if not boms:
+            return boms
+
+    if compact is None:
+        compact = len(boms) > COMPACT_BOM_THRESHOLD
+
+    items_by_bom = {bom["name"]: [] for bom in boms}
+    for row in frappe.get_all(
+        "BOM Item",
+        filters={"parenttype": "BOM", "parent": ["in", list(items_by_bom)]},
+        fields=["parent", "item_code", "item_name", "qty", "rate", "amount"],
+        order_by="parent asc, idx asc",
+    ):
+        items_by_bom[row.pop("parent")].append(row)
+
+    for bom in boms:
+        items = items_by_bom[bom["name"]]
+        if compact:
+            bom["item_count"] = len(items)
+            bom["items_amount"] = flt(sum(flt(i["amount"]) for i in items), 2)
+        else:
+            bom["items"] = items
     return boms
 
 
+def explode_bom(query: str = None, bom: str = None, qty: float = 1) -> dict:
+    """คำนวณวัตถุดิบทุกระดับ (รวมสูตรย่อย) และต้นทุนสำหรับผลิตตามจำนวนที่ระบุ"""
+    resolved_from = None
+    if not bom and query:
+        if frappe.db.exists("BOM", query):
+            bom = query
+        else:
+            bom = bom_explosion.get_default_bom(query)
+            if not bom:
+                for item_code in item_resolver.resolve_codes(query):
+                    bom = bom_explosion.get_default_bom(item_code)
+                    if bom:
+                        resolved_from = query
+                        break
+    if not bom:
+        return {"error": f"ไม่พบ BOM ที่ใช้งานอยู่สำหรับ '{query or ''}'"}
+
+    frappe.has_permission("BOM", doc=bom, throw=True)
+    result = bom_explosion.explode(bom, qty)
+    if resolved_from:
+        result["_resolved_from"] = resolved_from
+    return result
+
+
+def get_yield_analysis(
+    item_code: str = None,
+    bom: str = None,
+    from_date: str = None,
+    to_date: str = None,
+    group_by: str = "item",
+    limit: int = 20,
+) -> list[dict]:
+    """วิเคราะห์ Yield การผลิต (ผลผลิตจริงเทียบแผน) และส่วนต่างต้นทุนวัตถุดิบ"""
+    resolved_from = None
+    if item_code and not frappe.db.exists("Item", item_code):
+        item_codes = item_resolver.resolve_codes(item_code, 1)
+        if item_codes:
+            resolved_from, item_code = item_code, item_codes[0]
+
+    rows = yield_analysis.get_yield(
+        from_date=from_date,
+        to_date=to_date,
+        item_code=item_code,
+        bom=bom,
+        group_by=group_by,
+        limit=limit,
+    )
+    if resolved_from:
+        for row in rows:
+            row["_resolved_from"] = resolved_from
+    return rows
+
+
 def check_stock(item_code: str = None, warehouse: str = None, query: str = None, limit: int = 10) -> list[dict]:
     """เช็คสต็อกสินค้า"""
     filters = {}
@@ -45,14 +146,162 @@ def check_stock(item_code: str = None, warehouse: str = None, query: str = None,
             "item_name": ["like", f"%{query}%"],
         }
 
-    return frappe.get_list(
+    fields = ["item_code", "item_name", "warehouse", "actual_qty", "reserved_qty", "ordered_qty", "projected_qty"]
+    bins = frappe.get_list(
         "Bin",
         filters=filters,
         or_filters=or_filters if or_filters else None,
-        fields=["item_code", "item_name", "warehouse", "actual_qty", "reserved_qty", "ordered_qty", "projected_qty"],
+        fields=fields,
+        limit_page_length=limit,
+        order_by="actual_qty desc",
+    )
+    text = item_code or query
+    if bins or not text:
+        return bins
+
+    # Nothing matched verbatim (a typo, missing tone marks): try the Items
+    # the text most likely means
+    item_codes = item_resolver.resolve_codes(text)
+    if not item_codes or item_codes == [item_code]:
+        return bins
+    filters["item_code"] = ["in", item_codes]
+    bins = frappe.get_list(
+        "Bin",
+        filters=filters,
+        fields=fields,
         limit_page_length=limit,
         order_by="actual_qty desc",
     )
+    for row in bins:
+        row["_resolved_from"] = text
+    return bins
+
+
+def _with_item_details(rows: list[dict]) -> list[dict]:
+    """Add item_name and stock_uom to rows keyed by item_code (one query)"""
+    codes = list({r["item_code"] for r in rows})
+    if not codes:
+        return rows
+    items = {
+        i.name: i
+        for i in frappe.get_all("Item", filters={"name": ["in", codes]}, fields=["name", "item_name", "stock_uom"])
+    }
+    for row in rows:
+        item = items.get(row["item_code"]) or {}
+        row["item_name"] = item.get("item_name")
+        row["stock_uom"] = item.get("stock_uom")
+    return rows
+
+
+def get_stock_summary(item_code: str = None, warehouse: str = None, query: str = None, limit: int = 20) -> list[dict]:
+    """สรุปยอดสต็อกรวมต่อสินค้า ทุกคลังหรือเฉพาะคลัง/กลุ่มคลัง
+
+    Quantities are summed per item in one GROUP BY query over Bin; a group
+    warehouse covers every warehouse under it.
+    """
+    filters = {}
+    if item_code:
+        filters["item_code"] = item_code
+    elif query:
+        # Bin has no item name; match codes and (Thai) names on Item first
+        filters["item_code"] = ["in", frappe.get_list(
+            "Item",
+            or_filters={"name": ["like", f"%{query}%"], "item_name": ["like", f"%{query}%"]},
+            pluck="name",
+            limit_page_length=SUMMARY_QUERY_ITEM_LIMIT,
+        ) or [""]]
+    if warehouse:
+        filters["warehouse"] = ["descendants of (inclusive)", warehouse]
+
+    def summarize(filters):
+        return frappe.get_list(
+            "Bin",
+            filters=filters,
+            fields=["item_code", *(f"sum({f}) as {f}" for f in STOCK_QTY_FIELDS), "count(name) as warehouse_count"],
+            group_by="item_code",
+            order_by="sum(actual_qty) desc",
+            limit_page_length=limit,
+        )
+
+    rows = summarize(filters)
+    text = item_code or query
+    if not rows and text:
+        item_codes = item_resolver.resolve_codes(text)
+        if item_codes and item_codes != [item_code]:
+            rows = summarize({**filters, "item_code": ["in", item_codes]})
+            for row in rows:
+                row["_resolved_from"] = text
+
+    for row in rows:
+        for f in STOCK_QTY_FIELDS:
+            row[f] = flt(row[f], 3)
+    return _with_item_details(rows)
+
+
+def get_low_stock_items(warehouse: str = None, item_group: str = None, limit: int = 20) -> dict:
+    """สแกนสินค้าที่ยอดคาดการณ์ (projected qty) ต่ำกว่าจุดสั่งซื้อใน Item Reorder
+
+    Reorder levels are scanned in batches of REORDER_SCAN_BATCH_SIZE, each
+    joined to its Bin in one query, keeping only the ``limit`` largest
+    shortfalls, so memory stays constant however large the inventory.
+    """
+    frappe.has_permission("Bin", throw=True)
+    frappe.has_permission("Item", throw=True)
+    limit = cint(limit) or 20
+
+    warehouse_filters = {"is_group": 0}
+    if warehouse:
+        warehouse_filters["name"] = ["descendants of (inclusive)", warehouse]
+    warehouses = frappe.get_list("Warehouse", filters=warehouse_filters, pluck="name", limit_page_length=0)
+    result = {"scanned": 0, "below_reorder_level": 0, "items": []}
+    if not warehouses:
+        return result
+
+    params = {"warehouses": warehouses, "batch_size": REORDER_SCAN_BATCH_SIZE}
+    group_condition = ""
+    if item_group:
+        params["item_groups"] = frappe.get_list(
+            "Item Group", filters={"name": ["descendants of (inclusive)", item_group]}, pluck="name", limit_page_length=0
+        ) or [item_group]
+        group_condition = "AND i.item_group IN %(item_groups)s"
+
+    lowest = []
+    after = ""
+    while True:
+        rows = frappe.db.sql(f"""
+            SELECT ir.name, ir.parent AS item_code, ir.warehouse,
+                ir.warehouse_reorder_level AS reorder_level, ir.warehouse_reorder_qty AS reorder_qty,
+                IFNULL(b.actual_qty, 0) AS actual_qty, IFNULL(b.projected_qty, 0) AS projected_qty
+            FROM `tabItem Reorder` ir
+            JOIN `tabItem` i ON i.name = ir.parent
+            LEFT JOIN `tabBin` b ON b.item_code = ir.parent AND b.warehouse = ir.warehouse
+            WHERE ir.parenttype = 'Item' AND ir.name > %(after)s
+                AND i.disabled = 0 AND ir.warehouse IN %(warehouses)s {group_condition}
+            ORDER BY ir.name
+            LIMIT %(batch_size)s
+        """, {**params, "after": after}, as_dict=True)
+        if not rows:
+            break
+        # Read the cursor before the loop pops ``name`` off short rows
+        after = rows[-1].name
+        for row in rows:
+            result["scanned"] += 1
+            shortfall = flt(row.reorder_level) - flt(row.projected_qty)
+            if shortfall <= 0:
+                continue
+            result["below_reorder_level"] += 1
+            entry = (shortfall, row.pop("name"), row)
+            if len(lowest) < limit:
+                heapq.heappush(lowest, entry)
+            else:
+                heapq.heappushpop(lowest, entry)
+
+    items = []
+    for shortfall, _name, row in sorted(lowest, key=lambda e: e[0], reverse=True):
+        row["shortfall"] = flt(shortfall, 3)
+        items.append(row)
+    result["items"] = _with_item_details(items)
+    return result
 
 
 def get_order_status(
@@ -113,17 +362,21 @@ def search_customer_supplier(query: str, doc_type: str = None, limit: int = 10)
     if doc_type in ("Supplier", None):
         types_to_search.append(("Supplier", ["name", "supplier_name", "supplier_group", "country", "mobile_no", "email_id"]))
 
+    hits = erp_search.search(query, [dt for dt, _ in types_to_search], limit)
     for dt, fields in types_to_search:
-        name_field = "customer_name" if dt == "Customer" else "supplier_name"
-        items = frappe.get_list(
-            dt,
-            or_filters={
-                "name": ["like", f"%{query}%"],
-                name_field: ["like", f"%{query}%"],
-            },
-            fields=fields,
-            limit_page_length=limit,
-        )
+        if hits is not None:
+            items = erp_search.fetch_ranked(dt, hits[dt], fields, limit)
+        else:
+            name_field = "customer_name" if dt == "Customer" else "supplier_name"
+            items = frappe.get_list(
+                dt,
+                or_filters={
+                    "name": ["like", f"%{query}%"],
+                    name_field: ["like", f"%{query}%"],
+                },
+                fields=fields,
+                limit_page_length=limit,
+            )
         for item in items:
             item["_doctype"] = dt
         results.extend(items)
@@ -161,17 +414,24 @@ def search_erp_general(query: str, doc_types: list = None, limit: int = 10) -> d
         },
     }
 
+    # Ranked candidates for every DocType from one index query; None means
+    # the index cannot answer and the LIKE filters are used instead
+    hits = erp_search.search(query, doc_types, limit)
+
     for dt in doc_types:
         if dt not in search_configs:
             continue
         cfg = search_configs[dt]
         try:
-            data = frappe.get_list(
-                dt,
-                or_filters=cfg["or_filters"],
-                fields=cfg["fields"],
-                limit_page_length=limit,
-            )
+            if hits is not None:
+                data = erp_search.fetch_ranked(dt, hits[dt], cfg["fields"], limit)
+            else:
+                data = frappe.get_list(
+                    dt,
+                    or_filters=cfg["or_filters"],
+                    fields=cfg["fields"],
+                    limit_page_length=limit,
+                )
             results[dt] = data
         except Exception:
             results[dt] = []
@@ -239,7 +499,11 @@ def get_recent_activity(limit: int = 10) -> dict:
 # Map function names for OpenAI function calling
 TOOL_FUNCTIONS = {
     "search_bom": search_bom,
+    "explode_bom": explode_bom,
+    "get_yield_analysis": get_yield_analysis,
     "check_stock": check_stock,
+    "get_stock_summary": get_stock_summary,
+    "get_low_stock_items": get_low_stock_items,
     "get_order_status": get_order_status,
     "search_customer_supplier": search_customer_supplier,
     "search_erp_general": search_erp_general,
@@ -252,22 +516,64 @@ TOOL_DEFINITIONS = [
         "type": "function",
         "function": {
             "name": "search_bom",
-            "description": "ค้นหาสูตรตำรับ (Bill of Materials / BOM) จาก ERPNext ใช้เมื่อต้องการดูสูตร ส่วนประกอบ วัตถุดิบ",
+            "description": "ค้นหาสูตรตำรับ (Bill of Materials / BOM) จาก ERPNext ใช้เมื่อต้องการดูสูตร ส่วนประกอบ วัตถุดิบ ถ้าไม่พบตรงตัวจะค้นจากสินค้าที่ชื่อหรือรหัสใกล้เคียง (ผลลัพธ์มี _resolved_from)",
             "parameters": {
                 "type": "object",
                 "properties": {
                     "query": {"type": "string", "description": "คำค้นหา: ชื่อสินค้า, รหัส BOM, หรือรหัสสินค้า"},
                     "limit": {"type": "integer", "description": "จำนวนผลลัพธ์สูงสุด", "default": 10},
+                    "compact": {
+                        "type": "boolean",
+                        "description": "true = สรุปเฉพาะจำนวนรายการและต้นทุนรวมของแต่ละ BOM, false = แสดงวัตถุดิบทุกรายการ (ค่าเริ่มต้น: สรุปเมื่อพบมากกว่า 5 BOM)",
+                    },
                 },
                 "required": ["query"],
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "explode_bom",
+            "description": "แตกสูตรตำรับทุกระดับ (รวมสูตรย่อย/กึ่งสำเร็จรูป) เป็นวัตถุดิบตั้งต้น พร้อมปริมาณและต้นทุนรวม ใช้เมื่อถามว่าต้องใช้วัตถุดิบเท่าไรในการผลิต X หน่วย",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "รหัสหรือชื่อสินค้าสำเร็จรูป (ใช้ BOM ค่าเริ่มต้น) หรือรหัส BOM"},
+                    "bom": {"type": "string", "description": "รหัส BOM (ถ้าทราบ)"},
+                    "qty": {"type": "number", "description": "จำนวนที่ต้องการผลิต (หน่วยสต็อกของสินค้า)", "default": 1},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_yield_analysis",
+            "description": "วิเคราะห์ Yield การผลิตจาก Stock Entry ประเภท Manufacture: ยอดผลิตตามแผนเทียบผลิตได้จริง, ของเสีย, %Yield และส่วนต่างต้นทุนวัตถุดิบจริงเทียบ BOM",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "item_code": {"type": "string", "description": "รหัสสินค้าสำเร็จรูป"},
+                    "bom": {"type": "string", "description": "รหัส BOM"},
+                    "from_date": {"type": "string", "description": "วันที่เริ่มต้น (YYYY-MM-DD) ค่าเริ่มต้น 30 วันย้อนหลัง"},
+                    "to_date": {"type": "string", "description": "วันที่สิ้นสุด (YYYY-MM-DD) ค่าเริ่มต้นวันนี้"},
+                    "group_by": {
+                        "type": "string",
+                        "enum": ["item", "bom", "day", "item_day"],
+                        "description": "สรุปตามสินค้า, BOM, วัน หรือสินค้าต่อวัน",
+                        "default": "item",
+                    },
+                    "limit": {"type": "integer", "description": "จำนวนแถวสูงสุด", "default": 20},
+                },
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
             "name": "check_stock",
-            "description": "เช็คจำนวนสต็อกสินค้าในคลัง ใช้เมื่อต้องการรู้จำนวนคงเหลือ สินค้าในคลัง",
+            "description": "เช็คจำนวนสต็อกสินค้าในคลัง ใช้เมื่อต้องการรู้จำนวนคงเหลือ สินค้าในคลัง ถ้าไม่พบตรงตัวจะค้นจากสินค้าที่ชื่อหรือรหัสใกล้เคียง (ผลลัพธ์มี _resolved_from)",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -279,6 +585,37 @@ TOOL_DEFINITIONS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_stock_summary",
+            "description": "สรุปยอดสต็อกรวมต่อสินค้า (คงเหลือ, จอง, สั่งซื้อ, คาดการณ์) รวมทุกคลังหรือเฉพาะคลัง/กลุ่มคลัง ใช้แทน check_stock เมื่อต้องการยอดรวม ไม่ต้องบวกเลขเอง",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "item_code": {"type": "string", "description": "รหัสสินค้า"},
+                    "warehouse": {"type": "string", "description": "คลังหรือกลุ่มคลัง (รวมคลังย่อยทั้งหมด)"},
+                    "query": {"type": "string", "description": "คำค้นหารหัสหรือชื่อสินค้า"},
+                    "limit": {"type": "integer", "description": "จำนวนสินค้าสูงสุด", "default": 20},
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_low_stock_items",
+            "description": "สแกนสินค้าทั้งหมดที่ยอดคาดการณ์ต่ำกว่าจุดสั่งซื้อ (Item Reorder) เรียงตามจำนวนที่ขาดมากสุด ใช้เมื่อถามว่าสินค้าอะไรใกล้หมด/ต้องสั่งเพิ่ม",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "warehouse": {"type": "string", "description": "คลังหรือกลุ่มคลัง"},
+                    "item_group": {"type": "string", "description": "กลุ่มสินค้า"},
+                    "limit": {"type": "integer", "description": "จำนวนรายการสูงสุด", "default": 20},
+                },
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
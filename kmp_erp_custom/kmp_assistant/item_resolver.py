@@ -0,0 +1,209 @@
+"""
+KMP Assistant - Typo-tolerant item code and name resolution
+
+Maps free text ("ครีมขมนชัน", "fg 0002", "BENC-FG-00002") to the most likely
+item codes, so the stock and BOM tools can still answer when the text does
+not match an Item verbatim.
+
+Codes and names are reduced to a key of lower-case letters and digits with
+Thai tone marks dropped (users often leave them out), and indexed as
+character trigrams. Candidates sharing the rarest trigrams with the query
+are ranked by edit distance to the code, or to the closest substring of the
+name.
+
+The index lives in process memory, is loaded lazily per site and catches up
+with Items modified since the last sync whenever the Item data version
+(bumped by the tool cache doc_events, see hooks.py) changes.
+"""
+import threading
+import unicodedata
+from collections import Counter
+
+import frappe
+from frappe.utils import cint
+
+from kmp_erp_custom.kmp_assistant.cache import get_doctype_versions
+from kmp_erp_custom.kmp_assistant.knowledge import normalize
+
+NGRAM_SIZE = 3
+DEFAULT_LIMIT = 5
+# Postings scanned per lookup; grams are taken rarest first, so very common
+# ones ("ben" in every "BENCH-..." code) are skipped once this is reached
+POSTINGS_BUDGET = 5000
+# Best-overlapping Items checked by edit distance
+CANDIDATES = 12
+# Edits allowed per query character (about one typo in three characters)
+MAX_EDIT_RATIO = 0.34
+# Rebuild instead of patching once this share of slots is superseded
+MAX_STALE_RATIO = 0.2
+
+# Mai taikhu, the four tone marks and thanthakhat
+_DROPPED = dict.fromkeys(map(ord, "็่้๊๋์"))
+
+
+def make_key(text: str) -> str:
+    text = normalize(text).translate(_DROPPED)
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] in ("L", "M", "N"))
+
+
+def _grams(key: str) -> set:
+    if len(key) <= NGRAM_SIZE:
+        return {key} if key else set()
+    return {key[i:i + NGRAM_SIZE] for i in range(len(key) - NGRAM_SIZE + 1)}
+
+
+def edit_distance(pattern: str, text: str, anywhere: bool = False, cutoff: int = None) -> int:
+    """Levenshtein distance; with ``anywhere``, the fewest edits turning
+    ``pattern`` into some substring of ``text``. Gives up with ``cutoff + 1``
+    once the distance is bound to exceed ``cutoff``."""
+    prev = [0] * (len(text) + 1) if anywhere else list(range(len(text) + 1))
+    for i, pc in enumerate(pattern, 1):
+        cur = [i]
+        for j, tc in enumerate(text, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (pc != tc)))
+        if cutoff is not None and min(cur) > cutoff:
+            return cutoff + 1
+        prev = cur
+    return min(prev) if anywhere else prev[-1]
+
+
+class ItemIndex:
+    """Trigram index over item codes and names.
+
+    Items are stored in slots; an update takes a new slot and leaves the old
+    one superseded, so postings are only ever appended to.
+    """
+
+    def __init__(self):
+        self.slots = []
+        self.slot_of = {}
+        self.postings = {}
+        self.exact = {}
+        self.synced_modified = None
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    @property
+    def stale_ratio(self) -> float:
+        return 1 - len(self.slot_of) / len(self.slots) if self.slots else 0
+
+    def add(self, item_code: str, item_name: str = None):
+        self.remove(item_code)
+        slot = len(self.slots)
+        code_key, name_key = make_key(item_code), make_key(item_name)
+        self.slots.append((item_code, item_name, code_key, name_key))
+        self.slot_of[item_code] = slot
+        for key in (code_key, name_key):
+            if key:
+                self.exact.setdefault(key, []).append(slot)
+        for gram in _grams(code_key) | _grams(name_key):
+            self.postings.setdefault(gram, []).append(slot)
+
+    def remove(self, item_code: str):
+        self.slot_of.pop(item_code, None)
+
+    def _live(self, slot: int) -> bool:
+        return self.slot_of.get(self.slots[slot][0]) == slot
+
+    def resolve(self, text: str, limit: int = DEFAULT_LIMIT) -> list[dict]:
+        key = make_key(text)
+        if not key or not self.slots:
+            return []
+
+        exact = [s for s in self.exact.get(key, ()) if self._live(s)]
+        if exact:
+            return [self._result(s, 0) for s in exact[:limit]]
+
+        grams = sorted(
+            (g for g in _grams(key) if g in self.postings),
+            key=lambda g: len(self.postings[g]),
+        )
+        overlap = Counter()
+        scanned = 0
+        for gram in grams:
+            posting = self.postings[gram]
+            if scanned and scanned + len(posting) > POSTINGS_BUDGET:
+                break
+            overlap.update(posting)
+            scanned += len(posting)
+
+        max_edits = max(1, int(len(key) * MAX_EDIT_RATIO))
+        ranked = []
+        for slot, shared in overlap.most_common(CANDIDATES * 2):
+            if not self._live(slot):
+                continue
+            _code, _name, code_key, name_key = self.slots[slot]
+            # Codes are typed whole, names often only in part
+            distance = edit_distance(key, code_key, cutoff=max_edits)
+            if name_key and distance:
+                distance = min(distance, edit_distance(key, name_key, anywhere=True, cutoff=max_edits))
+            if distance <= max_edits:
+                ranked.append((distance, -shared, slot))
+            if len(ranked) >= CANDIDATES:
+                break
+        ranked.sort()
+        return [self._result(slot, distance) for distance, _shared, slot in ranked[:limit]]
+
+    def _result(self, slot: int, distance: int) -> dict:
+        item_code, item_name, _code_key, _name_key = self.slots[slot]
+        return {"item_code": item_code, "item_name": item_name, "edits": distance}
+
+
+# ---------------------------------------------------------------------------
+# Per-process index, synced from the database
+# ---------------------------------------------------------------------------
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _load(index: ItemIndex, since=None):
+    filters = {"modified": [">=", since]} if since else {}
+    for row in frappe.get_all(
+        "Item",
+        filters=filters,
+        fields=["name", "item_name", "disabled", "modified"],
+        order_by="modified asc",
+        ignore_permissions=True,
+    ):
+        if row.disabled:
+            index.remove(row.name)
+        else:
+            index.add(row.name, row.item_name)
+        index.synced_modified = row.modified
+
+
+def get_index() -> ItemIndex:
+    version = get_doctype_versions(["Item"])["Item"]
+    site = frappe.local.site
+    synced_version, index = _indexes.get(site, (None, None))
+    if index is not None and synced_version == version:
+        return index
+
+    with _lock:
+        synced_version, index = _indexes.get(site, (None, None))
+        if index is not None and synced_version == version:
+            return index
+        if index is None or index.stale_ratio > MAX_STALE_RATIO:
+            index = ItemIndex()
+            _load(index)
+        else:
+            _load(index, index.synced_modified)
+            # Deleted or renamed Items leave no modified row behind
+            if len(index) != frappe.db.count("Item", {"disabled": 0}):
+                index = ItemIndex()
+                _load(index)
+        _indexes[site] = (version, index)
+    return index
+
+
+def resolve(text: str, limit: int = DEFAULT_LIMIT) -> list[dict]:
+    """Most likely Items for ``text``: ``[{item_code, item_name, edits}]``"""
+    if not text:
+        return []
+    return get_index().resolve(text, cint(limit) or DEFAULT_LIMIT)
+
+
+def resolve_codes(text: str, limit: int = DEFAULT_LIMIT) -> list[str]:
+    return [r["item_code"] for r in resolve(text, limit)]
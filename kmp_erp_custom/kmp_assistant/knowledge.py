@@ -0,0 +1,200 @@
+"""
+KMP Assistant - Knowledge base retrieval
+
+Thai is written without spaces between words, so entries are indexed as
+character n-grams of each letter run and ranked with BM25. The index lives
+in process memory and is synced incrementally against a manifest of
+``{name: modified}`` for the active entries, which is cached in Redis and
+invalidated whenever an entry changes.
+"""
+import heapq
+import math
+import unicodedata
+from collections import Counter
+
+import frappe
+from frappe.utils import cint
+
+from kmp_erp_custom.kmp_assistant.cache import VersionedCache
+
+DEFAULT_TOP_K = 5
+NGRAM_SIZES = (2, 3)
+KNOWLEDGE_HEADER = "\n\n--- ฐานความรู้เพิ่มเติม ---\n"
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return text.replace("\u200b", "")
+
+
+def _segments(text: str):
+    """Split text into runs of letters, marks and digits (Thai vowels and
+    tone marks are combining marks, so they stay inside their run)"""
+    run = []
+    for ch in text:
+        if unicodedata.category(ch)[0] in ("L", "M", "N"):
+            run.append(ch)
+        elif run:
+            yield "".join(run)
+            run = []
+    if run:
+        yield "".join(run)
+
+
+def tokenize(text: str) -> list[str]:
+    terms = []
+    for seg in _segments(normalize(text)):
+        if len(seg) <= NGRAM_SIZES[0]:
+            terms.append(seg)
+            continue
+        for n in NGRAM_SIZES:
+            terms.extend(seg[i:i + n] for i in range(len(seg) - n + 1))
+    return terms
+
+
+class KnowledgeIndex:
+    """In-memory BM25 index over knowledge entries"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, entry: dict, modified: str = None):
+        name = entry["name"]
+        self.remove(name)
+        # Questions are what users paraphrase, so they count double
+        question = tokenize(entry.get("question"))
+        tf = Counter(question)
+        tf.update(question)
+        tf.update(tokenize(entry.get("category")))
+        tf.update(tokenize(entry.get("answer")))
+
+        length = sum(tf.values())
+        self.docs[name] = (entry, tf, length, modified)
+        self.total_length += length
+        for term, count in tf.items():
+            self.postings.setdefault(term, {})[name] = count
+
+    def remove(self, name):
+        doc = self.docs.pop(name, None)
+        if not doc:
+            return
+        _entry, tf, length, _modified = doc
+        self.total_length -= length
+        for term in tf:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(name, None)
+            if not posting:
+                del self.postings[term]
+
+    def sync(self, manifest: dict, fetch):
+        """Bring the index in line with ``manifest`` ({name: modified}),
+        calling ``fetch(names)`` only for new or changed entries"""
+        for name in [n for n in self.docs if n not in manifest]:
+            self.remove(name)
+        changed = [
+            name for name, modified in manifest.items()
+            if name not in self.docs or self.docs[name][3] != modified
+        ]
+        if changed:
+            for entry in fetch(changed):
+                self.add(entry, manifest.get(entry["name"]))
+
+    def search(self, query: str, top_k: int = DEFAULT_TOP_K) -> list[dict]:
+        n_docs = len(self.docs)
+        if not n_docs or top_k <= 0:
+            return []
+        avgdl = self.total_length / n_docs
+        # n-grams found in most entries ("ขั้", "ทำ") carry almost no signal but
+        # dominate the scoring cost, so treat them as stop-terms
+        max_df = max(n_docs // 2, 1)
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting or (n_docs > 10 and len(posting) > max_df):
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for name, tf in posting.items():
+                dl = self.docs[name][2]
+                score = idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+                scores[name] = scores.get(name, 0.0) + score
+        top = heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
+        return [self.docs[name][0] for name, _score in top]
+
+
+def format_entries(entries: list[dict]) -> str:
+    if not entries:
+        return ""
+    parts = [KNOWLEDGE_HEADER]
+    for e in entries:
+        cat = f" [{e['category']}]" if e.get("category") else ""
+        parts.append(f"\nQ{cat}: {e['question']}\nA: {e['answer']}\n")
+    return "".join(parts)
+
+
+# ---------------------------------------------------------------------------
+# Per-process index, synced from the database
+# ---------------------------------------------------------------------------
+
+def _build_manifest() -> dict:
+    if not frappe.db.exists("DocType", "KMP Knowledge Entry"):
+        return {}
+    rows = frappe.get_all(
+        "KMP Knowledge Entry",
+        filters={"is_active": 1},
+        fields=["name", "modified"],
+        ignore_permissions=True,
+    )
+    return {r["name"]: str(r["modified"]) for r in rows}
+
+
+def _fetch_entries(names: list) -> list[dict]:
+    return frappe.get_all(
+        "KMP Knowledge Entry",
+        filters={"name": ["in", names]},
+        fields=["name", "question", "answer", "category"],
+        ignore_permissions=True,
+    )
+
+
+_manifest = VersionedCache("knowledge_manifest", _build_manifest)
+_indexes = {}
+
+
+def clear_knowledge_index():
+    """Make every worker re-sync its index once the transaction commits"""
+    _manifest.invalidate_after_commit()
+
+
+def get_version() -> str:
+    """Token that changes whenever a knowledge entry changes"""
+    return _manifest.version()
+
+
+def get_index() -> KnowledgeIndex:
+    manifest = _manifest.get()
+    site = frappe.local.site
+    synced_manifest, index = _indexes.get(site, (None, None))
+    if index is None:
+        index = KnowledgeIndex()
+    if synced_manifest is not manifest:
+        index.sync(manifest, _fetch_entries)
+        _indexes[site] = (manifest, index)
+    return index
+
+
+def retrieve(query: str, top_k: int = None) -> list[dict]:
+    """Return the knowledge entries most relevant to ``query``"""
+    if not query:
+        return []
+    if top_k is None:
+        top_k = cint(frappe.conf.get("kmp_assistant_knowledge_top_k") or DEFAULT_TOP_K)
+    return get_index().search(query, top_k)
@@ -0,0 +1,194 @@
+"""
+KMP Assistant - Shared OpenAI client with timeouts, retries and a circuit breaker
+
+Clients are cached per process, keyed by API key and base URL, so turns
+reuse the keep-alive connection pool instead of paying a TLS handshake
+each time. ``chat_completion`` retries 429/5xx and connection errors with
+jittered exponential backoff, and a per-endpoint circuit breaker fails
+fast while the upstream keeps failing.
+
+Site config (all optional):
+
+    openai_base_url                        OpenAI-compatible endpoint, e.g. a
+                                           local mock server for testing
+    kmp_assistant_llm_connect_timeout      seconds, default 5
+    kmp_assistant_llm_read_timeout         seconds, default 60
+    kmp_assistant_llm_max_retries          default 3
+    kmp_assistant_llm_breaker_threshold    consecutive failed calls, default 5
+    kmp_assistant_llm_breaker_cooldown     seconds, default 30
+"""
+import random
+import threading
+import time
+
+import frappe
+import httpx
+import openai
+from frappe import _
+from frappe.utils import cint, flt
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+MAX_CONNECTIONS = 20
+
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30
+
+_clients = {}
+_breakers = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """The upstream has been failing; calls are refused until the cooldown ends"""
+
+
+# ---------------------------------------------------------------------------
+# Client pool
+# ---------------------------------------------------------------------------
+
+def get_client(api_key: str, base_url: str = None) -> openai.OpenAI:
+    """The process-wide client for ``(api_key, base_url)``.
+
+    Timeouts are read when the client is first built; restart workers to
+    pick up changed values.
+    """
+    key = (api_key, base_url or None)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                timeout = httpx.Timeout(
+                    flt(frappe.conf.get("kmp_assistant_llm_read_timeout")) or DEFAULT_READ_TIMEOUT,
+                    connect=flt(frappe.conf.get("kmp_assistant_llm_connect_timeout")) or DEFAULT_CONNECT_TIMEOUT,
+                )
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url or None,
+                    timeout=timeout,
+                    # Retries are handled by chat_completion so they feed the breaker
+                    max_retries=0,
+                    http_client=httpx.Client(
+                        timeout=timeout,
+                        limits=httpx.Limits(
+                            max_connections=MAX_CONNECTIONS,
+                            max_keepalive_connections=MAX_CONNECTIONS,
+                        ),
+                    ),
+                )
+                _clients[key] = client
+    return client
+
+
+# ---------------------------------------------------------------------------
+# Circuit breaker
+# ---------------------------------------------------------------------------
+
+class _Breaker:
+    """Open after ``threshold`` consecutive failures; after ``cooldown``
+    seconds a single trial call is let through (half-open)"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def before_call(self):
+        with _lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_running:
+                raise CircuitOpenError(_("AI service is temporarily unavailable"))
+            self.trial_running = True
+
+    def record_success(self):
+        with _lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with _lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+
+def _get_breaker(client: openai.OpenAI) -> _Breaker:
+    key = str(client.base_url)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(key, _Breaker(
+                cint(frappe.conf.get("kmp_assistant_llm_breaker_threshold")) or DEFAULT_BREAKER_THRESHOLD,
+                flt(frappe.conf.get("kmp_assistant_llm_breaker_cooldown")) or DEFAULT_BREAKER_COOLDOWN,
+            ))
+    return breaker
+
+
+def get_breaker_states() -> dict:
+    return {url: breaker.state() for url, breaker in _breakers.items()}
+
+
+# ---------------------------------------------------------------------------
+# Calls
+# ---------------------------------------------------------------------------
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        # APITimeoutError is a subclass of APIConnectionError
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, honouring a short ``Retry-After``"""
+    response = getattr(error, "response", None)
+    retry_after = flt(response.headers.get("retry-after")) if response is not None else 0
+    if 0 < retry_after <= BACKOFF_MAX:
+        return retry_after
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def chat_completion(client: openai.OpenAI, **kwargs):
+    """``client.chat.completions.create(**kwargs)`` with retries and the breaker.
+
+    For ``stream=True`` only opening the stream is retried; an error while
+    reading it propagates to the caller.
+    """
+    breaker = _get_breaker(client)
+    max_retries = cint(frappe.conf.get("kmp_assistant_llm_max_retries", DEFAULT_MAX_RETRIES))
+    # The breaker counts logical calls: one failure once the retries are
+    # used up, so a single slow request cannot trip it for everyone
+    breaker.before_call()
+    attempt = 0
+    while True:
+        try:
+            response = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if not _is_retryable(e):
+                # The upstream answered; the request itself was bad
+                breaker.record_success()
+                raise
+            if attempt >= max_retries:
+                breaker.record_failure()
+                raise
+            time.sleep(_retry_delay(attempt, e))
+            attempt += 1
+            continue
+        breaker.record_success()
+        return response
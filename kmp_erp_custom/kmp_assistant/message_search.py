@@ -0,0 +1,232 @@
+"""
+KMP Assistant - Full-text search over chat messages
+
+MariaDB has no n-gram FULLTEXT parser for Thai, so message content is
+indexed in a per-site SQLite FTS5 sidecar using the trigram tokenizer,
+which matches any substring of three or more characters regardless of
+word boundaries. The sidecar lives in the site's private files and is
+kept in sync by a deduplicated background job that indexes messages
+created after the last indexed ``(creation, name)``.
+"""
+import os
+import sqlite3
+
+import frappe
+from frappe.utils import add_to_date, cint, escape_html
+
+SYNC_BATCH_SIZE = 5000
+SYNC_OVERLAP_SECONDS = 60
+MAX_HITS = 1000
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    message TEXT NOT NULL UNIQUE,
+    session TEXT NOT NULL,
+    role TEXT,
+    creation TEXT
+);
+CREATE INDEX IF NOT EXISTS docs_session ON docs (session);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(content, tokenize = 'trigram');
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def get_index_path() -> str:
+    return frappe.get_site_path("private", "kmp_assistant", "message_search.sqlite3")
+
+
+def _connect() -> sqlite3.Connection:
+    path = get_index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _get_meta(conn, key: str, default: str = "") -> str:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(conn, key: str, value: str):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+# ---------------------------------------------------------------------------
+# Indexing
+# ---------------------------------------------------------------------------
+
+def enqueue_sync():
+    frappe.enqueue(
+        "kmp_erp_custom.kmp_assistant.message_search.sync",
+        queue="short",
+        job_id="kmp_assistant_message_search_sync",
+        deduplicate=True,
+    )
+
+
+def sync(max_batches: int = None):
+    """Index messages created since the last sync, in batches.
+
+    Each run starts a little before the stored watermark so messages whose
+    transaction committed late are still picked up; rows already indexed
+    are skipped by the unique ``message`` column.
+    """
+    conn = _connect()
+    try:
+        watermark = _get_meta(conn, "last_creation")
+        last_creation = (
+            str(add_to_date(watermark, seconds=-SYNC_OVERLAP_SECONDS)) if watermark else "1900-01-01 00:00:00"
+        )
+        last_name = ""
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = frappe.db.sql("""
+                SELECT name, parent, role, content, creation
+                FROM `tabKMP Chat Message`
+                WHERE parenttype = 'KMP Chat Session'
+                    AND (creation > %(creation)s OR (creation = %(creation)s AND name > %(name)s))
+                ORDER BY creation ASC, name ASC
+                LIMIT %(limit)s
+            """, {"creation": last_creation, "name": last_name, "limit": SYNC_BATCH_SIZE}, as_dict=True)
+            if not rows:
+                break
+
+            with conn:
+                for row in rows:
+                    cur = conn.execute(
+                        "INSERT OR IGNORE INTO docs (message, session, role, creation) VALUES (?, ?, ?, ?)",
+                        (row.name, row.parent, row.role, str(row.creation)),
+                    )
+                    if cur.rowcount:
+                        conn.execute(
+                            "INSERT INTO docs_fts (rowid, content) VALUES (?, ?)",
+                            (cur.lastrowid, row.content or ""),
+                        )
+                last_creation, last_name = str(rows[-1].creation), rows[-1].name
+                _set_meta(conn, "last_creation", last_creation)
+            batches += 1
+    finally:
+        conn.close()
+
+
+def _remove_session(session_name: str):
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM docs_fts WHERE rowid IN (SELECT id FROM docs WHERE session = ?)",
+                    (session_name,),
+                )
+                conn.execute("DELETE FROM docs WHERE session = ?", (session_name,))
+        finally:
+            conn.close()
+    except Exception:
+        frappe.log_error(title="KMP Assistant message search")
+
+
+def remove_session(session_name: str):
+    """Drop a deleted session's messages from the index once the delete commits"""
+    frappe.db.after_commit.add(lambda: _remove_session(session_name))
+
+
+def rebuild():
+    """Drop the sidecar and index every message again.
+
+    bench --site <site> execute kmp_erp_custom.kmp_assistant.message_search.rebuild
+    """
+    for suffix in ("", "-wal", "-shm"):
+        path = get_index_path() + suffix
+        if os.path.exists(path):
+            os.remove(path)
+    sync()
+
+
+# ---------------------------------------------------------------------------
+# Querying
+# ---------------------------------------------------------------------------
+
+def _match_expression(query: str) -> str:
+    """Every whitespace-separated term must appear (as a substring)"""
+    terms = [t for t in query.split() if t]
+    return " AND ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _highlight(snippet: str) -> str:
+    return (
+        escape_html(snippet or "")
+        .replace(SNIPPET_OPEN, "<mark>")
+        .replace(SNIPPET_CLOSE, "</mark>")
+    )
+
+
+def search(query: str, limit: int = 20) -> list[dict]:
+    """Sessions whose messages match ``query``, best match first.
+
+    Each result carries the best-ranked message's highlighted snippet and
+    the number of matching messages in the session.
+    """
+    query = (query or "").strip()
+    limit = cint(limit) or 20
+    if not query:
+        return []
+
+    conn = _connect()
+    try:
+        if all(len(t) >= 3 for t in query.split()):
+            hits = conn.execute(f"""
+                SELECT d.session, d.message, d.role, d.creation,
+                    snippet(docs_fts, 0, ?, ?, '…', 32) AS snippet,
+                    bm25(docs_fts) AS score
+                FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid
+                WHERE docs_fts MATCH ?
+                ORDER BY score
+                LIMIT {MAX_HITS}
+            """, (SNIPPET_OPEN, SNIPPET_CLOSE, _match_expression(query))).fetchall()
+        else:
+            # Trigrams need three characters; short terms fall back to a scan
+            # of the sidecar (still off the main database)
+            like = "%" + query.replace("%", "").replace("_", "") + "%"
+            hits = conn.execute(f"""
+                SELECT d.session, d.message, d.role, d.creation,
+                    substr(docs_fts.content, 1, 120) AS snippet, 0 AS score
+                FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid
+                WHERE docs_fts.content LIKE ?
+                ORDER BY d.creation DESC
+                LIMIT {MAX_HITS}
+            """, (like,)).fetchall()
+    finally:
+        conn.close()
+
+    sessions = {}
+    for session, message, role, creation, snippet, score in hits:
+        result = sessions.get(session)
+        if result is None:
+            if len(sessions) >= limit:
+                continue
+            sessions[session] = {
+                "session": session,
+                "message": message,
+                "role": role,
+                "creation": creation,
+                "snippet": _highlight(snippet),
+                "score": score,
+                "hits": 1,
+            }
+        else:
+            result["hits"] += 1
+
+    if sessions:
+        for row in frappe.get_all(
+            "KMP Chat Session",
+            filters={"name": ["in", list(sessions)]},
+            fields=["name", "user", "modified", "preview"],
+        ):
+            sessions[row.name].update({"user": row.user, "modified": row.modified, "preview": row.preview})
+    # Sessions deleted since they were indexed have no row any more
+    return [s for s in sessions.values() if "user" in s]
@@ -12,6 +12,7 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
         { id: 'feedback',  icon: '👍', label: 'Feedback' },
         { id: 'knowledge', icon: '📝', label: 'Knowledge Base' },
         { id: 'tools',     icon: '🔧', label: 'Tools' },
+        { id: 'performance', icon: '⏱️', label: 'Performance' },
     ];
 
     const API = 'kmp_erp_custom.kmp_assistant.api';
@@ -85,6 +86,27 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                             <div class="stat-label">Feedback Score</div>
                             <div class="stat-value">${total_fb ? pos_pct+'%' : 'N/A'}</div>
                         </div>
+                        <div class="kmp-stat-card">
+                            <span class="stat-icon">⏱️</span>
+                            <div class="stat-label">Avg Response</div>
+                            <div class="stat-value">${d.avg_latency_ms ? (d.avg_latency_ms/1000).toFixed(1)+'s' : 'N/A'}</div>
+                        </div>
+                        <div class="kmp-stat-card">
+                            <span class="stat-icon">🔢</span>
+                            <div class="stat-label">Total Tokens</div>
+                            <div class="stat-value">${format_number(d.total_tokens||0, null, 0)}</div>
+                        </div>
+                    </div>
+
+                    <div class="kmp-table-card">
+                        <div class="card-header">
+                            Usage Trend
+                            <select class="form-control" id="trend-days" style="float:right;width:auto;height:26px;padding:0 8px;font-size:12px;">
+                                <option value="30">30 days</option>
+                                <option value="90">90 days</option>
+                            </select>
+                        </div>
+                        <div id="trend-chart" style="padding:8px 16px;"></div>
                     </div>
 
                     <div class="kmp-table-card">
@@ -113,6 +135,45 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                         </table>
                     </div>
                 `);
+                $('#trend-days').on('change', function() { loadTrend(cint(this.value)); });
+                loadTrend(30);
+            }
+        });
+    }
+
+    function loadTrend(days) {
+        frappe.call({
+            method: `${API}.get_dashboard_trend`,
+            args: { days },
+            callback(r) {
+                // Days without activity have no stats row; fill them with zeros
+                const byDate = {};
+                (r.message||[]).forEach(row => { byDate[row.date] = row; });
+                const labels = [], sessions = [], messages = [], users = [];
+                for (let i = days - 1; i >= 0; i--) {
+                    const date = frappe.datetime.add_days(frappe.datetime.get_today(), -i);
+                    const row = byDate[date] || {};
+                    labels.push(frappe.datetime.str_to_user(date));
+                    sessions.push(row.sessions || 0);
+                    messages.push(row.messages || 0);
+                    users.push(row.active_users || 0);
+                }
+                $('#trend-chart').empty();
+                new frappe.Chart('#trend-chart', {
+                    type: 'line',
+                    height: 220,
+                    colors: ['#FF5B04', '#075056', '#7cd6fd'],
+                    data: {
+                        labels,
+                        datasets: [
+                            { name: 'Messages', values: messages },
+                            { name: 'Sessions', values: sessions },
+                            { name: 'Active Users', values: users },
+                        ],
+                    },
+                    axisOptions: { xIsSeries: true, xAxisMode: 'tick' },
+                    lineOptions: { hideDots: 1, regionFill: 0 },
+                });
             }
         });
     }
@@ -151,6 +212,16 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                             <label>System Prompt</label>
                             <textarea class="form-control" id="set-prompt">${frappe.utils.escape_html(s.system_prompt||'')}</textarea>
                         </div>
+                        <div class="form-group">
+                            <label>
+                                <input type="checkbox" id="set-answer-cache" ${s.enable_answer_cache?'checked':''}>
+                                Answer Cache (reuse answers to repeated first questions)
+                            </label>
+                        </div>
+                        <div class="form-group">
+                            <label>Max Cached Answers</label>
+                            <input type="number" min="1" class="form-control" id="set-answer-cache-size" value="${s.answer_cache_size}">
+                        </div>
                         <button class="btn-kmp" id="save-settings">💾 Save Settings</button>
                         <span id="settings-status" style="margin-left:12px;"></span>
                     </div>
@@ -165,6 +236,8 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                             ai_model: $('#set-model').val(),
                             temperature: $('#set-temp').val(),
                             system_prompt: $('#set-prompt').val(),
+                            enable_answer_cache: $('#set-answer-cache').is(':checked') ? 1 : 0,
+                            answer_cache_size: $('#set-answer-cache-size').val(),
                         },
                         callback() {
                             $('#settings-status').html('<span style="color:green">✅ Saved!</span>');
@@ -180,6 +253,8 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
     // =====================================================================
     // TAB 3: Chat History
     // =====================================================================
+    // Keyset pagination: cursors[i] is the cursor that loads page i
+    let historyCursors = [null];
     let historyPage = 0;
     const historyLimit = 20;
 
@@ -187,24 +262,71 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
         const $el = $('#tab-history');
         $el.html(`
             <div class="kmp-search-bar">
-                <input type="text" class="form-control" id="history-search" placeholder="🔍 Search by user...">
+                <input type="text" class="form-control" id="history-search" placeholder="🔍 Search by user (starts with)...">
                 <button class="btn-kmp-outline" id="history-search-btn">Search</button>
             </div>
+            <div class="kmp-search-bar">
+                <input type="text" class="form-control" id="message-search" placeholder="🔎 Search message content (item code, customer, error...)">
+                <button class="btn-kmp-outline" id="message-search-btn">Search messages</button>
+            </div>
+            <div id="message-search-results"></div>
             <div id="history-table"></div>
             <div id="history-detail"></div>
         `);
-        $('#history-search-btn').on('click', () => { historyPage = 0; fetchHistory(); });
-        $('#history-search').on('keypress', (e) => { if(e.which===13){ historyPage=0; fetchHistory(); }});
+        $('#history-search-btn').on('click', () => { resetHistoryPaging(); fetchHistory(); });
+        $('#history-search').on('keypress', (e) => { if(e.which===13){ resetHistoryPaging(); fetchHistory(); }});
+        $('#message-search-btn').on('click', searchMessages);
+        $('#message-search').on('keypress', (e) => { if(e.which===13) searchMessages(); });
         fetchHistory();
     }
 
+    function searchMessages() {
+        const query = ($('#message-search').val() || '').trim();
+        const $res = $('#message-search-results');
+        if (!query) { $res.html(''); return; }
+        $res.html('<div class="kmp-loading">⏳ Searching...</div>');
+        frappe.call({
+            method: `${API}.search_messages`,
+            args: { query, limit: 20 },
+            callback(r) {
+                // snippet is escaped server-side; only <mark> tags are added
+                let rows = (r.message||[]).map(s => `
+                    <tr class="clickable" data-id="${s.session}">
+                        <td>${frappe.utils.escape_html(s.user||'')}</td>
+                        <td>${s.snippet||''}</td>
+                        <td>${s.hits}</td>
+                        <td>${frappe.datetime.prettyDate(s.modified)}</td>
+                    </tr>
+                `).join('') || '<tr><td colspan="4" class="text-center text-muted">No matching messages</td></tr>';
+                $res.html(`
+                    <div class="kmp-table-card">
+                        <div class="card-header">
+                            Message matches for "${frappe.utils.escape_html(query)}"
+                            <button class="btn-kmp-outline" style="float:right;" onclick="$('#message-search-results').html('')">✕</button>
+                        </div>
+                        <table>
+                            <thead><tr><th>User</th><th>Match</th><th>Hits</th><th>Last Active</th></tr></thead>
+                            <tbody>${rows}</tbody>
+                        </table>
+                    </div>
+                `);
+                $res.find('tr.clickable').on('click', function() { showSessionDetail($(this).data('id')); });
+            }
+        });
+    }
+
+    function resetHistoryPaging() {
+        historyCursors = [null];
+        historyPage = 0;
+    }
+
     function fetchHistory() {
         const search = $('#history-search').val() || '';
         const $table = $('#history-table').html('<div class="kmp-loading">⏳ Loading...</div>');
         $('#history-detail').html('');
         frappe.call({
             method: `${API}.get_all_sessions`,
-            args: { limit: historyLimit, offset: historyPage * historyLimit, search },
+            args: { limit: historyLimit, cursor: historyCursors[historyPage], search },
             callback(r) {
                 const d = r.message;
                 const total = d.total || 0;
@@ -219,19 +341,20 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                     </tr>
                 `).join('') || '<tr><td colspan="6" class="text-center text-muted">No sessions</td></tr>';
 
-                const pages = Math.ceil(total / historyLimit);
+                historyCursors[historyPage + 1] = d.next_cursor || null;
+                const hasNext = !!d.next_cursor;
                 $table.html(`
                     <div class="kmp-table-card">
-                        <div class="card-header">Chat Sessions <span class="text-muted" style="font-weight:normal;font-size:12px;">(${total} total)</span></div>
+                        <div class="card-header">Chat Sessions <span class="text-muted" style="font-weight:normal;font-size:12px;">(~${total} total)</span></div>
                         <table>
                             <thead><tr><th>User</th><th>Msgs</th><th>Status</th><th>Created</th><th>Last Active</th><th></th></tr></thead>
                             <tbody>${rows}</tbody>
                         </table>
-                        ${pages > 1 ? `
+                        ${(historyPage > 0 || hasNext) ? `
                         <div class="kmp-pagination">
                             <button class="btn-kmp-outline" id="hist-prev" ${historyPage===0?'disabled':''}>← Prev</button>
-                            <span>Page ${historyPage+1} / ${pages}</span>
-                            <button class="btn-kmp-outline" id="hist-next" ${historyPage>=pages-1?'disabled':''}>Next →</button>
+                            <span>Page ${historyPage+1}</span>
+                            <button class="btn-kmp-outline" id="hist-next" ${hasNext?'':'disabled'}>Next →</button>
                         </div>` : ''}
                     </div>
                 `);
@@ -243,7 +366,7 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                     e.stopPropagation();
                     const id = $(this).data('id');
                     frappe.confirm('Delete this session?', () => {
-                        frappe.call({ method: `${API}.delete_session`, args: {session_id: id}, callback() { fetchHistory(); }});
+                        frappe.call({ method: `${API}.delete_session`, args: {session_id: id}, callback() { resetHistoryPaging(); fetchHistory(); }});
                     });
                 });
                 $('#hist-prev').on('click', () => { historyPage--; fetchHistory(); });
@@ -280,6 +403,7 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
     // =====================================================================
     // TAB 4: Feedback
     // =====================================================================
+    let fbCursors = [null];
     let fbPage = 0;
     const fbLimit = 20;
 
@@ -295,7 +419,7 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
             </div>
             <div id="fb-table"></div>
         `);
-        $('#fb-filter').on('change', () => { fbPage = 0; fetchFeedback(); });
+        $('#fb-filter').on('change', () => { fbCursors = [null]; fbPage = 0; fetchFeedback(); });
         fetchFeedback();
     }
 
@@ -304,7 +428,7 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
         const $table = $('#fb-table').html('<div class="kmp-loading">⏳ Loading...</div>');
         frappe.call({
             method: `${API}.get_all_feedback`,
-            args: { limit: fbLimit, offset: fbPage * fbLimit, rating_filter: filter },
+            args: { limit: fbLimit, cursor: fbCursors[fbPage], rating_filter: filter },
             callback(r) {
                 const d = r.message;
                 const total = d.total || 0;
@@ -318,19 +442,20 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                     </tr>
                 `).join('') || '<tr><td colspan="5" class="text-center text-muted">No feedback</td></tr>';
 
-                const pages = Math.ceil(total / fbLimit);
+                fbCursors[fbPage + 1] = d.next_cursor || null;
+                const hasNext = !!d.next_cursor;
                 $table.html(`
                     <div class="kmp-table-card">
-                        <div class="card-header">Feedback <span class="text-muted" style="font-weight:normal;font-size:12px;">(${total} total)</span></div>
+                        <div class="card-header">Feedback <span class="text-muted" style="font-weight:normal;font-size:12px;">(~${total} total)</span></div>
                         <table>
                             <thead><tr><th>Date</th><th>User</th><th>Session</th><th>Rating</th><th>Comment</th></tr></thead>
                             <tbody>${rows}</tbody>
                         </table>
-                        ${pages > 1 ? `
+                        ${(fbPage > 0 || hasNext) ? `
                         <div class="kmp-pagination">
                             <button class="btn-kmp-outline" id="fb-prev" ${fbPage===0?'disabled':''}>← Prev</button>
-                            <span>Page ${fbPage+1} / ${pages}</span>
-                            <button class="btn-kmp-outline" id="fb-next" ${fbPage>=pages-1?'disabled':''}>Next →</button>
+                            <span>Page ${fbPage+1}</span>
+                            <button class="btn-kmp-outline" id="fb-next" ${hasNext?'':'disabled'}>Next →</button>
                         </div>` : ''}
                     </div>
                     <div id="fb-detail"></div>
@@ -465,7 +590,11 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                 // Known tools from helper definitions (we'll list common ones)
                 const knownTools = [
                     { name: 'search_bom', desc: 'ค้นหาสูตรตำรับ (Bill of Materials)' },
+                    { name: 'explode_bom', desc: 'แตกสูตรตำรับทุกระดับเป็นวัตถุดิบและต้นทุน' },
+                    { name: 'get_yield_analysis', desc: 'วิเคราะห์ Yield การผลิต' },
                     { name: 'check_stock', desc: 'เช็คสต็อกสินค้า' },
+                    { name: 'get_stock_summary', desc: 'สรุปยอดสต็อกรวมต่อสินค้า' },
+                    { name: 'get_low_stock_items', desc: 'สินค้าต่ำกว่าจุดสั่งซื้อ' },
                     { name: 'search_sales_order', desc: 'ค้นหา Sales Order' },
                     { name: 'search_purchase_order', desc: 'ค้นหา Purchase Order' },
                     { name: 'search_customer', desc: 'ค้นหาข้อมูลลูกค้า' },
@@ -499,7 +628,11 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
                     </div>
                     <button class="btn-kmp" id="save-tools">💾 Save Tools Config</button>
                     <span id="tools-status" style="margin-left:12px;"></span>
+                    <div id="tool-cache-stats" style="margin-top:20px;"></div>
+                    <div id="answer-cache-stats" style="margin-top:20px;"></div>
                 `);
+                fetchToolCacheStats();
+                fetchAnswerCacheStats();
 
                 $el.find('.tool-toggle').on('change', function() {
                     const lbl = $(this).next('span');
@@ -524,6 +657,161 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
         });
     }
 
+    function fetchToolCacheStats() {
+        const $box = $('#tool-cache-stats').html('<div class="kmp-loading">⏳ Loading...</div>');
+        frappe.call({
+            method: `${API}.get_tool_cache_stats`,
+            callback(r) {
+                let rows = (r.message||[]).map(t => `
+                    <tr>
+                        <td>${t.tool}</td>
+                        <td>${t.ttl}s</td>
+                        <td>${t.hits}</td>
+                        <td>${t.misses}</td>
+                        <td>${t.hit_rate}%</td>
+                    </tr>
+                `).join('');
+                $box.html(`
+                    <div class="kmp-table-card">
+                        <div class="card-header">
+                            Tool Result Cache
+                            <button class="btn-kmp-outline" id="reset-cache-stats" style="float:right;">Reset counters</button>
+                        </div>
+                        <table>
+                            <thead><tr><th>Tool</th><th>TTL</th><th>Hits</th><th>Misses</th><th>Hit Rate</th></tr></thead>
+                            <tbody>${rows}</tbody>
+                        </table>
+                    </div>
+                `);
+                $('#reset-cache-stats').on('click', () => {
+                    frappe.call({ method: `${API}.reset_tool_cache_stats`, callback() { fetchToolCacheStats(); }});
+                });
+            }
+        });
+    }
+
+    function fetchAnswerCacheStats() {
+        const $box = $('#answer-cache-stats').html('<div class="kmp-loading">⏳ Loading...</div>');
+        frappe.call({
+            method: `${API}.get_answer_cache_stats`,
+            callback(r) {
+                const s = r.message || {};
+                $box.html(`
+                    <div class="kmp-table-card">
+                        <div class="card-header">
+                            Answer Cache
+                            <button class="btn-kmp-outline" id="purge-answer-cache" style="float:right;">Purge</button>
+                        </div>
+                        <table>
+                            <thead><tr><th>Entries</th><th>Hits</th><th>Misses</th><th>Hit Rate</th></tr></thead>
+                            <tbody><tr><td>${s.entries}</td><td>${s.hits}</td><td>${s.misses}</td><td>${s.hit_rate}%</td></tr></tbody>
+                        </table>
+                    </div>
+                `);
+                $('#purge-answer-cache').on('click', () => {
+                    frappe.confirm('Purge all cached answers?', () => {
+                        frappe.call({ method: `${API}.purge_answer_cache`, callback() { fetchAnswerCacheStats(); }});
+                    });
+                });
+            }
+        });
+    }
+
+    // =====================================================================
+    // TAB 7: Performance
+    // =====================================================================
+    function loadPerformance(hours) {
+        hours = hours || 24;
+        const $el = $('#tab-performance').html('<div class="kmp-loading">⏳ Loading...</div>');
+        frappe.call({
+            method: `${API}.get_performance_summary`,
+            args: { hours },
+            callback(r) {
+                const d = r.message || {};
+                const pctRows = (rows, withDb) => (rows||[]).map(x => `
+                    <tr>
+                        <td>${frappe.utils.escape_html(x.name||'')}</td>
+                        <td>${x.count}</td>
+                        <td>${x.p50} ms</td>
+                        <td>${x.p95} ms</td>
+                        <td>${x.p99} ms</td>
+                        ${withDb ? `<td>${x.avg_db_queries}</td>` : ''}
+                    </tr>
+                `).join('') || `<tr><td colspan="${withDb ? 6 : 5}" style="text-align:center;color:#999;">No data</td></tr>`;
+                const slowRows = (d.slowest_turns||[]).map(t => `
+                    <tr class="kmp-turn-row" data-turn="${t.turn_id}" style="cursor:pointer;">
+                        <td>${frappe.datetime.str_to_user(t.creation)}</td>
+                        <td>${frappe.utils.escape_html(t.user||'')}</td>
+                        <td>${frappe.utils.escape_html(t.label||'')}</td>
+                        <td>${Math.round(t.duration_ms)} ms</td>
+                        <td>${t.prompt_tokens} / ${t.completion_tokens} (${t.cached_tokens} cached)</td>
+                    </tr>
+                `).join('') || '<tr><td colspan="5" style="text-align:center;color:#999;">No data</td></tr>';
+
+                $el.html(`
+                    <div style="margin-bottom:12px;">
+                        <select class="form-control" id="perf-hours" style="width:auto;display:inline-block;">
+                            <option value="24" ${hours==24?'selected':''}>Last 24 hours</option>
+                            <option value="168" ${hours==168?'selected':''}>Last 7 days</option>
+                        </select>
+                    </div>
+                    <div class="kmp-table-card">
+                        <div class="card-header">Latency by Stage</div>
+                        <table>
+                            <thead><tr><th>Stage</th><th>Count</th><th>p50</th><th>p95</th><th>p99</th></tr></thead>
+                            <tbody>${pctRows(d.stages)}</tbody>
+                        </table>
+                    </div>
+                    <div class="kmp-table-card">
+                        <div class="card-header">Latency by Tool</div>
+                        <table>
+                            <thead><tr><th>Tool</th><th>Count</th><th>p50</th><th>p95</th><th>p99</th><th>Avg DB Queries</th></tr></thead>
+                            <tbody>${pctRows(d.tools, true)}</tbody>
+                        </table>
+                    </div>
+                    <div class="kmp-table-card">
+                        <div class="card-header">Slowest Turns</div>
+                        <table>
+                            <thead><tr><th>Time</th><th>User</th><th>Model</th><th>Duration</th><th>Tokens (prompt / completion)</th></tr></thead>
+                            <tbody>${slowRows}</tbody>
+                        </table>
+                    </div>
+                `);
+                $('#perf-hours').on('change', function() { loadPerformance(cint(this.value)); });
+                $el.find('.kmp-turn-row').on('click', function() { showTurnSpans($(this).data('turn')); });
+            }
+        });
+    }
+
+    function showTurnSpans(turnId) {
+        frappe.call({
+            method: `${API}.get_turn_spans`,
+            args: { turn_id: turnId },
+            callback(r) {
+                const rows = (r.message||[]).map(s => `
+                    <tr>
+                        <td>${s.stage}</td>
+                        <td>${frappe.utils.escape_html(s.label||'')}</td>
+                        <td>${Math.round(s.offset_ms)} ms</td>
+                        <td>${Math.round(s.duration_ms)} ms</td>
+                        <td>${s.stage === 'llm' || s.stage === 'turn' ? `${s.prompt_tokens} / ${s.completion_tokens} (${s.cached_tokens} cached)` : ''}</td>
+                        <td>${s.stage === 'tool' ? `${s.db_queries} (${Math.round(s.db_time_ms)} ms)` : ''}</td>
+                    </tr>
+                `).join('');
+                frappe.msgprint({
+                    title: __('Turn {0}', [turnId]),
+                    wide: true,
+                    message: `
+                        <table class="table table-bordered">
+                            <thead><tr><th>Stage</th><th>Label</th><th>Start</th><th>Duration</th><th>Tokens</th><th>DB Queries</th></tr></thead>
+                            <tbody>${rows}</tbody>
+                        </table>
+                    `
+                });
+            }
+        });
+    }
+
     // Loader map
     const loaders = {
         dashboard: loadDashboard,
@@ -532,6 +820,7 @@ frappe.pages['kmp-assistant'].on_page_load = function(wrapper) {
         feedback: loadFeedback,
         knowledge: loadKnowledge,
         tools: loadTools,
+        performance: () => loadPerformance(),
     };
 
     // Load default tab
@@ -0,0 +1,242 @@
+"""
+KMP Assistant - Per-turn timing and token telemetry
+
+A ``Trace`` collects spans for one chat turn in memory:
+
+    build     settings, knowledge retrieval and context assembly
+    llm       one OpenAI call (label = model) with its token usage
+    tool      one tool execution (label = tool) with DB query count/time
+    persist   saving the messages
+    turn      the whole turn (label = model, "cached" or "error")
+
+At the end of the turn the spans are pushed to a Redis list in one call;
+a scheduler job drains the list into ``KMP Assistant Span`` with bulk
+inserts, so the request path never writes telemetry rows itself.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import add_days, add_to_date, cint, now_datetime
+
+SPAN_DOCTYPE = "KMP Assistant Span"
+QUEUE_KEY = "kmp_assistant:telemetry_queue"
+MAX_QUEUED_TURNS = 20000
+FLUSH_BATCH_SIZE = 500
+DEFAULT_RETENTION_DAYS = 14
+MAX_SUMMARY_ROWS = 100000
+
+SPAN_FIELDS = (
+    "turn_id",
+    "session",
+    "stage",
+    "label",
+    "offset_ms",
+    "duration_ms",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "db_queries",
+    "db_time_ms",
+)
+
+
+class Trace:
+    """Spans of one chat turn. Safe to add to from tool worker threads."""
+
+    def __init__(self, session: str = None):
+        self.turn_id = frappe.generate_hash(length=16)
+        self.session = session
+        self.user = frappe.session.user
+        self.started_at = now_datetime()
+        self._start = time.perf_counter()
+        self.spans = []
+
+    def add(self, stage: str, label: str = None, duration_ms: float = 0, **metrics):
+        """Record a span that ended just now and lasted ``duration_ms``"""
+        offset_ms = (time.perf_counter() - self._start) * 1000 - duration_ms
+        self.spans.append({
+            "stage": stage,
+            "label": label,
+            "offset_ms": round(max(offset_ms, 0), 2),
+            "duration_ms": round(duration_ms, 2),
+            **metrics,
+        })
+
+    @contextmanager
+    def span(self, stage: str, label: str = None, **metrics):
+        """Time the enclosed block; the yielded dict can carry extra metrics"""
+        start = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            self.add(stage, label, (time.perf_counter() - start) * 1000, **metrics)
+
+    def finish(self, label: str = None, **metrics):
+        """Record the whole-turn span and queue the trace for writing"""
+        self.add("turn", label, (time.perf_counter() - self._start) * 1000, **metrics)
+        payload = json.dumps({
+            "turn_id": self.turn_id,
+            "session": self.session,
+            "user": self.user,
+            "started_at": str(self.started_at),
+            "spans": self.spans,
+        }, default=str)
+        try:
+            cache = frappe.cache()
+            cache.rpush(QUEUE_KEY, payload)
+            # Keep the backlog bounded if the flush job is not running
+            cache.ltrim(QUEUE_KEY, -MAX_QUEUED_TURNS, -1)
+        except Exception:
+            frappe.log_error(title="KMP Assistant telemetry")
+
+
+@contextmanager
+def count_queries():
+    """Count queries and their time on the current DB connection.
+
+    Tool calls on worker threads have their own connection, so the counts
+    only include the enclosed block's queries.
+    """
+    db = frappe.db
+    stats = {"db_queries": 0, "db_time_ms": 0.0}
+    previous = db.__dict__.get("sql")
+    sql = db.sql
+
+    def counted_sql(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return sql(*args, **kwargs)
+        finally:
+            stats["db_queries"] += 1
+            stats["db_time_ms"] += (time.perf_counter() - start) * 1000
+
+    db.sql = counted_sql
+    try:
+        yield stats
+    finally:
+        if previous is None:
+            del db.sql
+        else:
+            db.sql = previous
+        stats["db_time_ms"] = round(stats["db_time_ms"], 2)
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+def flush_spans(max_batches: int = 20):
+    """Scheduler job (every minute): move queued traces into the span table"""
+    cache = frappe.cache()
+    for _batch in range(max_batches):
+        payloads = cache.lrange(QUEUE_KEY, 0, FLUSH_BATCH_SIZE - 1)
+        if not payloads:
+            break
+
+        values = []
+        for payload in payloads:
+            trace = json.loads(frappe.safe_decode(payload))
+            for span in trace["spans"]:
+                values.append((
+                    frappe.generate_hash(length=12),
+                    trace["started_at"],
+                    trace["started_at"],
+                    trace["user"],
+                    trace["user"],
+                    trace["turn_id"],
+                    trace["session"],
+                    span["stage"],
+                    span.get("label"),
+                    span.get("offset_ms", 0),
+                    span.get("duration_ms", 0),
+                    cint(span.get("prompt_tokens")),
+                    cint(span.get("completion_tokens")),
+                    cint(span.get("cached_tokens")),
+                    cint(span.get("db_queries")),
+                    span.get("db_time_ms", 0),
+                ))
+        frappe.db.bulk_insert(
+            SPAN_DOCTYPE,
+            ("name", "creation", "modified", "owner", "modified_by", *SPAN_FIELDS),
+            values,
+        )
+        frappe.db.commit()
+        cache.ltrim(QUEUE_KEY, len(payloads), -1)
+
+
+def purge_old_spans():
+    """Scheduler job (daily): drop spans past the retention period"""
+    days = cint(frappe.conf.get("kmp_assistant_telemetry_days")) or DEFAULT_RETENTION_DAYS
+    frappe.db.delete(SPAN_DOCTYPE, {"creation": ["<", add_days(now_datetime(), -days)]})
+    frappe.db.commit()
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return round(sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo), 1)
+
+
+def get_summary(hours: int = 24) -> dict:
+    """p50/p95/p99 per stage and per tool, plus the slowest recent turns"""
+    since = add_to_date(now_datetime(), hours=-cint(hours))
+    rows = frappe.db.sql("""
+        SELECT stage, label, duration_ms, db_queries
+        FROM `tabKMP Assistant Span`
+        WHERE creation >= %s
+        ORDER BY creation DESC
+        LIMIT %s
+    """, (since, MAX_SUMMARY_ROWS), as_dict=True)
+
+    groups = {}
+    for row in rows:
+        keys = [("stage", row.stage)]
+        if row.stage == "tool":
+            keys.append(("tool", row.label))
+        for key in keys:
+            groups.setdefault(key, []).append(row)
+
+    def summarize(kind):
+        result = []
+        for (group_kind, name), members in sorted(groups.items(), key=lambda g: g[0][1] or ""):
+            if group_kind != kind:
+                continue
+            durations = sorted(r.duration_ms for r in members)
+            result.append({
+                "name": name,
+                "count": len(durations),
+                "p50": _percentile(durations, 50),
+                "p95": _percentile(durations, 95),
+                "p99": _percentile(durations, 99),
+                "avg_db_queries": round(sum(cint(r.db_queries) for r in members) / len(members), 1),
+            })
+        return result
+
+    slowest = frappe.db.sql("""
+        SELECT turn_id, session, owner AS user, label, duration_ms, prompt_tokens,
+            completion_tokens, cached_tokens, creation
+        FROM `tabKMP Assistant Span`
+        WHERE creation >= %s AND stage = 'turn'
+        ORDER BY duration_ms DESC
+        LIMIT 20
+    """, since, as_dict=True)
+
+    return {"stages": summarize("stage"), "tools": summarize("tool"), "slowest_turns": slowest}
+
+
+def get_turn(turn_id: str) -> list[dict]:
+    return frappe.get_all(
+        SPAN_DOCTYPE,
+        filters={"turn_id": turn_id},
+        fields=list(SPAN_FIELDS[2:]),
+        order_by="offset_ms asc",
+    )
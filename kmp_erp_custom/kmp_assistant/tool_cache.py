@@ -0,0 +1,161 @@
+"""
+KMP Assistant - Shared result cache for assistant tools
+
+Results are cached in Redis per tool, normalized arguments and permission
+scope. The key also carries the data version of every DocType the tool
+reads, and ``doc_events`` (see hooks.py) bump those versions, so a change
+to e.g. a BOM makes cached ``search_bom`` results unreachable at once;
+the per-tool TTL only bounds staleness for writes that bypass doc events.
+"""
+import hashlib
+import inspect
+import json
+
+import frappe
+from frappe.utils import cint
+
+from kmp_erp_custom.kmp_assistant.cache import bump_doctype_version, get_doctype_versions
+
+# tool name -> TTL (seconds) and the DocTypes whose changes invalidate it
+TOOL_CACHE_CONFIG = {
+    "search_bom": {"ttl": 600, "doctypes": ["BOM"]},
+    "explode_bom": {"ttl": 600, "doctypes": ["BOM"]},
+    "get_yield_analysis": {"ttl": 600, "doctypes": ["Stock Entry"]},
+    "check_stock": {"ttl": 60, "doctypes": ["Bin"]},
+    "get_stock_summary": {"ttl": 60, "doctypes": ["Bin"]},
+    "get_low_stock_items": {"ttl": 300, "doctypes": ["Bin", "Item", "Warehouse"]},
+    "get_order_status": {"ttl": 60, "doctypes": ["Sales Order", "Purchase Order"]},
+    "search_customer_supplier": {"ttl": 600, "doctypes": ["Customer", "Supplier"]},
+    "search_erp_general": {
+        "ttl": 300,
+        "doctypes": ["Item", "Item Group", "Warehouse", "Customer", "Supplier"],
+    },
+    "get_system_info": {
+        "ttl": 900,
+        "doctypes": ["Company", "Fiscal Year", "Item", "Customer", "Supplier", "Sales Order", "Purchase Order", "BOM"],
+    },
+    "get_recent_activity": {
+        "ttl": 60,
+        "doctypes": ["Sales Order", "Purchase Order", "Stock Entry", "Item"],
+    },
+}
+
+# Documents whose changes are reflected in another DocType's data
+DERIVED_DOCTYPES = {
+    "Stock Ledger Entry": "Bin",
+}
+
+STATS_KEY = "kmp_assistant:tool_cache_stats"
+
+
+def get_ttl(tool: str) -> int:
+    overrides = frappe.conf.get("kmp_assistant_tool_cache_ttl") or {}
+    if tool in overrides:
+        return cint(overrides[tool])
+    return TOOL_CACHE_CONFIG[tool]["ttl"]
+
+
+def _normalize_args(fn, args: dict) -> dict:
+    """Bind ``args`` to ``fn``'s signature so omitted defaults and explicit
+    defaults produce the same key; strings are trimmed"""
+    bound = inspect.signature(fn).bind(**args)
+    bound.apply_defaults()
+    normalized = {}
+    for key, value in bound.arguments.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ""):
+            normalized[key] = value
+    return normalized
+
+
+def _permission_scope() -> str:
+    """Users with the same roles and no User Permissions see the same data"""
+    from frappe.core.doctype.user_permission.user_permission import get_user_permissions
+
+    user = frappe.session.user
+    if user != "Administrator" and get_user_permissions(user):
+        return f"user:{user}"
+    return "roles:" + ",".join(sorted(frappe.get_roles(user)))
+
+
+def make_key(tool: str, fn, args: dict) -> str:
+    payload = json.dumps(
+        {
+            "args": _normalize_args(fn, args),
+            "scope": _permission_scope(),
+            "versions": get_doctype_versions(TOOL_CACHE_CONFIG[tool]["doctypes"]),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    digest = hashlib.sha1(payload.encode()).hexdigest()
+    return f"kmp_assistant:tool:{tool}:{digest}"
+
+
+def _count(tool: str, outcome: str):
+    cache = frappe.cache()
+    cache.incrby(cache.make_key(f"{STATS_KEY}:{tool}:{outcome}"), 1)
+
+
+def call_tool(tool: str, fn, args: dict):
+    """Run ``fn(**args)`` through the cache when the tool is cacheable"""
+    if tool not in TOOL_CACHE_CONFIG or cint(frappe.conf.get("kmp_assistant_disable_tool_cache")):
+        return fn(**args)
+
+    key = make_key(tool, fn, args)
+    cache = frappe.cache()
+    result = cache.get_value(key)
+    if result is not None:
+        _count(tool, "hit")
+        return result
+
+    _count(tool, "miss")
+    result = fn(**args)
+    cache.set_value(key, result, expires_in_sec=get_ttl(tool))
+    return result
+
+
+def get_stats() -> list[dict]:
+    cache = frappe.cache()
+    stats = []
+    for tool in TOOL_CACHE_CONFIG:
+        hits = cint(cache.get(cache.make_key(f"{STATS_KEY}:{tool}:hit")))
+        misses = cint(cache.get(cache.make_key(f"{STATS_KEY}:{tool}:miss")))
+        total = hits + misses
+        stats.append({
+            "tool": tool,
+            "ttl": get_ttl(tool),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total * 100, 1) if total else 0,
+        })
+    return stats
+
+
+def reset_stats():
+    cache = frappe.cache()
+    for tool in TOOL_CACHE_CONFIG:
+        for outcome in ("hit", "miss"):
+            cache.delete(cache.make_key(f"{STATS_KEY}:{tool}:{outcome}"))
+
+
+def _flush_invalidations():
+    for doctype in frappe.flags.pop("kmp_tool_cache_stale", None) or ():
+        bump_doctype_version(doctype)
+
+
+def invalidate_doctype(doc, method=None):
+    """doc_events handler: make cached results that read this DocType stale.
+
+    Bumps each DocType's version once per transaction, however many of its
+    documents (e.g. Stock Ledger Entries of one stock entry) are saved.
+    """
+    doctype = DERIVED_DOCTYPES.get(doc.doctype, doc.doctype)
+    stale = frappe.flags.kmp_tool_cache_stale
+    if stale is None:
+        stale = frappe.flags.kmp_tool_cache_stale = set()
+        frappe.db.after_commit.add(_flush_invalidations)
+        frappe.db.after_rollback.add(lambda: frappe.flags.pop("kmp_tool_cache_stale", None))
+    stale.add(doctype)
@@ -0,0 +1,144 @@
+"""
+KMP Assistant - Compact encoding of tool results for the model
+
+Lists of rows are sent as ``{"columns": [...], "rows": [[...], ...]}`` so
+field names appear once instead of on every row, floats are rounded, and
+JSON is written without padding. Each tool has a token budget; rows that
+do not fit are dropped (spread evenly across the tables of a multi-table
+result) and the table reports ``total_rows`` so the model knows the
+answer is partial and can narrow its query.
+"""
+import datetime
+import decimal
+import json
+
+import frappe
+from frappe.utils import cint
+
+from kmp_erp_custom.kmp_assistant.context import count_tokens
+
+FLOAT_PRECISION = 2
+DEFAULT_TOKEN_BUDGET = 1500
+
+# tool name -> max tokens of its encoded result
+TOOL_TOKEN_BUDGETS = {
+    "search_bom": 2500,
+    "explode_bom": 3000,
+    "get_yield_analysis": 1500,
+    "check_stock": 1500,
+    "get_stock_summary": 1500,
+    "get_low_stock_items": 2000,
+    "get_order_status": 1500,
+    "search_customer_supplier": 1200,
+    "search_erp_general": 2000,
+    "get_system_info": 800,
+    "get_recent_activity": 1500,
+}
+
+
+def get_budget(tool: str) -> int:
+    overrides = frappe.conf.get("kmp_assistant_tool_token_budget") or {}
+    if tool in overrides:
+        return cint(overrides[tool])
+    return TOOL_TOKEN_BUDGETS.get(tool, DEFAULT_TOKEN_BUDGET)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# ---------------------------------------------------------------------------
+# Compaction
+# ---------------------------------------------------------------------------
+
+def _scalar(value):
+    if isinstance(value, decimal.Decimal):
+        value = float(value)
+    if isinstance(value, float):
+        value = round(value, FLOAT_PRECISION)
+        return int(value) if value.is_integer() else value
+    if isinstance(value, (datetime.date, datetime.timedelta)):
+        return str(value)
+    return value
+
+
+def _is_table(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+
+
+def to_table(rows: list[dict]) -> dict:
+    """``[{"a": 1, "b": 2}, ...]`` -> ``{"columns": ["a", "b"], "rows": [[1, 2], ...]}``
+
+    Columns are the union of all row keys in first-seen order; a row
+    without a key gets null.
+    """
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    return {
+        "columns": columns,
+        "rows": [[compact(row.get(c)) for c in columns] for row in rows],
+    }
+
+
+def compact(value):
+    if _is_table(value):
+        return to_table(value)
+    if isinstance(value, dict):
+        return {k: compact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [compact(v) for v in value]
+    return _scalar(value)
+
+
+# ---------------------------------------------------------------------------
+# Budgeting
+# ---------------------------------------------------------------------------
+
+def _tables(value) -> list[dict]:
+    """Top-level tables of a compacted result (the result itself, or the
+    values of a dict result)"""
+    if isinstance(value, dict) and "columns" in value and "rows" in value:
+        return [value]
+    if isinstance(value, dict):
+        return [v for v in value.values() if isinstance(v, dict) and "rows" in v]
+    return []
+
+
+def fit(value, budget: int):
+    """Drop trailing rows until the encoded ``value`` fits ``budget`` tokens.
+
+    Rows are admitted round-robin across tables so every table keeps its
+    first rows; truncated tables get ``total_rows``.
+    """
+    tables = _tables(value)
+    if not tables or count_tokens(_dumps(value)) <= budget:
+        return value
+
+    all_rows = [t["rows"] for t in tables]
+    costs = [[count_tokens(_dumps(r)) + 1 for r in rows] for rows in all_rows]
+    for t, rows in zip(tables, all_rows):
+        t["rows"] = []
+        t["total_rows"] = len(rows)
+    remaining = budget - count_tokens(_dumps(value))
+
+    keep = [0] * len(tables)
+    open_tables = set(range(len(tables)))
+    while open_tables:
+        for i in sorted(open_tables):
+            if keep[i] < len(all_rows[i]) and costs[i][keep[i]] <= remaining:
+                remaining -= costs[i][keep[i]]
+                keep[i] += 1
+            else:
+                open_tables.discard(i)
+
+    for t, rows, n in zip(tables, all_rows, keep):
+        t["rows"] = rows[:n]
+        if n < len(rows):
+            t["total_rows"] = len(rows)
+        else:
+            del t["total_rows"]
+    return value
+
+
+def encode(tool: str, result) -> str:
+    """Encode a tool result for the model within the tool's token budget"""
+    return _dumps(fit(compact(result), get_budget(tool)))
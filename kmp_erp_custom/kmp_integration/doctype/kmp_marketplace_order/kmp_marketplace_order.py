@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class KMPMarketplaceOrder(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Marketplace Order", ["marketplace", "status"])
+    frappe.db.add_index("KMP Marketplace Order", ["sales_order"])
@@ -0,0 +1,12 @@
+import frappe
+from frappe.model.document import Document
+
+
+class KMPNotificationOutbox(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Notification Outbox", ["status", "next_attempt_at"])
+    frappe.db.add_index("KMP Notification Outbox", ["recipient"])
+    frappe.db.add_index("KMP Notification Outbox", ["push_key"])
@@ -0,0 +1,401 @@
+"""
+KMP Integration - LINE notifications through an outbox
+
+``notify`` only inserts a row into ``KMP Notification Outbox`` as part of
+the caller's transaction, so saves never wait on LINE and a rolled-back
+save sends nothing. ``drain`` (a background job woken after commit, and
+every minute by the scheduler for retries) claims due rows, coalesces them
+per recipient into as few push requests as the Messaging API allows, and
+sends them over a pooled HTTP client. A global and a per-recipient token
+bucket keep within the rate limits; failed requests are retried with
+jittered exponential backoff until ``kmp_line_max_attempts``.
+
+Site config:
+
+    kmp_line_channel_access_token    Messaging API channel access token
+    kmp_line_api_base                default https://api.line.me (point it
+                                     at benchmarks/mock_line.py to test)
+    kmp_line_rate_per_sec            push requests per second, default 100
+    kmp_line_recipient_rate_per_sec  per recipient, default 1 (bursts of 5)
+    kmp_line_max_attempts            default 8
+    kmp_line_notify                  {"Sales Order:on_submit": ["<group id>"], ...}
+                                     messages queued by ``notify_document``
+"""
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+import httpx
+from frappe import _
+from frappe.utils import add_to_date, cint, flt, fmt_money, get_url_to_form, now_datetime
+
+OUTBOX_DOCTYPE = "KMP Notification Outbox"
+DRAIN_JOB_ID = "kmp_line_outbox_drain"
+DEFAULT_API_BASE = "https://api.line.me"
+PUSH_PATH = "/v2/bot/message/push"
+
+# Messaging API limits: 5 message objects per push, 5000 characters per text
+MAX_MESSAGES_PER_PUSH = 5
+MAX_TEXT_LENGTH = 5000
+
+BATCH_SIZE = 200
+MAX_BATCHES = 20
+SEND_WORKERS = 4
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+STALE_CLAIM_MINUTES = 10
+CLAIM_FIELDS = "name, recipient, message, attempts, push_key, creation"
+
+DEFAULT_RATE_PER_SEC = 100
+DEFAULT_RECIPIENT_RATE_PER_SEC = 1
+RECIPIENT_BURST = 5
+DEFAULT_MAX_ATTEMPTS = 8
+BACKOFF_BASE = 10
+BACKOFF_MAX = 30 * 60
+
+EVENT_LABELS = {
+    "on_submit": "ยืนยันแล้ว",
+    "on_cancel": "ยกเลิกแล้ว",
+    "on_update_after_submit": "มีการแก้ไข",
+}
+
+_client = None
+_buckets = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second on average, in bursts of up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 when one is)"""
+        with self.lock:
+            self._refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        """Take a token, returning how long to wait before using it"""
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        """Hold back every caller for ``seconds`` (e.g. after a 429)"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+# ---------------------------------------------------------------------------
+# Queueing
+# ---------------------------------------------------------------------------
+
+def notify(recipient: str, message: str, reference_doctype: str = None, reference_name: str = None):
+    """Queue a LINE text message; it is sent once the current transaction commits"""
+    frappe.get_doc({
+        "doctype": OUTBOX_DOCTYPE,
+        "channel": "LINE",
+        "recipient": recipient,
+        "message": message,
+        "status": "Queued",
+        "next_attempt_at": now_datetime(),
+        "reference_doctype": reference_doctype,
+        "reference_name": reference_name,
+    }).db_insert()
+    # A drain that is already running may miss this row; the scheduler's
+    # next run picks it up
+    frappe.enqueue(
+        f"{__name__}.drain",
+        queue="short",
+        job_id=DRAIN_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+def _document_message(doc, method: str) -> str:
+    lines = [f"{_(doc.doctype)} {doc.name} {EVENT_LABELS.get(method, method)}"]
+    party = doc.get("customer_name") or doc.get("supplier_name") or doc.get("stock_entry_type")
+    if party:
+        lines.append(party)
+    if doc.get("grand_total"):
+        lines.append(fmt_money(doc.grand_total, currency=doc.get("currency")))
+    lines.append(get_url_to_form(doc.doctype, doc.name))
+    return "\n".join(lines)
+
+
+def notify_document(doc, method=None):
+    """doc_events handler: queue the messages ``kmp_line_notify`` configures for this event"""
+    recipients = (frappe.conf.get("kmp_line_notify") or {}).get(f"{doc.doctype}:{method}")
+    if not recipients:
+        return
+    message = _document_message(doc, method)
+    for recipient in recipients:
+        notify(recipient, message, doc.doctype, doc.name)
+
+
+# ---------------------------------------------------------------------------
+# Sending
+# ---------------------------------------------------------------------------
+
+def _get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(
+                    timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=SEND_WORKERS, max_keepalive_connections=SEND_WORKERS),
+                )
+    return _client
+
+
+def _get_bucket(key: str, rate: float, capacity: float = None) -> TokenBucket:
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None or bucket.rate != rate:
+            if len(_buckets) >= 10000:
+                _buckets.clear()
+            bucket = _buckets[key] = TokenBucket(rate, capacity)
+    return bucket
+
+
+def pack(messages: list[str]) -> list[tuple[list[str], int]]:
+    """Coalesce message texts, in order, into pushes of at most
+    MAX_MESSAGES_PER_PUSH texts of at most MAX_TEXT_LENGTH characters.
+    Returns ``[(texts, count)]``, ``count`` being how many messages each
+    push carries."""
+    pushes = []
+    texts, count = [], 0
+    for message in messages:
+        message = message[:MAX_TEXT_LENGTH]
+        if texts and len(texts[-1]) + 2 + len(message) <= MAX_TEXT_LENGTH:
+            texts[-1] += "\n\n" + message
+        elif len(texts) < MAX_MESSAGES_PER_PUSH:
+            texts.append(message)
+        else:
+            pushes.append((texts, count))
+            texts, count = [message], 0
+        count += 1
+    if texts:
+        pushes.append((texts, count))
+    return pushes
+
+
+def _push(recipient: str, rows: list, texts: list, key: str, new: bool = False) -> dict:
+    return {
+        "recipient": recipient,
+        "names": [r.name for r in rows],
+        "texts": texts,
+        "attempts": max(cint(r.attempts) for r in rows),
+        "key": key,
+        "new": new,
+    }
+
+
+def _plan_pushes(rows: list) -> list[dict]:
+    """Group claimed rows into pushes: [{recipient, names, texts, attempts, key, new}].
+
+    Rows already tried together keep their ``push_key`` and are sent as the
+    same push again, so LINE can drop it if the earlier attempt went
+    through. Only rows never tried are packed into new pushes.
+    """
+    by_recipient, by_key = {}, {}
+    for row in rows:
+        if row.push_key:
+            by_key.setdefault(row.push_key, []).append(row)
+        else:
+            by_recipient.setdefault(row.recipient, []).append(row)
+
+    pushes = []
+    for key, key_rows in by_key.items():
+        # Same messages in the same order pack into the same single push
+        key_rows.sort(key=lambda r: (r.creation, r.name))
+        texts = [t for push_texts, _count in pack([r.message for r in key_rows]) for t in push_texts]
+        pushes.append(_push(key_rows[0].recipient, key_rows, texts, key))
+    for recipient, recipient_rows in by_recipient.items():
+        start = 0
+        for texts, count in pack([r.message for r in recipient_rows]):
+            push_rows = recipient_rows[start:start + count]
+            start += count
+            pushes.append(_push(recipient, push_rows, texts, str(uuid.uuid4()), new=True))
+    return pushes
+
+
+def _assign_push_keys(pushes: list):
+    """Store the key of each new push on its rows before it is first sent"""
+    for push in pushes:
+        if push["new"]:
+            frappe.db.sql(f"""
+                UPDATE `tab{OUTBOX_DOCTYPE}` SET push_key = %s WHERE name IN %s
+            """, (push["key"], push["names"]))
+    frappe.db.commit()
+
+
+def _send(push: dict, token: str, api_base: str) -> tuple[str, str | None]:
+    """POST one push; returns (outcome, error) with outcome sent/retry/failed"""
+    try:
+        response = _get_client().post(
+            api_base.rstrip("/") + PUSH_PATH,
+            json={"to": push["recipient"], "messages": [{"type": "text", "text": t} for t in push["texts"]]},
+            headers={"Authorization": f"Bearer {token}", "X-Line-Retry-Key": push["key"]},
+        )
+    except httpx.HTTPError as e:
+        return "retry", f"{type(e).__name__}: {e}"
+
+    if response.status_code == 200 or response.status_code == 409:
+        return "sent", None
+    error = f"HTTP {response.status_code}: {response.text[:500]}"
+    if response.status_code == 429:
+        return "rate_limited", error
+    if response.status_code >= 500:
+        return "retry", error
+    return "failed", error
+
+
+def _complete_pushes(rows: list) -> list:
+    """Add the rest of each retried push to the claimed rows, and leave out
+    any push whose rows cannot all be claimed now (the limit cut it, or
+    another drain holds some of them)"""
+    keys = list({r.push_key for r in rows if r.push_key})
+    if not keys:
+        return rows
+    names = {r.name for r in rows}
+    rows = rows + [
+        r
+        for r in frappe.db.sql(f"""
+            SELECT {CLAIM_FIELDS} FROM `tab{OUTBOX_DOCTYPE}`
+            WHERE push_key IN %s AND status = 'Queued'
+            FOR UPDATE SKIP LOCKED
+        """, (keys,), as_dict=True)
+        if r.name not in names
+    ]
+    sizes = dict(frappe.db.sql(f"""
+        SELECT push_key, COUNT(*) FROM `tab{OUTBOX_DOCTYPE}` WHERE push_key IN %s GROUP BY push_key
+    """, (keys,)))
+    claimed = {}
+    for row in rows:
+        if row.push_key:
+            claimed[row.push_key] = claimed.get(row.push_key, 0) + 1
+    return [r for r in rows if not r.push_key or claimed[r.push_key] == sizes.get(r.push_key)]
+
+
+def _claim(batch_size: int) -> list:
+    now = now_datetime()
+    frappe.db.sql(f"""
+        UPDATE `tab{OUTBOX_DOCTYPE}` SET status = 'Queued'
+        WHERE status = 'Sending' AND modified < %s
+    """, add_to_date(now, minutes=-STALE_CLAIM_MINUTES))
+    rows = frappe.db.sql(f"""
+        SELECT {CLAIM_FIELDS} FROM `tab{OUTBOX_DOCTYPE}`
+        WHERE status = 'Queued' AND next_attempt_at <= %s
+        ORDER BY next_attempt_at, creation, name
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (now, batch_size), as_dict=True)
+    rows = _complete_pushes(rows)
+    if rows:
+        frappe.db.sql(f"""
+            UPDATE `tab{OUTBOX_DOCTYPE}` SET status = 'Sending', modified = %s WHERE name IN %s
+        """, (now, [r.name for r in rows]))
+    frappe.db.commit()
+    return rows
+
+
+def _record(push: dict, outcome: str, error: str = None, delay: float = None):
+    now = now_datetime()
+    if outcome == "sent":
+        frappe.db.sql(f"""
+            UPDATE `tab{OUTBOX_DOCTYPE}`
+            SET status = 'Sent', sent_at = %s, modified = %s, attempts = attempts + 1, last_error = NULL
+            WHERE name IN %s
+        """, (now, now, push["names"]))
+        return
+
+    max_attempts = cint(frappe.conf.get("kmp_line_max_attempts")) or DEFAULT_MAX_ATTEMPTS
+    if outcome == "deferred":
+        # Held back by the recipient's rate limit; not an attempt
+        status, attempts = "Queued", 0
+    else:
+        status = "Failed" if outcome == "failed" or push["attempts"] + 1 >= max_attempts else "Queued"
+        attempts = 1
+    if delay is None:
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** push["attempts"]) * random.uniform(0.5, 1)
+    frappe.db.sql(f"""
+        UPDATE `tab{OUTBOX_DOCTYPE}`
+        SET status = %s, attempts = attempts + %s, next_attempt_at = %s, last_error = %s, modified = %s
+        WHERE name IN %s
+    """, (status, attempts, add_to_date(now, seconds=delay), error, now, push["names"]))
+
+
+def drain(max_batches: int = MAX_BATCHES, batch_size: int = BATCH_SIZE) -> dict:
+    """Send due outbox rows; background job and scheduler entry point"""
+    stats = {"rows": 0, "requests": 0, "sent": 0, "retry": 0, "failed": 0, "deferred": 0}
+    token = frappe.conf.get("kmp_line_channel_access_token")
+    if not token:
+        return stats
+    api_base = frappe.conf.get("kmp_line_api_base") or DEFAULT_API_BASE
+    rate = flt(frappe.conf.get("kmp_line_rate_per_sec")) or DEFAULT_RATE_PER_SEC
+    recipient_rate = flt(frappe.conf.get("kmp_line_recipient_rate_per_sec")) or DEFAULT_RECIPIENT_RATE_PER_SEC
+    channel_bucket = _get_bucket(f"{frappe.local.site}:channel", rate)
+
+    with ThreadPoolExecutor(max_workers=SEND_WORKERS) as pool:
+        for _batch in range(cint(max_batches)):
+            rows = _claim(cint(batch_size))
+            if not rows:
+                break
+            stats["rows"] += len(rows)
+
+            pushes = _plan_pushes(rows)
+            _assign_push_keys(pushes)
+            ready, deferred = [], []
+            for push in pushes:
+                bucket = _get_bucket(f"{frappe.local.site}:{push['recipient']}", recipient_rate, RECIPIENT_BURST)
+                wait = bucket.wait_time()
+                if wait:
+                    deferred.append((push, wait))
+                else:
+                    bucket.take()
+                    ready.append(push)
+
+            def send(push):
+                time.sleep(channel_bucket.take())
+                return _send(push, token, api_base)
+
+            for push, (outcome, error) in zip(ready, pool.map(send, ready)):
+                stats["requests"] += 1
+                if outcome == "rate_limited":
+                    channel_bucket.pause(1)
+                    outcome = "retry"
+                stats[outcome] += len(push["names"])
+                _record(push, outcome, error)
+            for push, wait in deferred:
+                stats["deferred"] += len(push["names"])
+                _record(push, "deferred", delay=wait)
+            frappe.db.commit()
+    return stats
+
+
+def purge_sent(days: int = 30):
+    """Scheduler job (daily): delete sent notifications older than ``days``"""
+    frappe.db.delete(OUTBOX_DOCTYPE, {
+        "status": "Sent",
+        "creation": ["<", add_to_date(now_datetime(), days=-cint(days))],
+    })
+    frappe.db.commit()
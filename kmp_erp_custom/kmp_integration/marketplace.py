@@ -0,0 +1,542 @@
+"""
+KMP Integration - Shopee and Lazada order ingestion
+
+``ingest`` reads a marketplace's order feed a page (up to 100 orders) at a
+time, from the cursor saved by the previous run, and turns new paid orders
+into Sales Orders. Each page is written in one transaction together with
+the cursor after it, so an interrupted run resumes at the first unwritten
+page; the next page is fetched while the current one is written.
+
+Every order seen gets a ``KMP Marketplace Order`` row named
+``<marketplace>-<order id>`` in the same transaction as its Sales Order, so
+a page is checked for orders already ingested with one primary key lookup
+and overlapping feed windows never create an order twice. An order that
+cannot be imported (unknown SKU, validation error) is rolled back on its
+own, recorded as Failed with its payload and can be imported again with
+``retry_failed`` once fixed. SKUs are matched to Item codes and barcodes,
+case-insensitively, from a per-process map rebuilt when Items change.
+
+The feeds are read by update time, so an order left unpaid when first seen
+is imported once it is paid. Cancellations after import are not synced.
+
+Site config, one entry per marketplace:
+
+    "kmp_marketplace": {
+        "shopee": {"partner_id": ..., "partner_key": "...", "shop_id": ..., "access_token": "...",
+                   "customer": "Shopee", "warehouse": "Stores - KMP"},
+        "lazada": {"app_key": "...", "app_secret": "...", "access_token": "...",
+                   "customer": "Lazada", "warehouse": "Stores - KMP"}
+    }
+
+and optionally per marketplace: ``api_base`` (point it at
+benchmarks/mock_marketplace.py to test), ``company``, ``initial_days``
+(how far back a first run reads, default 7), ``delivery_days`` (default 3),
+``submit`` (submit the Sales Orders, default 0) and ``sku_map``
+(``{"<marketplace SKU>": "<item code>"}`` for SKUs that differ).
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import frappe
+import httpx
+from frappe import _
+from frappe.utils import add_days, cint, flt, get_datetime, get_system_timezone, now_datetime
+
+from kmp_erp_custom.kmp_assistant.cache import get_doctype_versions
+
+ORDER_DOCTYPE = "KMP Marketplace Order"
+CURSOR_DOCTYPE = "KMP Marketplace Cursor"
+SAVEPOINT = "kmp_marketplace_order"
+
+PAGE_SIZE = 100
+DETAIL_CHUNK = 50
+DEFAULT_INITIAL_DAYS = 7
+DEFAULT_DELIVERY_DAYS = 3
+# Scheduled runs stop paging after this long and continue on the next run
+MAX_RUN_SECONDS = 240
+RETRY_BATCH_SIZE = 100
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+
+_client = None
+_sku_maps = {}
+_lock = threading.Lock()
+
+
+class MarketplaceError(Exception):
+    """The marketplace API refused a request or kept failing"""
+
+
+def _get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT))
+    return _client
+
+
+# ---------------------------------------------------------------------------
+# Feeds
+# ---------------------------------------------------------------------------
+
+class Feed:
+    """One marketplace's order feed.
+
+    ``fetch`` returns a page of normalized orders (only those ready to
+    import), the cursor to continue from and whether the feed is caught up.
+    Normalized orders are JSON-safe dicts: ``{order_id, created_at (system
+    time), customer_name, total, items: [{sku, qty, rate}]}``. Feeds do not
+    touch the database, so ``fetch`` can run on another thread.
+    """
+
+    marketplace = None
+    default_api_base = None
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.api_base = (settings.get("api_base") or self.default_api_base).rstrip("/")
+        self.timezone = ZoneInfo(get_system_timezone())
+
+    def start_cursor(self, days: int) -> dict:
+        raise NotImplementedError
+
+    def fetch(self, cursor: dict) -> tuple[list[dict], dict, bool]:
+        raise NotImplementedError
+
+    def _sign(self, path: str, params: dict) -> dict:
+        raise NotImplementedError
+
+    def _check(self, body: dict):
+        pass
+
+    def _get(self, path: str, params: dict) -> dict:
+        """GET with retries on timeouts, 429 and 5xx"""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = _get_client().get(self.api_base + path, params=self._sign(path, params))
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200:
+                    body = response.json()
+                    self._check(body)
+                    return body
+                error = f"HTTP {response.status_code}: {response.text[:300]}"
+                if response.status_code != 429 and response.status_code < 500:
+                    break
+            if attempt + 1 < MAX_ATTEMPTS:
+                time.sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1))
+        raise MarketplaceError(f"{self.marketplace} {path}: {error}")
+
+    def _local_time(self, value: datetime) -> str:
+        return value.astimezone(self.timezone).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class ShopeeFeed(Feed):
+    """Shopee Open Platform v2: get_order_list by update time, in windows of
+    at most 15 days, then get_order_detail for 50 orders at a time"""
+
+    marketplace = "Shopee"
+    default_api_base = "https://partner.shopeemobile.com"
+    WINDOW = 15 * 24 * 60 * 60
+    # Windows after the first start this far back, for orders updated while
+    # the previous run was reading
+    OVERLAP = 10 * 60
+    SKIP_STATUSES = {"UNPAID", "IN_CANCEL", "CANCELLED"}
+
+    def start_cursor(self, days: int) -> dict:
+        return {"time_from": int(time.time()) - days * 24 * 60 * 60, "cursor": ""}
+
+    def _sign(self, path: str, params: dict) -> dict:
+        s = self.settings
+        timestamp = int(time.time())
+        base = f"{s['partner_id']}{path}{timestamp}{s['access_token']}{s['shop_id']}"
+        return {
+            **params,
+            "partner_id": s["partner_id"],
+            "shop_id": s["shop_id"],
+            "access_token": s["access_token"],
+            "timestamp": timestamp,
+            "sign": hmac.new(s["partner_key"].encode(), base.encode(), hashlib.sha256).hexdigest(),
+        }
+
+    def _check(self, body: dict):
+        if body.get("error"):
+            raise MarketplaceError(f"Shopee: {body['error']}: {body.get('message')}")
+
+    def fetch(self, cursor: dict) -> tuple[list[dict], dict, bool]:
+        now = int(time.time())
+        time_to = min(cursor["time_from"] + self.WINDOW, now)
+        listed = self._get("/api/v2/order/get_order_list", {
+            "time_range_field": "update_time",
+            "time_from": cursor["time_from"],
+            "time_to": time_to,
+            "page_size": PAGE_SIZE,
+            "cursor": cursor["cursor"],
+        })["response"]
+
+        order_sns = [o["order_sn"] for o in listed.get("order_list") or []]
+        orders = []
+        for i in range(0, len(order_sns), DETAIL_CHUNK):
+            detail = self._get("/api/v2/order/get_order_detail", {
+                "order_sn_list": ",".join(order_sns[i:i + DETAIL_CHUNK]),
+                "response_optional_fields": "buyer_username,total_amount,item_list",
+            })["response"]
+            orders.extend(
+                self._normalize(o) for o in detail.get("order_list") or []
+                if o.get("order_status") not in self.SKIP_STATUSES
+            )
+
+        if listed.get("more"):
+            return orders, {"time_from": cursor["time_from"], "cursor": listed["next_cursor"]}, False
+        next_cursor = {"time_from": max(cursor["time_from"], time_to - self.OVERLAP), "cursor": ""}
+        return orders, next_cursor, time_to >= now
+
+    def _normalize(self, order: dict) -> dict:
+        return {
+            "order_id": order["order_sn"],
+            "created_at": self._local_time(datetime.fromtimestamp(order["create_time"], timezone.utc)),
+            "customer_name": order.get("buyer_username"),
+            "total": flt(order.get("total_amount")),
+            "items": [
+                {
+                    "sku": row.get("model_sku") or row.get("item_sku"),
+                    "qty": flt(row.get("model_quantity_purchased")),
+                    "rate": flt(row.get("model_discounted_price")),
+                }
+                for row in order.get("item_list") or []
+            ],
+        }
+
+
+class LazadaFeed(Feed):
+    """Lazada Open Platform: /orders/get by update time with offset paging,
+    then /orders/items/get for 50 orders at a time"""
+
+    marketplace = "Lazada"
+    default_api_base = "https://api.lazada.co.th/rest"
+    # Deep offsets get slow; restart from the newest update seen instead
+    MAX_OFFSET = 5000
+    SKIP_STATUSES = {"unpaid", "canceled"}
+
+    def start_cursor(self, days: int) -> dict:
+        since = datetime.now(self.timezone) - timedelta(days=days)
+        return {"update_after": since.isoformat(timespec="seconds"), "offset": 0}
+
+    def _sign(self, path: str, params: dict) -> dict:
+        s = self.settings
+        params = {
+            **params,
+            "app_key": s["app_key"],
+            "access_token": s["access_token"],
+            "timestamp": str(int(time.time() * 1000)),
+            "sign_method": "sha256",
+        }
+        base = path + "".join(f"{k}{params[k]}" for k in sorted(params))
+        params["sign"] = hmac.new(s["app_secret"].encode(), base.encode(), hashlib.sha256).hexdigest().upper()
+        return params
+
+    def _check(self, body: dict):
+        if str(body.get("code", "0")) != "0":
+            raise MarketplaceError(f"Lazada: {body.get('code')}: {body.get('message')}")
+
+    def fetch(self, cursor: dict) -> tuple[list[dict], dict, bool]:
+        listed = self._get("/orders/get", {
+            "update_after": cursor["update_after"],
+            "sort_by": "updated_at",
+            "sort_direction": "ASC",
+            "offset": cursor["offset"],
+            "limit": PAGE_SIZE,
+        })["data"].get("orders") or []
+
+        order_ids = [o["order_id"] for o in listed]
+        items = {}
+        for i in range(0, len(order_ids), DETAIL_CHUNK):
+            for row in self._get("/orders/items/get", {
+                "order_ids": json.dumps(order_ids[i:i + DETAIL_CHUNK]),
+            })["data"] or []:
+                items[str(row["order_id"])] = row.get("order_items") or []
+
+        orders = [
+            self._normalize(o, items.get(str(o["order_id"]), []))
+            for o in listed
+            if not self.SKIP_STATUSES.intersection(o.get("statuses") or [])
+        ]
+
+        # Listed oldest first, so the last order is the newest update seen
+        newest = self._updated_at(listed[-1]) if listed else cursor.get("newest")
+        if len(listed) == PAGE_SIZE:
+            if cursor["offset"] + PAGE_SIZE < self.MAX_OFFSET:
+                return orders, {**cursor, "offset": cursor["offset"] + PAGE_SIZE, "newest": newest}, False
+            return orders, {"update_after": newest, "offset": 0}, False
+        return orders, {"update_after": newest or cursor["update_after"], "offset": 0}, True
+
+    def _updated_at(self, order: dict) -> str:
+        # "2026-10-18 10:00:00 +0700" -> ISO 8601, which update_after expects
+        return datetime.strptime(order["updated_at"], "%Y-%m-%d %H:%M:%S %z").isoformat()
+
+    def _normalize(self, order: dict, order_items: list) -> dict:
+        # Lazada lists one order item per unit; merge them per SKU
+        lines = {}
+        for row in order_items:
+            line = lines.setdefault(row.get("sku"), {"sku": row.get("sku"), "qty": 0.0, "amount": 0.0})
+            line["qty"] += 1
+            line["amount"] += flt(row.get("paid_price") or row.get("item_price"))
+        created_at = datetime.strptime(order["created_at"], "%Y-%m-%d %H:%M:%S %z")
+        return {
+            "order_id": str(order["order_id"]),
+            "created_at": self._local_time(created_at),
+            "customer_name": " ".join(
+                filter(None, (order.get("customer_first_name"), order.get("customer_last_name")))
+            ),
+            "total": flt(order.get("price")),
+            "items": [
+                {"sku": line["sku"], "qty": line["qty"], "rate": flt(line["amount"] / line["qty"], 2)}
+                for line in lines.values()
+            ],
+        }
+
+
+FEEDS = {feed.marketplace: feed for feed in (ShopeeFeed, LazadaFeed)}
+
+
+def _get_settings(marketplace: str) -> tuple[str, dict]:
+    marketplace = next((m for m in FEEDS if m.lower() == (marketplace or "").lower()), None)
+    if not marketplace:
+        frappe.throw(_("Unknown marketplace; expected one of {0}").format(", ".join(FEEDS)))
+    settings = (frappe.conf.get("kmp_marketplace") or {}).get(marketplace.lower())
+    if not settings or not settings.get("customer"):
+        frappe.throw(_("{0} is not configured in site config (kmp_marketplace)").format(marketplace))
+    return marketplace, settings
+
+
+# ---------------------------------------------------------------------------
+# Writing orders
+# ---------------------------------------------------------------------------
+
+def get_sku_map() -> dict:
+    """Lower-cased Item codes and barcodes -> (item code, stock UOM)"""
+    version = get_doctype_versions(["Item"])["Item"]
+    site = frappe.local.site
+    cached_version, sku_map = _sku_maps.get(site, (None, None))
+    if sku_map is not None and cached_version == version:
+        return sku_map
+
+    sku_map = {}
+    for row in frappe.get_all("Item", filters={"disabled": 0, "is_sales_item": 1}, fields=["name", "stock_uom"]):
+        sku_map[row.name.lower()] = (row.name, row.stock_uom)
+    for row in frappe.get_all("Item Barcode", filters={"parenttype": "Item"}, fields=["barcode", "parent"]):
+        item = sku_map.get(row.parent.lower())
+        if item and row.barcode:
+            sku_map.setdefault(row.barcode.lower(), item)
+    _sku_maps[site] = (version, sku_map)
+    return sku_map
+
+
+def _order_items(order: dict, sku_map: dict, overrides: dict) -> list[dict]:
+    items, unknown = [], []
+    for line in order["items"]:
+        sku = (line["sku"] or "").strip()
+        item = sku_map.get((overrides.get(sku) or sku).lower())
+        if item:
+            items.append({"item_code": item[0], "uom": item[1], "qty": line["qty"], "rate": line["rate"]})
+        else:
+            unknown.append(sku or "(blank)")
+    if unknown:
+        raise MarketplaceError(_("No Item for SKU {0}").format(", ".join(unknown)))
+    if not items:
+        raise MarketplaceError(_("Order has no items"))
+    return items
+
+
+def _insert_sales_order(order: dict, items: list, settings: dict, company: str) -> str:
+    order_date = get_datetime(order["created_at"]).date()
+    delivery_date = add_days(order_date, cint(settings.get("delivery_days")) or DEFAULT_DELIVERY_DAYS)
+    warehouse = settings.get("warehouse")
+    so = frappe.get_doc({
+        "doctype": "Sales Order",
+        "customer": settings["customer"],
+        "company": company,
+        "order_type": "Sales",
+        "transaction_date": order_date,
+        "delivery_date": delivery_date,
+        "po_no": order["order_id"],
+        "po_date": order_date,
+        "set_warehouse": warehouse,
+        "items": [{**item, "delivery_date": delivery_date, "warehouse": warehouse} for item in items],
+    })
+    so.flags.ignore_permissions = True
+    so.insert()
+    if cint(settings.get("submit")):
+        so.submit()
+    return so.name
+
+
+def _insert_order_row(marketplace: str, name: str, order: dict, status: str, sales_order=None, error=None):
+    frappe.get_doc({
+        "doctype": ORDER_DOCTYPE,
+        "name": name,
+        "marketplace": marketplace,
+        "order_id": order["order_id"],
+        "order_created_at": order["created_at"],
+        "status": status,
+        "sales_order": sales_order,
+        "error": error,
+        "payload": json.dumps(order, ensure_ascii=False) if status == "Failed" else None,
+    }).db_insert()
+
+
+def _import_order(marketplace: str, name: str, order: dict, settings: dict, company: str, sku_map: dict,
+                  stats: dict):
+    frappe.db.savepoint(SAVEPOINT)
+    try:
+        items = _order_items(order, sku_map, settings.get("sku_map") or {})
+        sales_order = _insert_sales_order(order, items, settings, company)
+        _insert_order_row(marketplace, name, order, "Imported", sales_order=sales_order)
+        stats["created"] += 1
+    except frappe.DuplicateEntryError as e:
+        frappe.db.rollback(save_point=SAVEPOINT)
+        if e.args and e.args[0] != ORDER_DOCTYPE:
+            raise
+        # Imported by a concurrent run since the page was checked
+        stats["duplicates"] += 1
+    except Exception as e:
+        frappe.db.rollback(save_point=SAVEPOINT)
+        frappe.clear_messages()
+        _insert_order_row(marketplace, name, order, "Failed", error=str(e)[:1000] or type(e).__name__)
+        stats["failed"] += 1
+
+
+def _write_page(marketplace: str, orders: list, settings: dict, company: str, stats: dict):
+    stats["orders"] += len(orders)
+    pending = {f"{marketplace}-{o['order_id']}": o for o in orders}
+    if not pending:
+        return
+    seen = set(frappe.get_all(ORDER_DOCTYPE, filters={"name": ["in", list(pending)]}, pluck="name"))
+    stats["duplicates"] += len(orders) - len(pending) + len(seen)
+    sku_map = get_sku_map()
+    for name, order in pending.items():
+        if name not in seen:
+            _import_order(marketplace, name, order, settings, company, sku_map, stats)
+
+
+def _save_cursor(marketplace: str, **values):
+    if frappe.db.exists(CURSOR_DOCTYPE, marketplace):
+        frappe.db.set_value(CURSOR_DOCTYPE, marketplace, values)
+    else:
+        frappe.get_doc({"doctype": CURSOR_DOCTYPE, "marketplace": marketplace, **values}).db_insert()
+
+
+def _load_cursor(marketplace: str) -> dict | None:
+    cursor = frappe.db.get_value(CURSOR_DOCTYPE, marketplace, "cursor")
+    return json.loads(cursor) if cursor else None
+
+
+# ---------------------------------------------------------------------------
+# Entry points
+# ---------------------------------------------------------------------------
+
+def _new_stats(marketplace: str) -> dict:
+    return {"marketplace": marketplace, "pages": 0, "orders": 0, "created": 0, "duplicates": 0, "failed": 0}
+
+
+def _finish(stats: dict, started: float) -> dict:
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    stats["orders_per_sec"] = flt(stats["created"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+    return stats
+
+
+def ingest(marketplace: str, max_pages: int = None, max_seconds: float = None) -> dict:
+    """Import new orders from ``marketplace``'s feed, resuming at the saved
+    cursor. Returns the run's counts and ``orders_per_sec`` (Sales Orders
+    created per second).
+
+    bench --site <site> execute kmp_erp_custom.kmp_integration.marketplace.ingest --args "['Shopee']"
+    """
+    marketplace, settings = _get_settings(marketplace)
+    company = settings.get("company") or frappe.defaults.get_global_default("company")
+    feed = FEEDS[marketplace](settings)
+    cursor = _load_cursor(marketplace) or feed.start_cursor(
+        cint(settings.get("initial_days")) or DEFAULT_INITIAL_DAYS
+    )
+    stats, started = _new_stats(marketplace), time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
+            page = prefetch.submit(feed.fetch, cursor)
+            while page:
+                orders, cursor, caught_up = page.result()
+                stats["pages"] += 1
+                stop = (
+                    caught_up
+                    or (max_pages and stats["pages"] >= cint(max_pages))
+                    or (max_seconds and time.perf_counter() - started >= flt(max_seconds))
+                )
+                # Read the next page while this one is written
+                page = None if stop else prefetch.submit(feed.fetch, cursor)
+                _write_page(marketplace, orders, settings, company, stats)
+                _save_cursor(marketplace, cursor=json.dumps(cursor))
+                frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        raise
+    finally:
+        _finish(stats, started)
+        _save_cursor(
+            marketplace,
+            last_run_at=now_datetime(),
+            last_run_orders=stats["created"],
+            last_run_seconds=stats["seconds"],
+            orders_per_sec=stats["orders_per_sec"],
+        )
+        frappe.db.commit()
+    return stats
+
+
+def ingest_all():
+    """Scheduler job (every 5 minutes): ingest each configured marketplace"""
+    for key in frappe.conf.get("kmp_marketplace") or {}:
+        try:
+            ingest(key, max_seconds=MAX_RUN_SECONDS)
+        except Exception:
+            frappe.log_error(title=f"KMP Marketplace ingestion: {key}")
+
+
+def retry_failed(marketplace: str) -> dict:
+    """Import the orders recorded as Failed again, e.g. after adding their
+    Items or ``sku_map`` entries"""
+    marketplace, settings = _get_settings(marketplace)
+    company = settings.get("company") or frappe.defaults.get_global_default("company")
+    stats, started = _new_stats(marketplace), time.perf_counter()
+    after = ""
+    while True:
+        rows = frappe.get_all(
+            ORDER_DOCTYPE,
+            filters={"marketplace": marketplace, "status": "Failed", "name": [">", after]},
+            fields=["name", "payload"],
+            order_by="name asc",
+            limit=RETRY_BATCH_SIZE,
+        )
+        if not rows:
+            break
+        sku_map = get_sku_map()
+        for row in rows:
+            stats["orders"] += 1
+            frappe.db.delete(ORDER_DOCTYPE, row.name)
+            _import_order(marketplace, row.name, json.loads(row.payload), settings, company, sku_map, stats)
+        frappe.db.commit()
+        after = rows[-1].name
+        stats["pages"] += 1
+    return _finish(stats, started)
@@ -0,0 +1,21 @@
+"""
+KMP Manufacturing - API endpoints
+"""
+import frappe
+from frappe import _
+
+from kmp_erp_custom.kmp_manufacturing.bom_explosion import explode, get_default_bom
+
+
+@frappe.whitelist()
+def get_bom_explosion(bom: str = None, item_code: str = None, qty: float = 1) -> dict:
+    """Raw materials and rolled-up cost for ``qty`` units of a BOM, or of the
+    default BOM of ``item_code``"""
+    if not bom:
+        if not item_code:
+            frappe.throw(_("Give a BOM or an item code"))
+        bom = get_default_bom(item_code)
+        if not bom:
+            frappe.throw(_("Item {0} has no active default BOM").format(item_code))
+    frappe.has_permission("BOM", doc=bom, throw=True)
+    return explode(bom, qty)
@@ -0,0 +1,160 @@
+"""
+KMP Manufacturing - Multi-level BOM explosion
+
+Explodes a submitted BOM down to its raw materials: quantities of every
+leaf item and the rolled-up material and operating cost, per unit of the
+finished item. Sub-assemblies are the BOM Item rows linked to a BOM of
+their own (``bom_no``).
+
+The BOM graph is fetched a level at a time (two queries per level, however
+many BOMs the level has) and each BOM's exploded result is memoized in
+process memory, so sub-assemblies shared between formulas are exploded
+once. The memo is dropped on every worker when a BOM is submitted,
+cancelled or has its costs updated (see hooks.py).
+"""
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+VERSION_KEY = "kmp_manufacturing:bom_explosion_version"
+MAX_MEMO_ENTRIES = 5000
+
+# site -> (version, {bom: exploded result per unit})
+_memo = {}
+
+
+def invalidate(doc=None, method=None):
+    """doc_events handler: drop memoized explosions once the transaction commits"""
+    frappe.db.after_commit.add(
+        lambda: frappe.cache().set_value(VERSION_KEY, frappe.generate_hash(length=8))
+    )
+
+
+def _get_memo() -> dict:
+    version = frappe.cache().get_value(VERSION_KEY) or "0"
+    site = frappe.local.site
+    memo_version, memo = _memo.get(site, (None, None))
+    if memo is None or memo_version != version or len(memo) > MAX_MEMO_ENTRIES:
+        memo = {}
+        _memo[site] = (version, memo)
+    return memo
+
+
+def _fetch_level(boms: list) -> tuple[dict, dict]:
+    headers = {
+        b.name: b
+        for b in frappe.get_all(
+            "BOM",
+            filters={"name": ["in", boms], "docstatus": 1},
+            fields=["name", "item", "item_name", "quantity", "base_operating_cost"],
+        )
+    }
+    rows = {}
+    if headers:
+        for row in frappe.get_all(
+            "BOM Item",
+            filters={"parenttype": "BOM", "parent": ["in", list(headers)]},
+            fields=["parent", "item_code", "item_name", "stock_uom", "stock_qty", "base_amount", "bom_no"],
+            order_by="parent asc, idx asc",
+        ):
+            rows.setdefault(row.pop("parent"), []).append(row)
+    return headers, rows
+
+
+def _load_graph(root: str, memo: dict) -> tuple[dict, dict]:
+    """Fetch every BOM under ``root`` that is not memoized, level by level"""
+    headers, items = {}, {}
+    frontier = [root]
+    while frontier:
+        level_headers, level_items = _fetch_level(frontier)
+        headers.update(level_headers)
+        items.update(level_items)
+        frontier = list({
+            row.bom_no
+            for rows in level_items.values()
+            for row in rows
+            if row.bom_no and row.bom_no not in memo and row.bom_no not in headers
+        })
+    return headers, items
+
+
+def _explode(bom: str, headers: dict, items: dict, memo: dict, path: list) -> dict:
+    if bom in memo:
+        return memo[bom]
+    if bom in path:
+        cycle = " → ".join(path[path.index(bom):] + [bom])
+        frappe.throw(_("BOM recursion found: {0}").format(cycle), title=_("BOM Explosion"))
+
+    header = headers[bom]
+    per_unit = 1 / (flt(header.quantity) or 1)
+    leaves = {}
+    exploded = {
+        "item": header.item,
+        "item_name": header.item_name,
+        "leaves": leaves,
+        "operating_cost": flt(header.base_operating_cost) * per_unit,
+        "levels": 1,
+    }
+
+    path.append(bom)
+    for row in items.get(bom, ()):
+        qty = flt(row.stock_qty) * per_unit
+        if row.bom_no and (row.bom_no in memo or row.bom_no in headers):
+            sub = _explode(row.bom_no, headers, items, memo, path)
+            for item_code, (sub_qty, sub_amount, item_name, stock_uom) in sub["leaves"].items():
+                leaf = leaves.setdefault(item_code, [0.0, 0.0, item_name, stock_uom])
+                leaf[0] += sub_qty * qty
+                leaf[1] += sub_amount * qty
+            exploded["operating_cost"] += sub["operating_cost"] * qty
+            exploded["levels"] = max(exploded["levels"], sub["levels"] + 1)
+        else:
+            leaf = leaves.setdefault(row.item_code, [0.0, 0.0, row.item_name, row.stock_uom])
+            leaf[0] += qty
+            leaf[1] += flt(row.base_amount) * per_unit
+    path.pop()
+
+    memo[bom] = exploded
+    return exploded
+
+
+def get_default_bom(item_code: str) -> str | None:
+    return frappe.db.get_value(
+        "BOM", {"item": item_code, "is_default": 1, "is_active": 1, "docstatus": 1}, "name"
+    )
+
+
+def explode(bom: str, qty: float = 1) -> dict:
+    """Raw materials and rolled-up cost to make ``qty`` units with ``bom``"""
+    memo = _get_memo()
+    if bom not in memo:
+        headers, items = _load_graph(bom, memo)
+        if bom not in headers:
+            frappe.throw(_("BOM {0} is not submitted").format(bom), title=_("BOM Explosion"))
+        _explode(bom, headers, items, memo, [])
+
+    exploded = memo[bom]
+    qty = flt(qty) or 1
+    rows = [
+        {
+            "item_code": item_code,
+            "item_name": item_name,
+            "stock_uom": stock_uom,
+            "qty": flt(leaf_qty * qty, 6),
+            "amount": flt(amount * qty, 2),
+        }
+        for item_code, (leaf_qty, amount, item_name, stock_uom) in exploded["leaves"].items()
+    ]
+    rows.sort(key=lambda r: r["amount"], reverse=True)
+    material_cost = flt(sum(amount for _q, amount, _n, _u in exploded["leaves"].values()) * qty, 2)
+    operating_cost = flt(exploded["operating_cost"] * qty, 2)
+    return {
+        "bom": bom,
+        "item": exploded["item"],
+        "item_name": exploded["item_name"],
+        "qty": qty,
+        "levels": exploded["levels"],
+        "items": rows,
+        "material_cost": material_cost,
+        "operating_cost": operating_cost,
+        "total_cost": flt(material_cost + operating_cost, 2),
+    }
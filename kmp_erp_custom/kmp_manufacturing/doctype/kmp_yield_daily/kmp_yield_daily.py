@@ -0,0 +1,11 @@
+import frappe
+from frappe.model.document import Document
+
+
+class KMPYieldDaily(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("KMP Yield Daily", ["posting_date", "item_code"])
+    frappe.db.add_index("KMP Yield Daily", ["bom", "posting_date"])
@@ -0,0 +1,50 @@
+frappe.query_reports["KMP Yield Analysis"] = {
+    filters: [
+        {
+            fieldname: "from_date",
+            label: __("From Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.add_days(frappe.datetime.get_today(), -29),
+            reqd: 1,
+        },
+        {
+            fieldname: "to_date",
+            label: __("To Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.get_today(),
+            reqd: 1,
+        },
+        {
+            fieldname: "company",
+            label: __("Company"),
+            fieldtype: "Link",
+            options: "Company",
+        },
+        {
+            fieldname: "item_code",
+            label: __("Item"),
+            fieldtype: "Link",
+            options: "Item",
+        },
+        {
+            fieldname: "bom",
+            label: __("BOM"),
+            fieldtype: "Link",
+            options: "BOM",
+        },
+        {
+            fieldname: "group_by",
+            label: __("Group By"),
+            fieldtype: "Select",
+            options: "item\nbom\nday\nitem_day",
+            default: "item",
+        },
+    ],
+    formatter(value, row, column, data, default_formatter) {
+        value = default_formatter(value, row, column, data);
+        if (column.fieldname === "yield_pct" && data && data.yield_pct != null && data.yield_pct < 95) {
+            value = `<span style="color: var(--red-500)">${value}</span>`;
+        }
+        return value;
+    },
+};
@@ -0,0 +1,38 @@
+import frappe
+from frappe import _
+
+from kmp_erp_custom.kmp_manufacturing.yield_analysis import get_yield
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    group_by = filters.group_by or "item"
+    return get_columns(group_by), get_yield(
+        from_date=filters.from_date,
+        to_date=filters.to_date,
+        item_code=filters.item_code,
+        bom=filters.bom,
+        company=filters.company,
+        group_by=group_by,
+    )
+
+
+def get_columns(group_by: str) -> list[dict]:
+    columns = []
+    if group_by in ("day", "item_day"):
+        columns.append({"fieldname": "posting_date", "label": _("Date"), "fieldtype": "Date", "width": 100})
+    if group_by != "day":
+        columns.append({"fieldname": "item_code", "label": _("Item"), "fieldtype": "Link", "options": "Item", "width": 180})
+    if group_by == "bom":
+        columns.append({"fieldname": "bom", "label": _("BOM"), "fieldtype": "Link", "options": "BOM", "width": 180})
+    return columns + [
+        {"fieldname": "entries", "label": _("Entries"), "fieldtype": "Int", "width": 80},
+        {"fieldname": "planned_qty", "label": _("Planned Qty"), "fieldtype": "Float", "width": 110},
+        {"fieldname": "actual_qty", "label": _("Actual Qty"), "fieldtype": "Float", "width": 110},
+        {"fieldname": "scrap_qty", "label": _("Scrap Qty"), "fieldtype": "Float", "width": 100},
+        {"fieldname": "yield_pct", "label": _("Yield %"), "fieldtype": "Percent", "width": 90},
+        {"fieldname": "rm_planned_cost", "label": _("Planned RM Cost"), "fieldtype": "Currency", "width": 130},
+        {"fieldname": "rm_actual_cost", "label": _("Actual RM Cost"), "fieldtype": "Currency", "width": 130},
+        {"fieldname": "rm_variance", "label": _("RM Variance"), "fieldtype": "Currency", "width": 120},
+        {"fieldname": "rm_variance_pct", "label": _("RM Variance %"), "fieldtype": "Percent", "width": 110},
+    ]
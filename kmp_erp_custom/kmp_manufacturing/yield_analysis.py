@@ -0,0 +1,206 @@
+"""
+KMP Manufacturing - Yield analysis
+
+``KMP Yield Daily`` holds one row per posting date and BOM with the totals
+of the submitted Manufacture Stock Entries: planned output
+(``fg_completed_qty``), actual finished and scrap output, and the raw
+material cost planned by the BOM vs actually consumed. Submitting or
+cancelling an entry adds or subtracts its own totals in the same
+transaction (``doc_events``, see hooks.py), and ``backfill`` rebuilds the
+rows from history a chunk of days at a time. Reports and the assistant
+read only these rows.
+
+Planned raw material cost uses the BOM's cost at the time the entry is
+submitted or cancelled, so a BOM cost update in between leaves a small
+drift in that day's row until the next backfill.
+"""
+import frappe
+from frappe.utils import add_days, cint, flt, getdate, now, nowdate
+
+YIELD_DOCTYPE = "KMP Yield Daily"
+TOTAL_FIELDS = ("entries", "planned_qty", "actual_qty", "scrap_qty", "rm_planned_cost", "rm_actual_cost")
+BACKFILL_CHUNK_DAYS = 30
+DEFAULT_DAYS = 30
+
+GROUP_BY = {
+    "item": ["item_code"],
+    "bom": ["item_code", "bom"],
+    "day": ["posting_date"],
+    "item_day": ["posting_date", "item_code"],
+}
+
+
+def _bucket_name(posting_date, bom: str) -> str:
+    return f"{bom}-{getdate(posting_date)}"
+
+
+def _write(buckets: list[dict], sign: int = 1):
+    """Add (``sign`` = 1) or subtract (-1) bucket totals, creating rows as needed"""
+    timestamp, user = now(), frappe.session.user
+    for bucket in buckets:
+        values = {f: flt(bucket.get(f)) * sign for f in TOTAL_FIELDS}
+        values.update(
+            name=_bucket_name(bucket["posting_date"], bucket["bom"]),
+            posting_date=bucket["posting_date"],
+            item_code=bucket["item_code"],
+            bom=bucket["bom"],
+            company=bucket.get("company"),
+            now=timestamp,
+            user=user,
+        )
+        frappe.db.sql(f"""
+            INSERT INTO `tab{YIELD_DOCTYPE}` (name, creation, modified, owner, modified_by, docstatus, idx,
+                posting_date, item_code, bom, company, {", ".join(TOTAL_FIELDS)})
+            VALUES (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0, 0,
+                %(posting_date)s, %(item_code)s, %(bom)s, %(company)s, {", ".join(f"%({f})s" for f in TOTAL_FIELDS)})
+            ON DUPLICATE KEY UPDATE modified = VALUES(modified),
+                {", ".join(f"{f} = {f} + VALUES({f})" for f in TOTAL_FIELDS)}
+        """, values)
+        if sign < 0:
+            frappe.db.sql(
+                f"DELETE FROM `tab{YIELD_DOCTYPE}` WHERE name = %s AND entries <= 0", values["name"]
+            )
+
+
+# ---------------------------------------------------------------------------
+# Incremental updates
+# ---------------------------------------------------------------------------
+
+def _entry_bucket(doc) -> dict | None:
+    if doc.purpose != "Manufacture" or not doc.bom_no:
+        return None
+    bom = frappe.db.get_value(
+        "BOM", doc.bom_no, ["item", "quantity", "base_raw_material_cost"], as_dict=True
+    )
+    if not bom:
+        return None
+
+    bucket = {
+        "posting_date": doc.posting_date,
+        "item_code": bom.item,
+        "bom": doc.bom_no,
+        "company": doc.company,
+        "entries": 1,
+        "planned_qty": flt(doc.fg_completed_qty),
+        "rm_planned_cost": flt(doc.fg_completed_qty) * flt(bom.base_raw_material_cost) / (flt(bom.quantity) or 1),
+        "actual_qty": 0.0,
+        "scrap_qty": 0.0,
+        "rm_actual_cost": 0.0,
+    }
+    for row in doc.items:
+        if row.is_finished_item:
+            bucket["actual_qty"] += flt(row.transfer_qty)
+        elif row.is_scrap_item:
+            bucket["scrap_qty"] += flt(row.transfer_qty)
+        elif row.s_warehouse:
+            bucket["rm_actual_cost"] += flt(row.basic_amount)
+    return bucket
+
+
+def update_from_stock_entry(doc, method=None):
+    """doc_events handler (Stock Entry on_submit / on_cancel)"""
+    bucket = _entry_bucket(doc)
+    if bucket:
+        _write([bucket], -1 if method == "on_cancel" else 1)
+
+
+# ---------------------------------------------------------------------------
+# Backfill
+# ---------------------------------------------------------------------------
+
+def compute_buckets(from_date, to_date) -> list[dict]:
+    """Totals of the submitted Manufacture entries in [from_date, to_date]
+    per posting date and BOM, with the same rules as ``_entry_bucket``"""
+    return frappe.db.sql("""
+        SELECT se.posting_date, se.bom_no AS bom, b.item AS item_code, MAX(se.company) AS company,
+            COUNT(*) AS entries,
+            SUM(se.fg_completed_qty) AS planned_qty,
+            SUM(se.fg_completed_qty * b.base_raw_material_cost / IF(b.quantity > 0, b.quantity, 1)) AS rm_planned_cost,
+            SUM(d.actual_qty) AS actual_qty,
+            SUM(d.scrap_qty) AS scrap_qty,
+            SUM(d.rm_actual_cost) AS rm_actual_cost
+        FROM `tabStock Entry` se
+        JOIN `tabBOM` b ON b.name = se.bom_no
+        JOIN (
+            SELECT sed.parent,
+                SUM(IF(sed.is_finished_item = 1, sed.transfer_qty, 0)) AS actual_qty,
+                SUM(IF(sed.is_finished_item = 0 AND sed.is_scrap_item = 1, sed.transfer_qty, 0)) AS scrap_qty,
+                SUM(IF(sed.is_finished_item = 0 AND sed.is_scrap_item = 0 AND IFNULL(sed.s_warehouse, '') != '',
+                    sed.basic_amount, 0)) AS rm_actual_cost
+            FROM `tabStock Entry Detail` sed
+            JOIN `tabStock Entry` e ON e.name = sed.parent
+            WHERE sed.parenttype = 'Stock Entry' AND e.docstatus = 1 AND e.purpose = 'Manufacture'
+                AND e.posting_date BETWEEN %(from_date)s AND %(to_date)s
+            GROUP BY sed.parent
+        ) d ON d.parent = se.name
+        WHERE se.docstatus = 1 AND se.purpose = 'Manufacture'
+            AND se.posting_date BETWEEN %(from_date)s AND %(to_date)s
+        GROUP BY se.posting_date, se.bom_no, b.item
+    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
+
+
+def backfill(from_date=None, chunk_days: int = BACKFILL_CHUNK_DAYS):
+    """Rebuild the yield rows from submitted Manufacture entries, one chunk
+    of days per query and commit.
+
+    bench --site <site> execute kmp_erp_custom.kmp_manufacturing.yield_analysis.backfill
+    """
+    first, last = frappe.db.sql("""
+        SELECT MIN(posting_date), MAX(posting_date) FROM `tabStock Entry`
+        WHERE docstatus = 1 AND purpose = 'Manufacture'
+    """)[0]
+    if not first:
+        return
+    start = getdate(from_date) if from_date else getdate(first)
+    last = getdate(last)
+    while start <= last:
+        end = min(add_days(start, cint(chunk_days) - 1), last)
+        frappe.db.delete(YIELD_DOCTYPE, {"posting_date": ["between", [start, end]]})
+        _write(compute_buckets(start, end))
+        frappe.db.commit()
+        start = add_days(end, 1)
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def get_yield(
+    from_date=None,
+    to_date=None,
+    item_code: str = None,
+    bom: str = None,
+    company: str = None,
+    group_by: str = "item",
+    limit: int = None,
+) -> list[dict]:
+    """Yield and raw material variance over [from_date, to_date] (default:
+    the last 30 days), summed per ``group_by`` (item, bom, day, item_day)"""
+    to_date = getdate(to_date or nowdate())
+    from_date = getdate(from_date) if from_date else add_days(to_date, -(DEFAULT_DAYS - 1))
+    filters = {"posting_date": ["between", [from_date, to_date]]}
+    if item_code:
+        filters["item_code"] = item_code
+    if bom:
+        filters["bom"] = bom
+    if company:
+        filters["company"] = company
+
+    group = GROUP_BY.get(group_by, GROUP_BY["item"])
+    rows = frappe.get_list(
+        YIELD_DOCTYPE,
+        filters=filters,
+        fields=[*group, *(f"sum({f}) as {f}" for f in TOTAL_FIELDS)],
+        group_by=", ".join(group),
+        order_by=", ".join(group),
+        limit_page_length=cint(limit),
+    )
+    for row in rows:
+        planned, actual = flt(row.planned_qty), flt(row.actual_qty)
+        row.entries = cint(row.entries)
+        row.yield_pct = flt(actual / planned * 100, 2) if planned else None
+        row.rm_variance = flt(flt(row.rm_actual_cost) - flt(row.rm_planned_cost), 2)
+        row.rm_variance_pct = (
+            flt(row.rm_variance / flt(row.rm_planned_cost) * 100, 2) if flt(row.rm_planned_cost) else None
+        )
+    return rows
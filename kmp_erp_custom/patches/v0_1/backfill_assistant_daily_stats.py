@@ -0,0 +1,6 @@
+from kmp_erp_custom.kmp_assistant.analytics import backfill
+
+
+def execute():
+    """Materialize KMP Assistant Daily Stats for existing chat history"""
+    backfill()
@@ -0,0 +1,36 @@
+import frappe
+
+from kmp_erp_custom.kmp_assistant.api import PREVIEW_LENGTH
+
+
+def execute():
+    """Fill preview, message_count, last_message_at and last_role on existing
+    KMP Chat Sessions from their messages"""
+    frappe.db.sql("""
+        UPDATE `tabKMP Chat Session` s
+        JOIN (
+            SELECT parent, COUNT(*) AS message_count, MAX(idx) AS last_idx, MAX(creation) AS last_message_at
+            FROM `tabKMP Chat Message`
+            WHERE parenttype = 'KMP Chat Session' AND parentfield = 'messages'
+            GROUP BY parent
+        ) agg ON agg.parent = s.name
+        JOIN `tabKMP Chat Message` lm ON lm.parent = agg.parent AND lm.idx = agg.last_idx
+            AND lm.parenttype = 'KMP Chat Session'
+        SET s.message_count = agg.message_count,
+            s.last_message_at = agg.last_message_at,
+            s.last_role = lm.role
+    """)
+
+    frappe.db.sql("""
+        UPDATE `tabKMP Chat Session` s
+        JOIN (
+            SELECT parent, MIN(idx) AS first_idx
+            FROM `tabKMP Chat Message`
+            WHERE parenttype = 'KMP Chat Session' AND parentfield = 'messages' AND role = 'user'
+            GROUP BY parent
+        ) agg ON agg.parent = s.name
+        JOIN `tabKMP Chat Message` fm ON fm.parent = agg.parent AND fm.idx = agg.first_idx
+            AND fm.parenttype = 'KMP Chat Session'
+        SET s.preview = LEFT(fm.content, %s)
+        WHERE IFNULL(s.preview, '') = ''
+    """, PREVIEW_LENGTH)
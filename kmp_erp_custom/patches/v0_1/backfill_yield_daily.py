@@ -0,0 +1,6 @@
+from kmp_erp_custom.kmp_manufacturing.yield_analysis import backfill
+
+
+def execute():
+    """Build KMP Yield Daily from existing Manufacture Stock Entries"""
+    backfill()
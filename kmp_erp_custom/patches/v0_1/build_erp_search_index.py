@@ -0,0 +1,6 @@
+from kmp_erp_custom.kmp_assistant.erp_search import rebuild
+
+
+def execute():
+    """Build the KMP Assistant search index over existing master data"""
+    rebuild()
@@ -130,6 +130,10 @@
             this.style.height = Math.min(this.scrollHeight, 100) + 'px';
         });
 
+        if (frappe.realtime) {
+            frappe.realtime.on('kmp_assistant_stream', onStreamEvent);
+        }
+
         // If we have a stored session, load it
         if (sessionName) {
             loadSession(sessionName);
@@ -287,6 +291,7 @@
                 if (!r.message) return;
                 sessionName = r.message.session_id;
                 saveSession();
+                subscribeSession(sessionName);
                 botMessageIndex = 0;
                 const messages = document.getElementById('kmp-chat-messages');
                 messages.innerHTML = '';
@@ -318,6 +323,104 @@
         if (el) el.remove();
     }
 
+    // Streaming: tokens arrive over the session's realtime room while the
+    // chat request is still in flight.
+    let streamDiv = null;
+    let streamText = '';
+    let subscribedSession = null;
+
+    function subscribeSession(sid) {
+        if (!sid || subscribedSession === sid || !frappe.realtime) return;
+        if (subscribedSession) frappe.realtime.doc_unsubscribe('KMP Chat Session', subscribedSession);
+        frappe.realtime.doc_subscribe('KMP Chat Session', sid);
+        subscribedSession = sid;
+    }
+
+    function setStreamContent(text) {
+        if (!streamDiv) {
+            removeLoadingMessage();
+            streamDiv = addMessage('', false);
+        }
+        streamText = text;
+        streamDiv.querySelector('.kmp-msg-content').innerHTML = escapeHtml(text).replace(/\n/g, '<br>');
+        const messages = document.getElementById('kmp-chat-messages');
+        messages.scrollTop = messages.scrollHeight;
+    }
+
+    function onStreamEvent(data) {
+        if (!data || data.session_id !== sessionName || !isLoading) return;
+        if (data.type === 'delta') {
+            setStreamContent(streamText + data.text);
+        } else if (data.type === 'reset' && streamDiv) {
+            streamDiv.remove();
+            streamDiv = null;
+            streamText = '';
+            addLoadingMessage();
+        } else if (data.type === 'tool' && !streamDiv) {
+            const loading = document.querySelector('#kmp-loading-msg .kmp-typing');
+            if (loading) loading.firstChild.textContent = 'กำลังค้นหาข้อมูล';
+        } else if (data.type === 'done') {
+            setStreamContent(data.text);
+            settleTurn({ status: 'done', response: data.text });
+        } else if (data.type === 'error') {
+            settleTurn({ status: 'error', error: data.text });
+        }
+    }
+
+    // Background turns: the chat call returns a job id straight away and the
+    // reply arrives over realtime, with polling as a fallback when the
+    // socket is down or the final event was missed.
+    const TURN_POLL_INTERVAL = 2500;
+    let pendingTurn = null;
+
+    function settleTurn(result) {
+        if (!pendingTurn) return;
+        const turn = pendingTurn;
+        pendingTurn = null;
+        clearInterval(turn.timer);
+        turn.resolve(result);
+    }
+
+    function waitForTurn(jobId) {
+        return new Promise((resolve) => {
+            const turn = { resolve: resolve, timer: null };
+            turn.timer = setInterval(async () => {
+                try {
+                    const r = await frappe.call({
+                        method: 'kmp_erp_custom.kmp_assistant.api.get_turn_result',
+                        args: { job_id: jobId },
+                        async: true
+                    });
+                    const state = r && r.message;
+                    if (pendingTurn === turn && state && ['done', 'error', 'unknown'].includes(state.status)) {
+                        settleTurn(state);
+                    }
+                } catch (e) {
+                    // keep polling; the next tick may succeed
+                }
+            }, TURN_POLL_INTERVAL);
+            pendingTurn = turn;
+        });
+    }
+
+    function discardStreamMessage() {
+        const had = !!streamDiv;
+        if (streamDiv) streamDiv.remove();
+        streamDiv = null;
+        streamText = '';
+        return had;
+    }
+
+    async function ensureSession() {
+        if (sessionName) return;
+        const r = await frappe.call({
+            method: 'kmp_erp_custom.kmp_assistant.api.create_session',
+            async: true
+        });
+        sessionName = r.message.session_id;
+        saveSession();
+    }
+
     async function sendMessage() {
         if (isLoading) return;
         const input = document.getElementById('kmp-chat-input');
@@ -333,28 +436,41 @@
         addLoadingMessage();
 
         try {
+            await ensureSession();
+            subscribeSession(sessionName);
+
             const response = await frappe.call({
                 method: 'kmp_erp_custom.kmp_assistant.api.chat',
                 args: {
                     message: message,
-                    session_id: sessionName
+                    session_id: sessionName,
+                    background: 1
                 },
                 async: true
             });
 
+            const queued = response && response.message;
+            const result = queued && queued.job_id
+                ? await waitForTurn(queued.job_id)
+                : queued;
+
             removeLoadingMessage();
 
-            if (response && response.message) {
-                const data = response.message;
-                sessionName = data.session_id || sessionName;
+            if (result && result.status !== 'error' && result.status !== 'unknown') {
+                sessionName = (queued && queued.session_id) || sessionName;
                 saveSession();
                 botMessageIndex++;
-                addMessage(data.response || 'ขออภัยครับ ไม่สามารถตอบได้ในขณะนี้', false, botMessageIndex);
+                const reply = result.response || 'ขออภัยครับ ไม่สามารถตอบได้ในขณะนี้';
+                // Replace the streamed bubble with the saved reply (adds feedback buttons)
+                discardStreamMessage();
+                addMessage(reply, false, botMessageIndex);
             } else {
-                addMessage('ขออภัยครับ เกิดข้อผิดพลาด กรุณาลองใหม่', false);
+                discardStreamMessage();
+                addMessage((result && result.error) || 'ขออภัยครับ เกิดข้อผิดพลาด กรุณาลองใหม่', false);
             }
         } catch (err) {
             removeLoadingMessage();
+            discardStreamMessage();
             console.error('KMP Assistant Error:', err);
             addMessage('ขออภัยครับ เกิดข้อผิดพลาด: ' + (err.message || 'กรุณาลองใหม่'), false);
         }